@@ -0,0 +1 @@
+"""module for offline benchmarks of the hot paths , every benchmark is runnable as `python -m benchmarks.<name>`"""
@@ -0,0 +1,81 @@
+"""benchmark of request latency on the event loop while ticks are flowing , blocking Cache vs AsyncCache
+price requests (HMGET of a slice of tokens) arrive at a fixed rate while a tick coroutine writes batches of prices.
+Along with them light requests that do not touch redis (like /status) arrive at a fixed rate , their latency is
+the time they wait for the event loop , which is where blocking redis calls show up.
+needs redis at REDIS_URL , benchmark only touches keys prefixed with BENCH_
+command to run - 'python -m benchmarks.async_redis_bench'"""
+import asyncio
+import random
+import time
+from typing import List
+
+from benchmarks.utils import percentiles
+from data_adapter.async_redis import AsyncCache
+from data_adapter.redis import Cache
+
+PRICE_KEY = "BENCH_ENTITY_PRICE_DATA"
+UNIVERSE = 20000
+TOKENS_PER_REQUEST = 500
+PRICE_REQUESTS_PER_SEC = 200
+LIGHT_REQUESTS_PER_SEC = 200
+TICK_BATCH = 1000
+TICK_INTERVAL_SEC = 0.01
+DURATION_SEC = 10
+
+
+async def write_ticks(mode: str, until: float):
+    while time.perf_counter() < until:
+        mapping = {str(random.randrange(UNIVERSE)): random.random() * 1000 for _ in range(TICK_BATCH)}
+        if mode == "sync":
+            Cache.get_instance().hset(PRICE_KEY, mapping)
+        else:
+            await AsyncCache.get_instance().hset(PRICE_KEY, mapping)
+        await asyncio.sleep(TICK_INTERVAL_SEC)
+
+
+async def price_request(mode: str, scheduled_at: float, latencies_ms: List[float]):
+    offset = random.randrange(UNIVERSE - TOKENS_PER_REQUEST)
+    fields = [str(token) for token in range(offset, offset + TOKENS_PER_REQUEST)]
+    if mode == "sync":
+        Cache.get_instance().hmget(PRICE_KEY, fields)
+    else:
+        await AsyncCache.get_instance().hmget(PRICE_KEY, fields)
+    latencies_ms.append((time.perf_counter() - scheduled_at) * 1000)
+
+
+async def light_request(scheduled_at: float, latencies_ms: List[float]):
+    latencies_ms.append((time.perf_counter() - scheduled_at) * 1000)
+
+
+async def arrive(rate: int, until: float, make_request):
+    """open loop arrivals , latency is measured from the time a request was due and not from when it started"""
+    interval = 1 / rate
+    scheduled_at = time.perf_counter()
+    tasks = []
+    while scheduled_at < until:
+        tasks.append(asyncio.create_task(make_request(scheduled_at)))
+        scheduled_at += interval
+        await asyncio.sleep(max(0.0, scheduled_at - time.perf_counter()))
+    await asyncio.gather(*tasks)
+
+
+async def run_mode(mode: str) -> dict:
+    until = time.perf_counter() + DURATION_SEC
+    price_latencies_ms: List[float] = []
+    light_latencies_ms: List[float] = []
+    await asyncio.gather(
+        write_ticks(mode, until),
+        arrive(PRICE_REQUESTS_PER_SEC, until, lambda at: price_request(mode, at, price_latencies_ms)),
+        arrive(LIGHT_REQUESTS_PER_SEC, until, lambda at: light_request(at, light_latencies_ms)))
+    return {"price_request_latency_ms": percentiles(price_latencies_ms),
+            "light_request_latency_ms": percentiles(light_latencies_ms)}
+
+
+async def run():
+    await AsyncCache.get_instance().hset(PRICE_KEY, {str(token): 1.0 for token in range(UNIVERSE)})
+    for mode in ("sync", "async"):
+        print(f"{mode} : {await run_mode(mode)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+"""benchmark of inserting derivatives , orm add_all vs bulk upsert (multi row insert ... on conflict)
+needs postgres at DB_HOST , every run happens in a transaction that is rolled back so db is left untouched
+command to run - 'python -m benchmarks.bulk_upsert_bench'"""
+import time
+from datetime import date, timedelta
+
+from controller.context_manager import context_db_session
+from data_adapter.db import SessionLocal
+from data_adapter.sensi_data import SensiUnderlying, SensiDerivative
+from models.sensi_models import SensiBrokerResModel
+
+DERIVATIVES = 100000
+
+
+def build_derivatives(prefix: str):
+    return [SensiBrokerResModel(token=f"{prefix}{i}", symbol=f"BENCH{i}", underlying="BENCH",
+                                instrument_type="CE" if i % 2 else "PE", expiry=date.today() + timedelta(days=i % 30),
+                                strike=100 + i) for i in range(DERIVATIVES)]
+
+
+def run_mode(mode: str) -> float:
+    db = SessionLocal()
+    context_db_session.set(db)
+    try:
+        SensiUnderlying.bulk_upsert([SensiBrokerResModel(token="BENCH_UNDERLYING", symbol="BENCH").build_db_row()])
+        underlying_id = db.query(SensiUnderlying.id).filter(SensiUnderlying.token == "BENCH_UNDERLYING").scalar()
+        derivatives = build_derivatives(f"BENCH_{mode}_")
+        start = time.perf_counter()
+        if mode == "orm":
+            db.add_all([SensiDerivative(**derivative.build_db_row(underlying_id=underlying_id))
+                        for derivative in derivatives])
+            db.flush()
+        else:
+            SensiDerivative.bulk_upsert([derivative.build_db_row(underlying_id=underlying_id)
+                                         for derivative in derivatives])
+        return time.perf_counter() - start
+    finally:
+        db.rollback()
+        db.close()
+
+
+def run():
+    for mode in ("orm", "bulk_upsert"):
+        elapsed = run_mode(mode)
+        print(f"{mode} : {DERIVATIVES} derivatives in {elapsed:.3f} s ({DERIVATIVES / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    run()
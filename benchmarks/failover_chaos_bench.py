@@ -0,0 +1,136 @@
+"""chaos benchmark of node failure detection and recovery
+starts a fake broker ws and NODES ingest processes ('python -m server.ingest') sharing TOKENS tokens , then kills
+one node per round , alternately with SIGKILL (crash , detected when its heartbeat expires) and SIGTERM (graceful ,
+heartbeat is dropped on shutdown). Detection is the time from the kill till the node is removed from
+NODE_IDS_IN_CLUSTER by the node that took it over , recovery is the time till every token of the killed node has a
+tick written after the kill (ENTITY_PRICE_UPDATED_AT) by its new owner.
+needs a scratch redis at REDIS_URL , nodes of the benchmark register in its cluster keys like real nodes do
+command to run - 'python -m benchmarks.failover_chaos_bench'"""
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set
+
+import websockets
+
+from benchmarks.utils import percentiles
+from config.constants import RedisKeys
+from config.settings import ShardConfig
+from data_adapter.redis import Cache
+from usecases.shard_usecase import ShardUseCase
+
+NODES = 4
+TOKENS = 2000
+BROKER_PORT = 18765
+TICK_INTERVAL_SEC = 0.1
+PING_INTERVAL_SEC = 1
+READY_TIMEOUT_SEC = 30
+ROUND_TIMEOUT_SEC = 30
+POLL_INTERVAL_SEC = 0.01
+
+
+class FakeBroker:
+    """ticks every subscribed token of every connection each TICK_INTERVAL_SEC and pings every PING_INTERVAL_SEC"""
+
+    def __init__(self):
+        self.subscriptions: Dict[object, Set[str]] = {}
+
+    async def handler(self, ws, path=None):
+        self.subscriptions[ws] = set()
+        ticker = asyncio.create_task(self.tick(ws))
+        try:
+            async for message in ws:
+                command = json.loads(message)
+                tokens = {str(token) for token in command.get("tokens", [])}
+                if command.get("msg_command") == "subscribe":
+                    self.subscriptions[ws] |= tokens
+                elif command.get("msg_command") == "unsubscribe":
+                    self.subscriptions[ws] -= tokens
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            ticker.cancel()
+            self.subscriptions.pop(ws, None)
+
+    async def tick(self, ws):
+        pinged_at = 0.0
+        while True:
+            await asyncio.sleep(TICK_INTERVAL_SEC)
+            for token in list(self.subscriptions.get(ws, ())):
+                await ws.send(json.dumps({"data_type": "quote", "payload": {
+                    "token": token, "price": round(random.uniform(1, 1000), 2)}}))
+            if time.time() - pinged_at >= PING_INTERVAL_SEC:
+                await ws.send(json.dumps({"data_type": "ping"}))
+                pinged_at = time.time()
+
+
+def start_node(node_id: str) -> subprocess.Popen:
+    env = {**os.environ, "NODE_ID": node_id, "BROKER_WS_URL": f"ws://127.0.0.1:{BROKER_PORT}",
+           "TICK_HISTORY_ENABLED": "0", "PRICE_BOARD_PATH": ""}
+    return subprocess.Popen([sys.executable, "-m", "server.ingest"], env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+async def wait_for(condition, timeout: float) -> float:
+    """seconds till condition is true"""
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise TimeoutError("condition not met in time")
+        await asyncio.sleep(POLL_INTERVAL_SEC)
+    return time.time() - start
+
+
+def ticked_after(tokens: List[str], after: float) -> bool:
+    updated_at = Cache.get_instance().zmscore(RedisKeys.ENTITY_PRICE_UPDATED_AT, tokens)
+    return all(token_updated_at is not None and token_updated_at > after for token_updated_at in updated_at)
+
+
+async def run():
+    broker = FakeBroker()
+    server = await websockets.serve(broker.handler, "127.0.0.1", BROKER_PORT)
+    node_ids = [f"chaos-node-{os.getpid()}-{i}" for i in range(NODES)]
+    processes = {node_id: start_node(node_id) for node_id in node_ids}
+    results: Dict[str, List[dict]] = {"kill": [], "term": []}
+    try:
+        await wait_for(lambda: set(node_ids) <= set(ShardUseCase.get_live_node_ids()), READY_TIMEOUT_SEC)
+        tokens = [str(100000 + i) for i in range(TOKENS)]
+        assigned_at = time.time()
+        ShardUseCase.assign_tokens(tokens)
+        ready_sec = await wait_for(lambda: ticked_after(tokens, assigned_at), READY_TIMEOUT_SEC)
+        print(f"{NODES} nodes , {TOKENS} tokens ticking in {ready_sec:.2f} sec , heartbeat every "
+              f"{ShardConfig.heartbeat_interval_ms} ms , ttl {ShardConfig.heartbeat_ttl_ms} ms")
+        for round_index in range(NODES - 1):
+            mode = "kill" if round_index % 2 == 0 else "term"
+            live_node_ids = set(node_ids) & set(ShardUseCase.get_live_node_ids())
+            victim = max(live_node_ids, key=lambda node_id: Cache.get_instance().scard(
+                RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(node_id)))
+            victim_tokens = list(Cache.get_instance().smembers(RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(victim)))
+            killed_at = time.time()
+            processes[victim].send_signal(signal.SIGKILL if mode == "kill" else signal.SIGTERM)
+            detection_sec = await wait_for(lambda: victim not in Cache.get_instance().hkeys(
+                RedisKeys.NODE_IDS_IN_CLUSTER), ROUND_TIMEOUT_SEC)
+            recovery_sec = await wait_for(lambda: ticked_after(victim_tokens, killed_at), ROUND_TIMEOUT_SEC) + \
+                detection_sec
+            results[mode].append({"detection_ms": detection_sec * 1000, "recovery_ms": recovery_sec * 1000})
+            print(f"round {round_index + 1} : {mode} {victim} owning {len(victim_tokens)} tokens , detected in "
+                  f"{detection_sec * 1000:.0f} ms , ticking again in {recovery_sec * 1000:.0f} ms")
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            process.wait()
+        server.close()
+    for mode, mode_results in results.items():
+        print(f"{mode} : detection {percentiles([result['detection_ms'] for result in mode_results])} , "
+              f"recovery {percentiles([result['recovery_ms'] for result in mode_results])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
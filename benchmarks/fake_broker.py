@@ -0,0 +1,256 @@
+"""fake broker for load tests , serves instruments over REST the way broker integration fetches them and quotes over
+ws the way broker ws listener reads them
+REST (/underlyings , /derivatives/{underlying_token}) serves UNDERLYINGS underlyings with DERIVATIVES_PER_UNDERLYING
+options each (CE / PE over weekly expiries and strikes around the underlying price) in broker payload format. Ws
+keeps subscriptions of every connection , sends TICK_RATE quotes/sec spread over all subscribed tokens and pings
+every connection every PING_INTERVAL_SEC. Universe and tick rate are configurable , the universe can be rolled (some
+derivatives replaced by new ones) to drive incremental syncs.
+app can be pointed at a standalone fake broker with BROKER_INTEGRATION_URL=http://127.0.0.1:{REST_PORT} and
+BROKER_WS_URL=ws://127.0.0.1:{WS_PORT}
+command to run - 'python -m benchmarks.fake_broker'"""
+import asyncio
+import math
+import random
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import orjson
+import uvicorn
+import websockets
+from fastapi import FastAPI
+
+UNDERLYINGS = 20
+DERIVATIVES_PER_UNDERLYING = 200
+EXPIRIES = 4
+TICK_RATE = 2000
+REST_PORT = 18767
+WS_PORT = 18768
+PING_INTERVAL_SEC = 1
+TICK_INTERVAL_SEC = 0.01
+UNDERLYING_TOKEN_BASE = 10000
+DERIVATIVE_TOKEN_BASE = 1000000
+# probe prices are above any price of a tick , so a probe is told apart from ticks downstream
+PROBE_PRICE_BASE = 10000000
+
+
+class FakeBroker:
+    """instrument universe , ws subscriptions and tick generator of the fake broker"""
+
+    def __init__(self, underlyings: int = UNDERLYINGS, derivatives_per_underlying: int = DERIVATIVES_PER_UNDERLYING,
+                 tick_rate: int = 0):
+        self.tick_rate = tick_rate
+        self.underlyings: List[dict] = []
+        self.derivatives: Dict[str, List[dict]] = {}
+        self.prices: Dict[str, float] = {}
+        self.subscriptions: Dict[object, Set[str]] = {}
+        # subscribed tokens of every connection as lists for sampling , rebuilt after subscriptions change
+        self.__sampling: Dict[object, List[str]] = {}
+        self.__next_derivative_token = DERIVATIVE_TOKEN_BASE
+        self.__next_derivative_seq: Dict[str, int] = {}
+        self.__probe_seq = 0
+        self.counters: Dict[str, int] = {"ticks_sent": 0, "probes_sent": 0, "rest_requests": 0, "connections": 0}
+        self.__build_universe(underlyings, derivatives_per_underlying)
+
+    def __build_universe(self, underlyings: int, derivatives_per_underlying: int) -> None:
+        for i in range(underlyings):
+            token = str(UNDERLYING_TOKEN_BASE + i)
+            self.underlyings.append({"token": token, "symbol": f"SYM{i}", "underlying": f"SYM{i}",
+                                     "instrument_type": "", "expiry": "", "strike": 0})
+            self.prices[token] = 1000.0 + 100 * i
+            self.__next_derivative_seq[token] = 0
+            self.derivatives[token] = [self.__build_derivative(i, token, derivatives_per_underlying)
+                                       for _ in range(derivatives_per_underlying)]
+
+    def __build_derivative(self, underlying_index: int, underlying_token: str, derivatives_per_underlying: int) -> dict:
+        """next derivative of the underlying , CE and PE of every strike of an expiry before the next expiry"""
+        strikes_per_expiry = max(1, math.ceil(derivatives_per_underlying / (2 * EXPIRIES)))
+        seq = self.__next_derivative_seq[underlying_token]
+        self.__next_derivative_seq[underlying_token] += 1
+        today = date.today()
+        expiry = today + timedelta(days=(3 - today.weekday()) % 7 or 7) + timedelta(
+            weeks=seq // (2 * strikes_per_expiry))
+        underlying_price = 1000.0 + 100 * underlying_index
+        step = underlying_price / 100
+        strike = round(underlying_price + step * ((seq // 2) % strikes_per_expiry - strikes_per_expiry // 2), 2)
+        instrument_type = "CE" if seq % 2 == 0 else "PE"
+        token = str(self.__next_derivative_token)
+        self.__next_derivative_token += 1
+        self.prices[token] = round(random.uniform(1, 500), 2)
+        return {"token": token, "symbol": f"SYM{underlying_index}{expiry:%y%b}{strike:g}{instrument_type}".upper(),
+                "underlying": f"SYM{underlying_index}", "instrument_type": instrument_type,
+                "expiry": expiry.isoformat(), "strike": strike}
+
+    def roll_derivatives(self, fraction: float) -> Tuple[List[str], List[str]]:
+        """replace fraction of derivatives of every underlying by new ones of a later expiry , like contracts expiring
+        and new ones being listed
+        :return tokens removed , tokens added"""
+        removed, added = [], []
+        for i, underlying in enumerate(self.underlyings):
+            derivatives = self.derivatives[underlying["token"]]
+            count = int(len(derivatives) * fraction)
+            removed.extend(derivative["token"] for derivative in derivatives[:count])
+            new_derivatives = [self.__build_derivative(i, underlying["token"], len(derivatives)) for _ in range(count)]
+            added.extend(derivative["token"] for derivative in new_derivatives)
+            self.derivatives[underlying["token"]] = derivatives[count:] + new_derivatives
+        for token in removed:
+            self.prices.pop(token, None)
+        return removed, added
+
+    def get_tokens(self) -> List[str]:
+        """every token of the universe"""
+        return [underlying["token"] for underlying in self.underlyings] + [
+            derivative["token"] for derivatives in self.derivatives.values() for derivative in derivatives]
+
+    def build_rest_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/underlyings")
+        async def underlyings():
+            self.counters["rest_requests"] += 1
+            return {"success": True, "payload": self.underlyings}
+
+        @app.get("/derivatives/{underlying_token}")
+        async def derivatives(underlying_token: str):
+            self.counters["rest_requests"] += 1
+            if underlying_token not in self.derivatives:
+                return {"success": False, "payload": []}
+            return {"success": True, "payload": self.derivatives[underlying_token]}
+
+        return app
+
+    async def ws_handler(self, ws, path=None):
+        self.subscriptions[ws] = set()
+        self.counters["connections"] += 1
+        pinger = asyncio.create_task(self.ping(ws))
+        try:
+            async for message in ws:
+                command = orjson.loads(message)
+                tokens = {str(token) for token in command.get("tokens", [])}
+                if command.get("msg_command") == "subscribe":
+                    self.subscriptions[ws] |= tokens
+                elif command.get("msg_command") == "unsubscribe":
+                    self.subscriptions[ws] -= tokens
+                self.__sampling.pop(ws, None)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            pinger.cancel()
+            self.subscriptions.pop(ws, None)
+            self.__sampling.pop(ws, None)
+
+    @staticmethod
+    async def ping(ws):
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SEC)
+            await ws.send(orjson.dumps({"data_type": "ping"}).decode())
+
+    def get_subscribed_tokens(self) -> Set[str]:
+        """tokens subscribed on any open connection"""
+        return set().union(*self.subscriptions.values())
+
+    async def run_ticks(self):
+        """send tick_rate quotes/sec spread over subscribed tokens in proportion to subscriptions of every
+        connection , runs till cancelled. Quotes due while the loop was busy are sent late , up to a second of them"""
+        carry = 0.0
+        ticked_at = time.perf_counter()
+        while True:
+            await asyncio.sleep(TICK_INTERVAL_SEC)
+            now = time.perf_counter()
+            due = min(self.tick_rate * (now - ticked_at) + carry, self.tick_rate)
+            ticked_at = now
+            count = int(due)
+            carry = due - count
+            if count:
+                await self.send_ticks(count)
+
+    async def send_ticks(self, count: int) -> None:
+        for ws in list(self.subscriptions):
+            if ws not in self.__sampling:
+                self.__sampling[ws] = list(self.subscriptions.get(ws, ()))
+        total = sum(len(tokens) for tokens in self.__sampling.values())
+        if not total:
+            return
+        for ws, tokens in list(self.__sampling.items()):
+            if not tokens:
+                continue
+            try:
+                for token in random.choices(tokens, k=round(count * len(tokens) / total)):
+                    price = self.prices.get(token)
+                    if price is None:
+                        continue
+                    price = self.prices[token] = round(max(0.05, price * (1 + random.uniform(-0.001, 0.001))), 2)
+                    await ws.send(orjson.dumps({"data_type": "quote", "payload": {"token": token, "price": price}})
+                                  .decode())
+                    self.counters["ticks_sent"] += 1
+            except websockets.ConnectionClosed:
+                continue
+
+    async def send_probe(self) -> Optional[Tuple[str, float, float]]:
+        """quote of a random subscribed token with a price above any tick , for the caller to look for downstream
+        :return token , price and time it was sent at , None if nothing is subscribed"""
+        connections = [(ws, tokens) for ws, tokens in list(self.subscriptions.items()) if tokens]
+        if not connections:
+            return None
+        ws, tokens = random.choice(connections)
+        token = random.choice(list(tokens))
+        self.__probe_seq += 1
+        price = float(PROBE_PRICE_BASE + self.__probe_seq)
+        sent_at = time.time()
+        try:
+            await ws.send(orjson.dumps({"data_type": "quote", "payload": {"token": token, "price": price}}).decode())
+        except websockets.ConnectionClosed:
+            return None
+        self.counters["probes_sent"] += 1
+        return token, price, sent_at
+
+    async def start(self, rest_port: int = REST_PORT, ws_port: int = WS_PORT) -> "FakeBrokerServer":
+        """serve REST and ws on the running event loop"""
+        server = FakeBrokerServer(self)
+        await server.start(rest_port, ws_port)
+        return server
+
+
+class FakeBrokerServer:
+    """REST server (uvicorn) , ws server and tick generator of a fake broker on the running event loop"""
+
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.__rest_server: Optional[uvicorn.Server] = None
+        self.__rest_task: Optional[asyncio.Task] = None
+        self.__ws_server = None
+        self.__tick_task: Optional[asyncio.Task] = None
+
+    async def start(self, rest_port: int, ws_port: int) -> None:
+        self.__rest_server = uvicorn.Server(uvicorn.Config(self.broker.build_rest_app(), host="127.0.0.1",
+                                                           port=rest_port, log_level="warning", access_log=False))
+        # signals are left to the process running the broker
+        self.__rest_server.install_signal_handlers = lambda: None
+        self.__rest_task = asyncio.create_task(self.__rest_server.serve())
+        while not self.__rest_server.started:
+            if self.__rest_task.done():
+                raise RuntimeError(f"fake broker REST server could not start on port {rest_port}")
+            await asyncio.sleep(0.05)
+        self.__ws_server = await websockets.serve(self.broker.ws_handler, "127.0.0.1", ws_port)
+        self.__tick_task = asyncio.create_task(self.broker.run_ticks())
+
+    async def stop(self) -> None:
+        self.__tick_task.cancel()
+        self.__ws_server.close()
+        await self.__ws_server.wait_closed()
+        self.__rest_server.should_exit = True
+        await self.__rest_task
+
+
+async def run():
+    broker = FakeBroker(tick_rate=TICK_RATE)
+    await broker.start()
+    print(f"fake broker : {len(broker.underlyings)} underlyings , {len(broker.get_tokens())} tokens , {TICK_RATE} "
+          f"ticks/sec , BROKER_INTEGRATION_URL=http://127.0.0.1:{REST_PORT} BROKER_WS_URL=ws://127.0.0.1:{WS_PORT}")
+    while True:
+        await asyncio.sleep(10)
+        print(f"fake broker : {broker.counters} , subscribed tokens {len(broker.get_subscribed_tokens())}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
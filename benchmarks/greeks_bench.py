@@ -0,0 +1,78 @@
+"""benchmark of implied volatility and greeks of option chains , solver alone and end to end with encoding
+runs without db or redis
+command to run - 'python -m benchmarks.greeks_bench'"""
+import math
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from data_adapter.instrument_catalog import CatalogEntry
+from models.sensi_models import SensiResModel
+from usecases.analytics_usecase import AnalyticsUseCase
+from utils.option_greeks import implied_volatility, greeks
+
+CHAIN_SIZES = (1000, 5000, 10000)
+SPOT = 20000.0
+RATE = 0.065
+DURATION_SEC = 3
+
+
+def build_chain(size: int):
+    """calls and puts around spot over a few weekly expiries priced at a volatility smile"""
+    instruments, prices = [], []
+    for i in range(size):
+        strike = SPOT + 50 * (i // 2 % 400 - 200)
+        expiry = date.today() + timedelta(days=7 * (1 + i // 800))
+        is_call = i % 2 == 0
+        years = ((expiry - date.today()).days + 0.5) / 365
+        volatility = 0.15 + 0.1 * abs(math.log(strike / SPOT)) * 10
+        price = implied_price(strike, years, volatility, is_call)
+        instruments.append(SensiResModel(token=str(i), symbol=f"BENCH{i}", instrument_type="CE" if is_call else "PE",
+                                         expiry=expiry, strike=strike))
+        prices.append(price * random.uniform(0.999, 1.001))
+    return CatalogEntry(instruments, version_tag="bench"), prices
+
+
+def implied_price(strike: float, years: float, volatility: float, is_call: bool) -> float:
+    d1 = (math.log(SPOT / strike) + (RATE + volatility * volatility / 2) * years) / (volatility * math.sqrt(years))
+    d2 = d1 - volatility * math.sqrt(years)
+    cdf = lambda x: 0.5 * (1 + math.erf(x / math.sqrt(2)))  # noqa: E731
+    call = SPOT * cdf(d1) - strike * math.exp(-RATE * years) * cdf(d2)
+    return call if is_call else call - SPOT + strike * math.exp(-RATE * years)
+
+
+def run_solver(entry: CatalogEntry, prices) -> float:
+    strike, expires_at, is_call, _ = AnalyticsUseCase.get_option_inputs(entry)
+    years = np.maximum(expires_at - time.time(), 0) / (365 * 24 * 3600)
+    price = np.array(prices)
+    spot = np.full(len(prices), SPOT)
+    chains = 0
+    until = time.perf_counter() + DURATION_SEC
+    while time.perf_counter() < until:
+        volatility = implied_volatility(price, spot, strike, years, is_call, RATE)
+        greeks(spot, strike, years, volatility, is_call, RATE)
+        chains += 1
+    return chains / DURATION_SEC
+
+
+def run_end_to_end(entry: CatalogEntry, prices) -> float:
+    chains = 0
+    until = time.perf_counter() + DURATION_SEC
+    while time.perf_counter() < until:
+        # solved and encoded every time , snapshot cache is bypassed
+        AnalyticsUseCase.build_encoded_greeks(entry, prices, underlying_price=SPOT, valued_at=time.time())
+        chains += 1
+    return chains / DURATION_SEC
+
+
+def run():
+    for size in CHAIN_SIZES:
+        entry, prices = build_chain(size)
+        print(f"{size} strikes : solver {run_solver(entry, prices):.1f} chains/s , "
+              f"with encoding {run_end_to_end(entry, prices):.1f} chains/s")
+
+
+if __name__ == "__main__":
+    run()
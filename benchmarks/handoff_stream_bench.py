@@ -0,0 +1,182 @@
+"""benchmark of handing synced tokens over to nodes through handoff streams
+starts a fake broker ws and NODES ingest processes ('python -m server.ingest'). Burst phase hands BURST_TOKENS tokens
+over as fast as the worker can and measures tokens/sec till all of them are subscribed at the broker. Chaos phase hands
+CHAOS_TOKENS tokens over at a steady pace while a node is killed (SIGKILL) and started again with the same node id
+every KILL_INTERVAL_SEC , then checks that every token ends up subscribed on an open broker connection , ie no token
+handed over is lost. Nodes run with HANDOFF_RECLAIM_IDLE_MS of RECLAIM_IDLE_MS so that entries left pending by killed
+processes are reclaimed within the run.
+needs a scratch redis at REDIS_URL , nodes of the benchmark register in its cluster keys like real nodes do
+command to run - 'python -m benchmarks.handoff_stream_bench'"""
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set
+
+import websockets
+
+from benchmarks.utils import percentiles
+from usecases.shard_usecase import ShardUseCase
+
+NODES = 3
+BURST_TOKENS = 20000
+CHAOS_TOKENS = 20000
+BATCH_SIZE = 200
+CHAOS_BATCH_INTERVAL_SEC = 0.1
+KILL_INTERVAL_SEC = 2
+RECLAIM_IDLE_MS = 2000
+BROKER_PORT = 18766
+PING_INTERVAL_SEC = 1
+READY_TIMEOUT_SEC = 30
+SETTLE_TIMEOUT_SEC = 60
+POLL_INTERVAL_SEC = 0.2
+
+
+class FakeBroker:
+    """keeps subscriptions of every connection and time every token was first subscribed at , pings every
+    PING_INTERVAL_SEC so that nodes do not find connections silent"""
+
+    def __init__(self):
+        self.subscriptions: Dict[object, Set[str]] = {}
+        self.subscribed_at: Dict[str, float] = {}
+
+    async def handler(self, ws, path=None):
+        self.subscriptions[ws] = set()
+        pinger = asyncio.create_task(self.ping(ws))
+        try:
+            async for message in ws:
+                command = json.loads(message)
+                tokens = {str(token) for token in command.get("tokens", [])}
+                if command.get("msg_command") == "subscribe":
+                    self.subscriptions[ws] |= tokens
+                    now = time.time()
+                    for token in tokens:
+                        self.subscribed_at.setdefault(token, now)
+                elif command.get("msg_command") == "unsubscribe":
+                    self.subscriptions[ws] -= tokens
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            pinger.cancel()
+            self.subscriptions.pop(ws, None)
+
+    @staticmethod
+    async def ping(ws):
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SEC)
+            await ws.send(json.dumps({"data_type": "ping"}))
+
+    def get_subscribed_tokens(self) -> Set[str]:
+        """tokens subscribed on any open connection"""
+        return set().union(*self.subscriptions.values())
+
+    def get_connection_counts(self) -> Dict[str, int]:
+        """open connections subscribed to every token"""
+        connections: Dict[str, int] = {}
+        for tokens in list(self.subscriptions.values()):
+            for token in tokens:
+                connections[token] = connections.get(token, 0) + 1
+        return connections
+
+
+def start_node(node_id: str) -> subprocess.Popen:
+    env = {**os.environ, "NODE_ID": node_id, "BROKER_WS_URL": f"ws://127.0.0.1:{BROKER_PORT}",
+           "TICK_HISTORY_ENABLED": "0", "PRICE_BOARD_PATH": "", "HANDOFF_RECLAIM_IDLE_MS": str(RECLAIM_IDLE_MS)}
+    return subprocess.Popen([sys.executable, "-m", "server.ingest"], env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+async def wait_for(condition, timeout: float) -> float:
+    """seconds till condition is true"""
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise TimeoutError("condition not met in time")
+        await asyncio.sleep(POLL_INTERVAL_SEC)
+    return time.time() - start
+
+
+async def hand_over(tokens: List[str], batch_interval: float, published_at: Dict[str, float]):
+    """assign tokens to nodes in batches like syncs do , off the event loop so that broker keeps serving"""
+    for start in range(0, len(tokens), BATCH_SIZE):
+        batch = tokens[start:start + BATCH_SIZE]
+        now = time.time()
+        published_at.update((token, now) for token in batch)
+        await asyncio.to_thread(ShardUseCase.assign_tokens, batch)
+        await asyncio.sleep(batch_interval)
+
+
+async def settle(broker: FakeBroker, tokens: List[str]) -> float:
+    """seconds till every token is subscribed on an open connection , SETTLE_TIMEOUT_SEC at most"""
+    start = time.time()
+    try:
+        token_set = set(tokens)
+        await wait_for(lambda: token_set <= broker.get_subscribed_tokens(), SETTLE_TIMEOUT_SEC)
+    except TimeoutError:
+        pass
+    return time.time() - start
+
+
+def report(name: str, broker: FakeBroker, tokens: List[str], published_at: Dict[str, float]):
+    subscribed = broker.get_connection_counts()
+    lost = [token for token in tokens if token not in subscribed]
+    duplicates = sum(1 for token in tokens if subscribed.get(token, 0) > 1)
+    latency_ms = [(broker.subscribed_at[token] - published_at[token]) * 1000 for token in tokens if
+                  token in broker.subscribed_at]
+    print(f"{name} : {len(tokens)} tokens , lost {len(lost)} , subscribed on more than one connection {duplicates} , "
+          f"handoff to first subscribe ms {percentiles(latency_ms)}")
+    if lost:
+        print(f"{name} : lost tokens (first 10) {lost[:10]}")
+
+
+async def run():
+    broker = FakeBroker()
+    server = await websockets.serve(broker.handler, "127.0.0.1", BROKER_PORT)
+    node_ids = [f"handoff-node-{os.getpid()}-{i}" for i in range(NODES)]
+    processes = {node_id: start_node(node_id) for node_id in node_ids}
+    published_at: Dict[str, float] = {}
+    try:
+        await wait_for(lambda: set(node_ids) <= set(ShardUseCase.get_live_node_ids()), READY_TIMEOUT_SEC)
+
+        burst_tokens = [str(1_000_000 + i) for i in range(BURST_TOKENS)]
+        start = time.time()
+        await hand_over(burst_tokens, 0, published_at)
+        handed_over_sec = time.time() - start
+        await settle(broker, burst_tokens)
+        total_sec = time.time() - start
+        print(f"burst : {BURST_TOKENS} tokens to {NODES} nodes , handed over in {handed_over_sec:.2f} sec , all "
+              f"subscribed in {total_sec:.2f} sec , {BURST_TOKENS / total_sec:.0f} tokens/sec")
+        report("burst", broker, burst_tokens, published_at)
+
+        chaos_tokens = [str(2_000_000 + i) for i in range(CHAOS_TOKENS)]
+        producer = asyncio.create_task(hand_over(chaos_tokens, CHAOS_BATCH_INTERVAL_SEC, published_at))
+        kills = 0
+        while not producer.done():
+            await asyncio.sleep(KILL_INTERVAL_SEC)
+            victim = random.choice(node_ids)
+            processes[victim].send_signal(signal.SIGKILL)
+            processes[victim].wait()
+            processes[victim] = start_node(victim)
+            kills += 1
+        await producer
+        settle_sec = await settle(broker, chaos_tokens)
+        print(f"chaos : {kills} nodes killed and started again while handing over , settled "
+              f"{settle_sec:.2f} sec after last hand over")
+        report("chaos", broker, chaos_tokens, published_at)
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            process.wait()
+        server.close()
+        # nodes of the benchmark and their tokens are not left for nodes of the next run to take over
+        ShardUseCase.remove_dead_nodes(node_ids)
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
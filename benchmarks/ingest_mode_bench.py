@@ -0,0 +1,121 @@
+"""benchmark of API latency under tick bursts , ingest embedded in the app event loop vs an external ingest process
+price requests (price table lookup of a slice of tokens) arrive at a fixed rate while broker frames arrive in
+bursts. In embedded mode frames are decoded and applied on the same event loop , in external mode a separate
+process decodes them and the app loop only applies the conflated price delta of every flush window like it does
+with the price delta feed. Needs at least 2 cores to be meaningful. Runs without broker or redis.
+command to run - 'python -m benchmarks.ingest_mode_bench'"""
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from typing import List, Dict
+
+import orjson
+
+from benchmarks.utils import percentiles
+from data_adapter.price_table import PriceTable
+from models.sensi_models import BrokerWSIncomingMessage
+
+UNIVERSE = 20000
+TOKENS_PER_REQUEST = 500
+REQUESTS_PER_SEC = 200
+# frames of a burst are read from socket in chunks , listener yields to the loop between chunks
+BURST_FRAMES = 50000
+BURST_INTERVAL_SEC = 1
+FRAMES_PER_READ = 500
+FLUSH_INTERVAL_SEC = 0.05
+DURATION_SEC = 10
+
+
+def build_frames() -> List[bytes]:
+    return [orjson.dumps({"data_type": "quote", "payload": {"token": str(random.randrange(UNIVERSE)),
+                                                            "price": round(random.uniform(1, 50000), 2)}})
+            for _ in range(BURST_FRAMES)]
+
+
+def decode_frames(frames: List[bytes], buffer: Dict[str, float]):
+    for frame in frames:
+        quote = BrokerWSIncomingMessage.get_quote(orjson.loads(frame))
+        if quote is not None:
+            buffer[quote[0]] = quote[1]
+
+
+async def embedded_ingest(frames: List[bytes], until: float):
+    while time.perf_counter() < until:
+        for start in range(0, len(frames), FRAMES_PER_READ):
+            buffer: Dict[str, float] = {}
+            decode_frames(frames[start:start + FRAMES_PER_READ], buffer)
+            PriceTable.get_instance().update_many(buffer)
+            await asyncio.sleep(0)
+        await asyncio.sleep(BURST_INTERVAL_SEC)
+
+
+def external_ingest(frames: List[bytes], deltas: multiprocessing.Queue, until_wall: float):
+    """runs in ingest process , conflated prices are handed over once per flush window"""
+    buffer: Dict[str, float] = {}
+    flushed_at = time.time()
+    while time.time() < until_wall:
+        for start in range(0, len(frames), FRAMES_PER_READ):
+            decode_frames(frames[start:start + FRAMES_PER_READ], buffer)
+            if time.time() - flushed_at >= FLUSH_INTERVAL_SEC:
+                deltas.put(orjson.dumps(buffer))
+                buffer, flushed_at = {}, time.time()
+        time.sleep(BURST_INTERVAL_SEC)
+    deltas.put(None)
+
+
+async def apply_deltas(deltas: multiprocessing.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        delta = await loop.run_in_executor(None, deltas.get)
+        if delta is None:
+            return
+        PriceTable.get_instance().update_many(orjson.loads(delta))
+
+
+async def price_request(scheduled_at: float, latencies_ms: List[float]):
+    offset = random.randrange(UNIVERSE - TOKENS_PER_REQUEST)
+    PriceTable.get_instance().get_many([str(token) for token in range(offset, offset + TOKENS_PER_REQUEST)])
+    latencies_ms.append((time.perf_counter() - scheduled_at) * 1000)
+
+
+async def arrive(rate: int, until: float, latencies_ms: List[float]):
+    """open loop arrivals , latency is measured from the time a request was due and not from when it started"""
+    interval = 1 / rate
+    scheduled_at = time.perf_counter()
+    tasks = []
+    while scheduled_at < until:
+        tasks.append(asyncio.create_task(price_request(scheduled_at, latencies_ms)))
+        scheduled_at += interval
+        await asyncio.sleep(max(0.0, scheduled_at - time.perf_counter()))
+    await asyncio.gather(*tasks)
+
+
+async def run_mode(mode: str, frames: List[bytes]) -> dict:
+    latencies_ms: List[float] = []
+    until = time.perf_counter() + DURATION_SEC
+    if mode == "idle":
+        await arrive(REQUESTS_PER_SEC, until, latencies_ms)
+    elif mode == "embedded":
+        await asyncio.gather(embedded_ingest(frames, until), arrive(REQUESTS_PER_SEC, until, latencies_ms))
+    else:
+        deltas = multiprocessing.Queue()
+        process = multiprocessing.Process(target=external_ingest, args=(frames, deltas, time.time() + DURATION_SEC))
+        process.start()
+        await asyncio.gather(apply_deltas(deltas), arrive(REQUESTS_PER_SEC, until, latencies_ms))
+        process.join()
+    return {"price_request_latency_ms": percentiles(latencies_ms)}
+
+
+async def run():
+    if (os.cpu_count() or 1) < 2:
+        print("single cpu , ingest process competes with app loop for the same core and external mode can not help")
+    frames = build_frames()
+    PriceTable.get_instance().update_many({str(token): 1.0 for token in range(UNIVERSE)})
+    for mode in ("idle", "embedded", "external"):
+        print(f"{mode} : {await run_mode(mode, frames)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+"""benchmark of instrument catalog cold load vs warm hit
+runs against an in-memory sqlite db so that it does not need postgres
+command to run - 'python -m benchmarks.instrument_catalog_bench'"""
+import asyncio
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from controller.context_manager import context_db_session
+from data_adapter.db import DBBase
+from data_adapter.instrument_catalog import InstrumentCatalog
+from data_adapter.sensi_data import SensiUnderlying, SensiDerivative
+from benchmarks.utils import percentiles
+
+UNDERLYINGS = 50
+DERIVATIVES_PER_UNDERLYING = 2000
+WARM_ITERATIONS = 200
+
+
+def seed_db():
+    engine = create_engine("sqlite://")
+    DBBase.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    underlyings = [SensiUnderlying(token=str(i), symbol=f"SYM{i}") for i in range(UNDERLYINGS)]
+    db.add_all(underlyings)
+    db.flush()
+    token = UNDERLYINGS
+    for underlying in underlyings:
+        derivatives = []
+        for i in range(DERIVATIVES_PER_UNDERLYING):
+            derivatives.append(SensiDerivative(token=str(token), symbol=f"{underlying.symbol}{i}",
+                                               underlying=underlying.symbol, underlying_id=underlying.id,
+                                               instrument_type="CE" if i % 2 else "PE",
+                                               expiry=date.today() + timedelta(days=i % 30), strike=100 + i))
+            token += 1
+        db.add_all(derivatives)
+    db.commit()
+    return db
+
+
+async def run():
+    context_db_session.set(seed_db())
+    catalog = InstrumentCatalog.get_instance()
+    # catalog version is pinned so that the benchmark does not need redis
+    catalog.set_remote_version(1)
+
+    start = time.perf_counter()
+    await catalog.get_derivatives_by_underlying_symbol("SYM0")
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    warm_ms = []
+    for _ in range(WARM_ITERATIONS):
+        start = time.perf_counter()
+        await catalog.get_derivatives_by_underlying_symbol("SYM0")
+        warm_ms.append((time.perf_counter() - start) * 1000)
+
+    print(f"derivatives per symbol : {DERIVATIVES_PER_UNDERLYING}")
+    print(f"cold load (db query + from_orm + build_res_model) : {cold_ms:.3f} ms")
+    print(f"warm hit (ms) : {percentiles(warm_ms)}")
+    print(f"catalog stats : {catalog.get_stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,369 @@
+"""load test suite of the API , tick ingestion and sync paths , runs offline against a fake broker
+(benchmarks.fake_broker) started in process and an app server ('uvicorn server.app:app' , embedded ingest) pointed at
+it. Phases run one after the other
+sync : celery sync tasks run in process (task.apply) , cold (empty db) , with unchanged payloads and after
+SYNC_ROLL_FRACTION of derivatives were replaced by new ones , along with time till every synced token is subscribed at
+the broker
+ticks : broker sends tick rate quotes/sec for TICK_SEC , ingest rate is read from /metrics of the app and probe quotes
+are looked for on the price delta feed for tick to delta latency
+api : API_CONCURRENCY clients request every API scenario back to back for API_SEC each while ticks keep flowing
+tasks : rebalance , stale price scan and expired derivatives purge tasks
+results are printed and saved as json under RESULTS_DIR (or --output) along with config and git commit they were
+measured at , --compare with an earlier result prints change of every measure. Broker , app and suite share the
+cores of the host , numbers are meant to be compared between runs on the same host.
+needs a scratch redis (6.2+) at REDIS_URL and a scratch postgres at DB_* with scripts/init_db.sql loaded , both are
+wiped at start with --reset , suite does not run on non empty ones without it
+command to run - 'python -m benchmarks.load_suite --reset'"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+import orjson
+from pydantic.main import BaseModel
+from sqlalchemy import text
+
+from benchmarks.fake_broker import FakeBroker, PROBE_PRICE_BASE, REST_PORT, WS_PORT
+from benchmarks.utils import percentiles
+from config.constants import RedisKeys
+from config.settings import BrokerConfig, DerivativeSyncConfig
+from data_adapter.async_redis import AsyncCache
+from data_adapter.db import db_engine
+from data_adapter.redis import Cache
+from logger import logger
+from models.base import GenericResponseModel
+from usecases.shard_usecase import ShardUseCase
+from worker.task_worker import trigger_underlyings_sync, trigger_derivatives_sync, trigger_ws_rebalance, \
+    trigger_stale_price_scan, trigger_expired_derivatives_purge
+
+UNDERLYINGS = 20
+DERIVATIVES_PER_UNDERLYING = 200
+TICK_RATE = 2000
+TICK_SEC = 10
+API_SEC = 10
+API_CONCURRENCY = 8
+SYNC_ROLL_FRACTION = 0.1
+APP_PORT = 18769
+PROBE_INTERVAL_SEC = 0.05
+READY_TIMEOUT_SEC = 60
+SETTLE_TIMEOUT_SEC = 60
+POLL_INTERVAL_SEC = 0.1
+RESULTS_DIR = "benchmarks/results"
+# leaves of results compared between runs , counts that only follow durations are left out
+COMPARED_MEASURES = ("_ms", "_rate", "_per_sec", "p50", "p90", "p99", "max", "errors", "lost", "subscribed")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="load test suite of the API , tick ingestion and sync paths")
+    parser.add_argument("--underlyings", type=int, default=UNDERLYINGS)
+    parser.add_argument("--derivatives-per-underlying", type=int, default=DERIVATIVES_PER_UNDERLYING)
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE, help="quotes/sec sent by the fake broker")
+    parser.add_argument("--tick-sec", type=float, default=TICK_SEC)
+    parser.add_argument("--api-sec", type=float, default=API_SEC, help="duration of every API scenario")
+    parser.add_argument("--concurrency", type=int, default=API_CONCURRENCY, help="concurrent API clients")
+    parser.add_argument("--output", help=f"result json , {RESULTS_DIR}/load_suite_<time>.json by default")
+    parser.add_argument("--compare", help="result json of an earlier run to compare with")
+    parser.add_argument("--reset", action="store_true", help="wipe redis db and sensi tables before the run")
+    return parser.parse_args()
+
+
+def reset_stores(reset: bool) -> bool:
+    """wipe redis db and instrument tables , without reset only checks that both are empty
+    :return True if stores are empty"""
+    if reset:
+        with db_engine.begin() as connection:
+            connection.execute(text("TRUNCATE sensi_derivative , sensi_underlying RESTART IDENTITY"))
+        Cache.get_instance().flushdb()
+        return True
+    with db_engine.connect() as connection:
+        underlyings = connection.execute(text("SELECT count(*) FROM sensi_underlying")).scalar()
+    return not underlyings and not Cache.get_instance().dbsize()
+
+
+def start_app(node_id: str) -> subprocess.Popen:
+    env = {**os.environ, "NODE_ID": node_id, "INGEST_MODE": "embedded", "PRICE_BOARD_PATH": "",
+           "BROKER_INTEGRATION_URL": f"http://127.0.0.1:{REST_PORT}", "BROKER_WS_URL": f"ws://127.0.0.1:{WS_PORT}"}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "server.app:app", "--host", "127.0.0.1", "--port",
+                             str(APP_PORT), "--log-level", "warning"], env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+
+async def wait_for(condition, timeout: float) -> Optional[float]:
+    """seconds till condition is true , None if it is not true within timeout"""
+    start = time.time()
+    while not await condition():
+        if time.time() - start > timeout:
+            return None
+        await asyncio.sleep(POLL_INTERVAL_SEC)
+    return time.time() - start
+
+
+async def wait_for_app(client: httpx.AsyncClient, node_id: str) -> Optional[float]:
+    async def is_ready() -> bool:
+        try:
+            response = await client.get("/status")
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200 and node_id in ShardUseCase.get_live_node_ids()
+
+    return await wait_for(is_ready, READY_TIMEOUT_SEC)
+
+
+async def run_task(task) -> Tuple[float, dict]:
+    """run celery task in process , off the event loop so that fake broker keeps serving
+    :return duration ms , summary of the task response"""
+    start = time.perf_counter()
+    response = (await asyncio.to_thread(task.apply)).result
+    duration_ms = round((time.perf_counter() - start) * 1000, 3)
+    if not isinstance(response, GenericResponseModel):
+        # task raised , apply keeps the exception as result
+        return duration_ms, {"success": False, "error": str(response)}
+    payload = response.payload
+    if isinstance(payload, BaseModel):
+        # per underlying reports would bury the totals
+        payload = payload.dict(exclude={"underlying_reports"})
+    return duration_ms, {"success": response.success, "payload": payload}
+
+
+async def run_sync_phase(broker: FakeBroker) -> dict:
+    results = {}
+    for run_name in ("cold", "unchanged", "rolled"):
+        removed: List[str] = []
+        if run_name == "rolled":
+            removed, _ = broker.roll_derivatives(SYNC_ROLL_FRACTION)
+        start = time.time()
+        underlyings_ms, underlyings_report = await run_task(trigger_underlyings_sync)
+        derivatives_ms, derivatives_report = await run_task(trigger_derivatives_sync)
+        tokens = set(broker.get_tokens())
+
+        async def is_subscribed() -> bool:
+            return tokens <= broker.get_subscribed_tokens()
+
+        settled = await wait_for(is_subscribed, SETTLE_TIMEOUT_SEC)
+        subscribed = broker.get_subscribed_tokens()
+        results[run_name] = {
+            "underlyings_sync_ms": underlyings_ms,
+            "derivatives_sync_ms": derivatives_ms,
+            # from start of underlyings sync till every token of the universe is subscribed at the broker
+            "all_subscribed_ms": round((time.time() - start) * 1000, 3) if settled is not None else None,
+            "tokens": len(tokens),
+            "not_subscribed": len(tokens - subscribed),
+            "removed_still_subscribed": len(set(removed) & subscribed),
+            "underlyings": underlyings_report,
+            "derivatives": derivatives_report,
+        }
+        print(f"sync {run_name} : underlyings {underlyings_ms:.0f} ms , derivatives {derivatives_ms:.0f} ms , "
+              f"{len(tokens)} tokens all subscribed in {results[run_name]['all_subscribed_ms']} ms")
+    return results
+
+
+async def get_metrics(client: httpx.AsyncClient) -> dict:
+    return (await client.get("/metrics")).json()
+
+
+async def run_ticks_phase(broker: FakeBroker, client: httpx.AsyncClient, tick_rate: int, duration: float) -> dict:
+    """ticks flow from here on , including the api phase"""
+    probes: Dict[Tuple[str, float], float] = {}
+    latencies_ms: List[float] = []
+    pubsub = AsyncCache.get_instance().pubsub()
+    await pubsub.subscribe(RedisKeys.TOPIC_FOR_PRICE_DELTA)
+
+    async def listen():
+        async for message in pubsub.listen():
+            received_at = time.time()
+            for token, price in orjson.loads(message["data"]).get("prices", {}).items():
+                if price > PROBE_PRICE_BASE:
+                    sent_at = probes.pop((token, price), None)
+                    if sent_at is not None:
+                        latencies_ms.append((received_at - sent_at) * 1000)
+
+    listener = asyncio.create_task(listen())
+    metrics_before = await get_metrics(client)
+    ticks_sent_before = broker.counters["ticks_sent"]
+    start = time.perf_counter()
+    broker.tick_rate = tick_rate
+    probes_sent = 0
+    while time.perf_counter() - start < duration:
+        probe = await broker.send_probe()
+        if probe is not None:
+            token, price, sent_at = probe
+            probes[(token, price)] = sent_at
+            probes_sent += 1
+        await asyncio.sleep(PROBE_INTERVAL_SEC)
+    elapsed = time.perf_counter() - start
+    ticks_sent = broker.counters["ticks_sent"] - ticks_sent_before
+    metrics_after = await get_metrics(client)
+    # probes of the last flush window
+    await asyncio.sleep(1)
+    listener.cancel()
+    await pubsub.close()
+    ticks_received = metrics_after["tick_writer"]["ticks_received"] - metrics_before["tick_writer"]["ticks_received"]
+    results = {
+        "ticks_sent": ticks_sent,
+        "ticks_received": ticks_received,
+        "send_rate": round(ticks_sent / elapsed, 1),
+        "ingest_rate": round(ticks_received / elapsed, 1),
+        "ticks_coalesced": metrics_after["tick_writer"]["ticks_coalesced"] -
+        metrics_before["tick_writer"]["ticks_coalesced"],
+        "flush_latency_ms": metrics_after["tick_writer"]["flush_latency"],
+        "probes_sent": probes_sent,
+        # a probe is lost when a tick of the same token overwrites it within the flush window
+        "probes_lost": len(probes),
+        "tick_to_delta_ms": percentiles(latencies_ms),
+    }
+    print(f"ticks : sent {results['send_rate']}/sec , ingested {results['ingest_rate']}/sec , tick to price delta ms "
+          f"{results['tick_to_delta_ms']}")
+    return results
+
+
+def build_api_scenarios(broker: FakeBroker) -> Dict[str, Callable[[], str]]:
+    """path of the next request of every scenario"""
+    symbols = [underlying["symbol"] for underlying in broker.underlyings]
+    return {
+        "underlying_prices": lambda: "/underlying-prices",
+        "option_chain": lambda: f"/derivative-prices/{random.choice(symbols)}",
+        "option_chain_max_age": lambda: f"/derivative-prices/{random.choice(symbols)}?max_age=5",
+        "option_chain_atm_greeks": lambda: f"/derivative-prices/{random.choice(symbols)}?strikes_around_atm=10"
+                                           f"&greeks=true",
+    }
+
+
+async def run_api_scenario(client: httpx.AsyncClient, build_path: Callable[[], str], concurrency: int,
+                           duration: float) -> dict:
+    """closed loop , every client sends its next request once the previous one is answered"""
+    latencies_ms: List[float] = []
+    statuses: Dict[str, int] = {}
+    until = time.perf_counter() + duration
+
+    async def send_requests():
+        while time.perf_counter() < until:
+            start = time.perf_counter()
+            try:
+                response = await client.get(build_path())
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send_requests() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies_ms),
+        "requests_per_sec": round(len(latencies_ms) / elapsed, 1),
+        "errors": sum(count for status, count in statuses.items() if status != "200"),
+        "statuses": statuses,
+        "latency_ms": percentiles(latencies_ms),
+    }
+
+
+async def run_api_phase(broker: FakeBroker, client: httpx.AsyncClient, concurrency: int, duration: float) -> dict:
+    results = {}
+    # instrument catalog of every symbol is loaded before measuring
+    for underlying in broker.underlyings:
+        await client.get(f"/derivative-prices/{underlying['symbol']}")
+    for name, build_path in build_api_scenarios(broker).items():
+        results[name] = await run_api_scenario(client, build_path, concurrency, duration)
+        print(f"api {name} : {results[name]['requests_per_sec']} req/sec , errors {results[name]['errors']} , "
+              f"latency ms {results[name]['latency_ms']}")
+    return results
+
+
+async def run_tasks_phase() -> dict:
+    results = {}
+    for name, task in (("ws_rebalance", trigger_ws_rebalance), ("stale_price_scan", trigger_stale_price_scan),
+                       ("expired_derivatives_purge", trigger_expired_derivatives_purge)):
+        duration_ms, report = await run_task(task)
+        results[name] = {"duration_ms": duration_ms, **report}
+        print(f"task {name} : {duration_ms:.0f} ms , success {report['success']}")
+    return results
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    """numeric leaves of nested results keyed by their dotted path"""
+    if isinstance(value, dict):
+        leaves = {}
+        for key, child in value.items():
+            leaves.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return leaves
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(previous_path: str, results: dict) -> None:
+    """print change of every measure (COMPARED_MEASURES) present in both runs"""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    print(f"compared with {previous_path} (commit {previous.get('git_commit')} , {previous.get('started_at')})")
+    previous_leaves = flatten(previous.get("results", {}))
+    for key, value in flatten(results).items():
+        previous_value = previous_leaves.get(key)
+        if previous_value is None or previous_value == value or not key.endswith(COMPARED_MEASURES):
+            continue
+        change = f"{(value - previous_value) / previous_value * 100:+.1f}%" if previous_value else "new"
+        print(f"{key} : {previous_value} -> {value} ({change})")
+
+
+async def run(args: argparse.Namespace):
+    # logs of tasks running in process would bury the report
+    logger.logger.setLevel(logging.WARNING)
+    if not reset_stores(args.reset):
+        print("redis db or sensi tables are not empty , run with --reset on scratch stores to wipe them")
+        return
+    started_at = datetime.now()
+    broker = FakeBroker(underlyings=args.underlyings, derivatives_per_underlying=args.derivatives_per_underlying)
+    broker_server = await broker.start()
+    # syncs run in this process , app server gets the broker from its env
+    BrokerConfig.url = f"http://127.0.0.1:{REST_PORT}"
+    node_id = f"load-suite-{os.getpid()}"
+    app = start_app(node_id)
+    results = {}
+    app_metrics = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", timeout=30,
+                                     limits=httpx.Limits(max_connections=args.concurrency)) as client:
+            if await wait_for_app(client, node_id) is None:
+                print("app server did not come up")
+                return
+            results["sync"] = await run_sync_phase(broker)
+            results["ticks"] = await run_ticks_phase(broker, client, args.tick_rate, args.tick_sec)
+            results["api"] = await run_api_phase(broker, client, args.concurrency, args.api_sec)
+            results["tasks"] = await run_tasks_phase()
+            app_metrics = await get_metrics(client)
+    finally:
+        app.terminate()
+        app.wait()
+        await broker_server.stop()
+        ShardUseCase.remove_dead_nodes([node_id])
+    output = args.output or os.path.join(RESULTS_DIR, f"load_suite_{started_at:%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump({"suite": "load_suite", "started_at": started_at.isoformat(), "git_commit": get_git_commit(),
+                   "cpus": os.cpu_count(), "config": {**vars(args), "derivative_sync_rate_limit_per_host":
+                                                      DerivativeSyncConfig.rate_limit_per_host},
+                   "results": results, "app_metrics": app_metrics}, output_file, indent=2, default=str)
+    print(f"results saved to {output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
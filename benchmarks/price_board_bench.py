@@ -0,0 +1,86 @@
+"""benchmark of per request cost of reading prices , shared memory price board vs redis HMGET
+a writer process keeps writing ticks to the board (and to redis) like the ingest side does , reader reads a slice of
+tokens per request like price APIs do.
+needs redis at REDIS_URL for the redis part , benchmark only touches keys prefixed with BENCH_ and a board file at
+PRICE_BOARD_PATH (default /dev/shm/sensi_price_board_bench)
+command to run - 'python -m benchmarks.price_board_bench'"""
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from typing import List
+
+os.environ.setdefault("PRICE_BOARD_PATH", "/dev/shm/sensi_price_board_bench")
+
+from benchmarks.utils import percentiles  # noqa: E402
+from data_adapter.async_redis import AsyncCache  # noqa: E402
+from data_adapter.price_board import PriceBoard  # noqa: E402
+from data_adapter.token_registry import TokenRegistry  # noqa: E402
+
+PRICE_KEY = "BENCH_ENTITY_PRICE_DATA"
+UNIVERSE = 20000
+TOKENS_PER_REQUEST = 500
+REQUESTS = 2000
+TICK_BATCH = 1000
+TICK_INTERVAL_SEC = 0.01
+
+
+def write_ticks(stop: multiprocessing.Event):
+    """runs in writer process"""
+    while not stop.is_set():
+        PriceBoard.get_instance().write_many({str(random.randrange(UNIVERSE)): random.random() * 1000 for _ in
+                                              range(TICK_BATCH)})
+        time.sleep(TICK_INTERVAL_SEC)
+
+
+def request_tokens() -> List[str]:
+    offset = random.randrange(UNIVERSE - TOKENS_PER_REQUEST)
+    return [str(token) for token in range(offset, offset + TOKENS_PER_REQUEST)]
+
+
+def run_board() -> dict:
+    latencies_ms: List[float] = []
+    for _ in range(REQUESTS):
+        tokens = request_tokens()
+        start = time.perf_counter()
+        PriceBoard.get_instance().get_many(tokens)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+    return {"latency_ms": percentiles(latencies_ms), "board": PriceBoard.get_instance().get_stats()}
+
+
+async def run_redis() -> dict:
+    try:
+        seeded = await asyncio.wait_for(AsyncCache.get_instance().hset(
+            PRICE_KEY, {str(token): 1.0 for token in range(UNIVERSE)}), timeout=5)
+    except asyncio.TimeoutError:
+        seeded = False
+    if not seeded:
+        return {"error": "redis not reachable"}
+    latencies_ms: List[float] = []
+    for _ in range(REQUESTS):
+        tokens = request_tokens()
+        start = time.perf_counter()
+        await AsyncCache.get_instance().hmget(PRICE_KEY, tokens)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+    return {"latency_ms": percentiles(latencies_ms)}
+
+
+def run():
+    # board slots are registry ids , ids of the universe are loaded locally (writer process inherits them) instead of
+    # being assigned in redis
+    TokenRegistry.get_instance().add_tokens(0, [str(token) for token in range(UNIVERSE)])
+    PriceBoard.get_instance().write_many({str(token): 1.0 for token in range(UNIVERSE)})
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(target=write_ticks, args=(stop,))
+    writer.start()
+    try:
+        print(f"price_board : {run_board()}")
+        print(f"redis_hmget : {asyncio.run(run_redis())}")
+    finally:
+        stop.set()
+        writer.join()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,71 @@
+"""benchmark of token ids of the token registry against string tokens
+memory of a per structure token -> slot dict (price table before token ids) against arrays indexed by token id with
+one registry shared by all structures , and cost of reading prices of an option chain by token vs by token id.
+runs without redis , registry is filled the way refresh fills it
+command to run - 'python -m benchmarks.token_registry_bench'"""
+import time
+import tracemalloc
+from array import array
+
+from data_adapter.price_table import PriceTable
+from data_adapter.token_registry import TokenRegistry
+
+UNIVERSE = 200000
+CHAIN_SIZE = 10000
+ITERATIONS = 200
+# structures of a process keyed by token , price table , price board slots , price stream subscriptions
+STRUCTURES = 3
+
+
+def measure(build) -> tuple:
+    """bytes allocated by build and what it built , result is kept alive till measured"""
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def build_slot_dict(tokens):
+    """token -> slot dict and price arrays , like price table kept before token ids"""
+    return {token: slot for slot, token in enumerate(tokens)}, array('d', bytes(8 * len(tokens))), \
+        array('d', bytes(8 * len(tokens)))
+
+
+def build_id_arrays(tokens):
+    """price arrays indexed by token id , token -> id lives in the shared registry"""
+    return array('d', bytes(8 * len(tokens))), array('d', bytes(8 * len(tokens)))
+
+
+def run():
+    # tokens are built before measuring , they are held by catalog and redis clients either way
+    tokens = [str(10_000_000 + i) for i in range(UNIVERSE)]
+    registry_bytes, _ = measure(lambda: TokenRegistry.get_instance().add_tokens(0, tokens))
+    slot_dict_bytes, slot_dict = measure(lambda: build_slot_dict(tokens))
+    id_array_bytes, _ = measure(lambda: build_id_arrays(tokens))
+    del slot_dict
+    print(f"tokens : {UNIVERSE}")
+    print(f"registry (token -> id dict + id -> token list) , once per process : {registry_bytes / 2 ** 20:.2f} MiB")
+    print(f"per structure , token -> slot dict + arrays : {slot_dict_bytes / 2 ** 20:.2f} MiB , "
+          f"id indexed arrays : {id_array_bytes / 2 ** 20:.2f} MiB")
+    print(f"{STRUCTURES} structures , token keyed : {STRUCTURES * slot_dict_bytes / 2 ** 20:.2f} MiB , "
+          f"id keyed with registry : {(registry_bytes + STRUCTURES * id_array_bytes) / 2 ** 20:.2f} MiB")
+
+    price_table = PriceTable.get_instance()
+    price_table.update_many({token: float(i) for i, token in enumerate(tokens)})
+    chain_tokens = tokens[:CHAIN_SIZE]
+    chain_ids = TokenRegistry.get_instance().get_ids(chain_tokens)
+    broker_tokens = [int(token) for token in chain_tokens]
+    for name, read in (("by token (registry lookup per token)", lambda: price_table.get_many(chain_tokens)),
+                       ("by int token as sent by broker", lambda: price_table.get_many(broker_tokens)),
+                       ("by token id (ids cached on catalog entry)",
+                        lambda: price_table.get_many_by_ids(chain_ids))):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            read()
+        per_call_ms = (time.perf_counter() - start) * 1000 / ITERATIONS
+        print(f"prices of {CHAIN_SIZE} tokens {name} : {per_call_ms:.3f} ms per chain")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,13 @@
+from typing import List
+
+
+def percentiles(samples_ms: List[float]) -> dict:
+    """summary of latency samples in milliseconds"""
+    if not samples_ms:
+        return {"count": 0}
+    ordered = sorted(samples_ms)
+
+    def at(percentile: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile))], 3)
+
+    return {"count": len(ordered), "p50": at(0.50), "p90": at(0.90), "p99": at(0.99), "max": round(ordered[-1], 3)}
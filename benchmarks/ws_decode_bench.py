@@ -0,0 +1,49 @@
+"""benchmark of decoding broker ws quote frames , pydantic model vs orjson fast path used by the listener
+runs on a single core without broker or redis
+command to run - 'python -m benchmarks.ws_decode_bench'"""
+import json
+import random
+import time
+
+import orjson
+
+from models.sensi_models import BrokerWSIncomingMessage
+
+FRAMES = 200000
+
+
+def build_frames():
+    return [json.dumps({"data_type": "quote", "payload": {"token": random.randint(1, 100000),
+                                                          "price": round(random.uniform(1, 50000), 2)}})
+            for _ in range(FRAMES)]
+
+
+def decode_with_model(frames) -> int:
+    decoded = 0
+    for frame in frames:
+        message = BrokerWSIncomingMessage.parse_raw(frame)
+        if message.payload.get("token") is not None:
+            decoded += 1
+    return decoded
+
+
+def decode_with_fast_path(frames) -> int:
+    decoded = 0
+    for frame in frames:
+        quote = BrokerWSIncomingMessage.get_quote(orjson.loads(frame))
+        if quote is not None and quote[0] is not None:
+            decoded += 1
+    return decoded
+
+
+def run():
+    frames = build_frames()
+    for name, decode in (("pydantic", decode_with_model), ("fast_path", decode_with_fast_path)):
+        start = time.process_time()
+        decoded = decode(frames)
+        elapsed = time.process_time() - start
+        print(f"{name} : {decoded} quotes in {elapsed:.3f} s cpu ({decoded / elapsed:.0f} messages/s per core)")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,12 +1,61 @@
 class RedisKeys:
     UNDERLYINGS_DATA = "UNDERLYINGS_DATA"
     DERIVATIVES_DATA = "DERIVATIVES_DATA:{}"
-    ENTITY_TOKENS_TO_BE_SYNCED = "ENTITY_TOKENS_TO_SYNC"
-    TOPIC_FOR_WS_ENTITY_PUSH = "WS_ENTITY_PUSH"
-    TOPIC_MESSAGE_FOR_WS_ENTITY_PUSH = "ENTITY_REFRESH"
+    # tokens handed over to a node to subscribe / unsubscribe from broker ws , in order , stream read by consumer
+    # group NODE_HANDOFF_GROUP of the node with one consumer per process of the node , entries are deleted once acked
+    NODE_HANDOFF = "NODE_HANDOFF:{}"
+    NODE_HANDOFF_GROUP = "ws_subscribers"
+    # tokens synced while no node was alive , assigned on next rebalance
+    UNASSIGNED_ENTITY_TOKENS = "UNASSIGNED_ENTITY_TOKENS"
     ENTITY_PRICE_DATA = "ENTITY_PRICE_DATA"
-    LAST_PING_TIME_FROM_WS = "LAST_PING_TIME_FROM_WS"
+    # last update time of price of every token (epoch sec of the flush window it was written in) , a sorted set so
+    # that tokens gone stale since last scan are a range of it
+    ENTITY_PRICE_UPDATED_AT = "ENTITY_PRICE_UPDATED_AT"
+    # tokens flagged by stale price scan , a token leaves the set on its next tick
+    STALE_ENTITY_TOKENS = "STALE_ENTITY_TOKENS"
+    # update time up to which stale price scan has flagged tokens
+    STALE_PRICE_SCAN_CUTOFF = "STALE_PRICE_SCAN_CUTOFF"
+    # heartbeat of a node (time it was written) , key expires after NODE_HEARTBEAT_TTL_MS unless written again , node
+    # is alive while its key exists
+    NODE_HEARTBEAT = "NODE_HEARTBEAT:{}"
+    # held by the node taking over tokens of a dead node
+    NODE_TAKEOVER_LOCK = "NODE_TAKEOVER_LOCK:{}"
     TOPIC_FOR_WS_RECONNECT = "WS_RECONNECT"
     NODE_ID_WS_ENTITY_MAPPING = "NODE_ID_WS_ENTITY_MAPPING:{}"
     NODE_IDS_IN_CLUSTER = "NODE_IDS_IN_CLUSTER"
+    TOPIC_FOR_PRICE_DELTA = "PRICE_DELTA"
+    INSTRUMENT_CATALOG_VERSION = "INSTRUMENT_CATALOG_VERSION"
+    TOPIC_FOR_INSTRUMENT_CATALOG_VERSION = "INSTRUMENT_CATALOG_VERSION"
+    # content hash of last synced broker payload , of underlyings list and of derivatives per underlying token
+    UNDERLYINGS_PAYLOAD_HASH = "UNDERLYINGS_PAYLOAD_HASH"
+    DERIVATIVES_PAYLOAD_HASH = "DERIVATIVES_PAYLOAD_HASH"
+    # history of a token , raw ticks and closed ohlc bars per resolution are streams with entry id as time in ms ,
+    # bars still open are kept in a hash per resolution
+    TICK_HISTORY = "TICK_HISTORY:{}"
+    OHLC_BARS = "OHLC_BARS:{}:{}"
+    OPEN_OHLC_BARS = "OPEN_OHLC_BARS:{}"
+    # dense integer ids of tokens assigned at sync time , token -> id , id -> token and last assigned id + 1
+    TOKEN_IDS = "TOKEN_IDS"
+    TOKENS_BY_ID = "TOKENS_BY_ID"
+    TOKEN_ID_SEQUENCE = "TOKEN_ID_SEQUENCE"
+    # ids released by expiry purge waiting to be reassigned (list , oldest first) and counter bumped every time an id
+    # is released or reassigned
+    FREE_TOKEN_IDS = "FREE_TOKEN_IDS"
+    TOKEN_ID_GENERATION = "TOKEN_ID_GENERATION"
     EXPIRY = 120 * 60  # 100 minutes
+
+
+class IngestModes:
+    # broker ws listener and tick writer run on the event loop of every app server
+    EMBEDDED = "embedded"
+    # broker ws listener and tick writer run in ingest processes (server/ingest.py) , app servers only receive prices
+    # from the price delta feed
+    EXTERNAL = "external"
+
+
+class HistoryResolutions:
+    TICK = "tick"
+    SECOND = "1s"
+    MINUTE = "1m"
+    # bucket length in seconds of ohlc bar resolutions
+    BAR_SECONDS = {SECOND: 1, MINUTE: 60}
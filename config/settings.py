@@ -16,17 +16,25 @@ class DB:
     name = Environment.get_string("DB_NAME", "sensi")
     user = Environment.get_string("DB_USER", "ketansomvanshi")
     pass_ = Environment.get_string("DB_PASS", "zxcvbnml")
+    # rows sent in a single multi row insert statement by bulk upserts
+    upsert_batch_size = Environment.get_int("DB_UPSERT_BATCH_SIZE", 1000)
 
 
 class CELERY:
     broker_uri = Environment.get_string("CELERY_BROKER_URI", "redis://redis_server:6379/1")
     trigger_freqn_for_derivative = Environment.get_int("CELERY_TRIGGER_FREQN_FOR_DERIVATIVE", 60)
     trigger_freqn_for_underlying = Environment.get_int("CELERY_TRIGGER_FREQN_FOR_UNDERLYING", 300)
-    trigger_freqn_for_ws_connection = Environment.get_int("CELERY_TRIGGER_FREQN_FOR_WS_CONNECTION", 60)
+    trigger_freqn_for_expiry_purge = Environment.get_int("CELERY_TRIGGER_FREQN_FOR_EXPIRY_PURGE", 3600)
+    trigger_freqn_for_ws_rebalance = Environment.get_int("CELERY_TRIGGER_FREQN_FOR_WS_REBALANCE", 60)
+    trigger_freqn_for_stale_price_scan = Environment.get_int("CELERY_TRIGGER_FREQN_FOR_STALE_PRICE_SCAN", 10)
 
 
 class REDIS:
     url = Environment.get_string("REDIS_URL", "redis://redis_server:6379/0")
+    # size of connection pool of async redis client used on the app event loop
+    max_connections = Environment.get_int("REDIS_MAX_CONNECTIONS", 50)
+    # seconds a command waits for a free connection when pool is exhausted
+    pool_timeout = Environment.get_int("REDIS_POOL_TIMEOUT", 5)
 
 
 class BrokerConfig:
@@ -34,9 +42,127 @@ class BrokerConfig:
     underlying_url = Environment.get_string("BROKER_UNDERLYING_URL", "/underlyings")
     derivative_url = Environment.get_string("BROKER_DERIVATIVE_URL", "/derivatives/{}")
     ws_url = Environment.get_string("BROKER_WS_URL", "wss://prototype.sbulltech.com/api/ws")
-    ws_ping_timeout = Environment.get_int("BROKER_WS_PING_TIMEOUT", 60)
+    # node reconnects a connection that received neither ticks nor pings for this long
+    ws_ping_timeout = Environment.get_int("BROKER_WS_PING_TIMEOUT", 15)
+    # tokens sent in a single subscribe / unsubscribe command to broker ws
+    ws_command_batch_size = Environment.get_int("BROKER_WS_COMMAND_BATCH_SIZE", 500)
+    # websocket connections per node , tokens of the node are partitioned across them
+    ws_connections = Environment.get_int("BROKER_WS_CONNECTIONS", 1)
+    # reconnect attempts back off exponentially from base up to max seconds , with jitter
+    ws_reconnect_backoff_sec = Environment.get_int("BROKER_WS_RECONNECT_BACKOFF_SEC", 1)
+    ws_reconnect_max_backoff_sec = Environment.get_int("BROKER_WS_RECONNECT_MAX_BACKOFF_SEC", 30)
+
+
+class DerivativeSyncConfig:
+    # underlyings whose derivatives are fetched from broker at the same time
+    concurrency = Environment.get_int("DERIVATIVE_SYNC_CONCURRENCY", 10)
+    # requests per second sent to a single broker host
+    rate_limit_per_host = Environment.get_int("DERIVATIVE_SYNC_RATE_LIMIT_PER_HOST", 20)
+    # attempts after the first one for timeouts , connection errors , 429 and 5xx responses
+    max_retries = Environment.get_int("DERIVATIVE_SYNC_MAX_RETRIES", 3)
+    # backoff before retry n is backoff_base_ms * 2^n with jitter
+    backoff_base_ms = Environment.get_int("DERIVATIVE_SYNC_BACKOFF_BASE_MS", 200)
+    request_timeout_sec = Environment.get_int("DERIVATIVE_SYNC_REQUEST_TIMEOUT_SEC", 10)
+
+
+class ShardConfig:
+    # node writes its heartbeat key every interval with ttl expiry , node is dead once its heartbeat expires
+    heartbeat_interval_ms = Environment.get_int("NODE_HEARTBEAT_INTERVAL_MS", 250)
+    # ttl of heartbeat of an ingest process , its event loop runs nothing but ingestion
+    heartbeat_ttl_ms = Environment.get_int("NODE_HEARTBEAT_TTL_MS", 1500)
+    # ttl of heartbeat of an app server in embedded ingest mode , its event loop also serves API requests which do
+    # blocking work (sync db and redis calls , greeks) , a stall past a short ttl would declare a healthy node dead
+    embedded_heartbeat_ttl_ms = Environment.get_int("NODE_HEARTBEAT_TTL_EMBEDDED_MS", 10000)
+    # node taking over tokens of a dead node holds a lock of the dead node for this long
+    takeover_lock_ms = Environment.get_int("NODE_TAKEOVER_LOCK_MS", 30000)
+
+
+class HandoffConfig:
+    # tokens in a single entry of the handoff stream of a node
+    entry_size = Environment.get_int("HANDOFF_ENTRY_SIZE", 1000)
+    # entries claimed by a node in a single read
+    claim_count = Environment.get_int("HANDOFF_CLAIM_COUNT", 50)
+    # read blocks this long waiting for entries
+    block_ms = Environment.get_int("HANDOFF_BLOCK_MS", 5000)
+    # entry delivered but not acked for this long is claimed again , eg process of the node died before subscribing
+    reclaim_idle_ms = Environment.get_int("HANDOFF_RECLAIM_IDLE_MS", 30000)
+
+
+class ExpiryPurgeConfig:
+    # tokens removed from db and redis in a single statement / command
+    purge_batch_size = Environment.get_int("EXPIRY_PURGE_BATCH_SIZE", 1000)
+
+
+class TickWriterConfig:
+    # ticks are buffered in memory and written to redis once per flush window
+    flush_interval_ms = Environment.get_int("TICK_WRITER_FLUSH_INTERVAL_MS", 100)
+    # buffer is flushed before the window ends if these many distinct tokens are pending
+    max_batch_size = Environment.get_int("TICK_WRITER_MAX_BATCH_SIZE", 5000)
+
+
+class PriceTableConfig:
+    # local copy of a price older than this is treated as a miss and refreshed from redis
+    max_staleness_ms = Environment.get_int("PRICE_TABLE_MAX_STALENESS_MS", 5000)
+
+
+class PriceStalenessConfig:
+    # price of a token with no tick for this long is flagged stale by stale price scan
+    stale_after_sec = Environment.get_int("PRICE_STALE_AFTER_SEC", 60)
+
+
+class TickHistoryConfig:
+    # ticks are recorded and rolled up into ohlc bars only if enabled
+    enabled = Environment.get_int("TICK_HISTORY_ENABLED", 1)
+    # raw ticks kept per token , older ticks are trimmed from the stream
+    max_ticks_per_token = Environment.get_int("TICK_HISTORY_MAX_TICKS_PER_TOKEN", 10000)
+    # bars kept per token and resolution , 1m bars cover ~2 weeks of trading hours
+    max_bars_per_token = Environment.get_int("TICK_HISTORY_MAX_BARS_PER_TOKEN", 5000)
+    # max ticks / bars returned by a history query , client pages further from the last returned time
+    max_query_entries = Environment.get_int("TICK_HISTORY_MAX_QUERY_ENTRIES", 5000)
+
+
+class OptionChainConfig:
+    # derivatives in a page of a filtered option chain when client does not ask for a limit
+    default_page_size = Environment.get_int("OPTION_CHAIN_DEFAULT_PAGE_SIZE", 200)
+    max_page_size = Environment.get_int("OPTION_CHAIN_MAX_PAGE_SIZE", 1000)
+
+
+class OptionAnalyticsConfig:
+    # risk free rate used for implied volatility and greeks , in basis points
+    risk_free_rate_bps = Environment.get_int("OPTION_ANALYTICS_RISK_FREE_RATE_BPS", 650)
+    # greeks of these many price snapshots are kept encoded
+    cache_size = Environment.get_int("OPTION_ANALYTICS_CACHE_SIZE", 256)
+    # local time options expire at on their expiry date
+    expiry_time = Environment.get_string("OPTION_ANALYTICS_EXPIRY_TIME", "15:30")
+    # greeks are valued at start of time buckets of these many seconds , a new bucket is a new snapshot
+    time_bucket_sec = Environment.get_int("OPTION_ANALYTICS_TIME_BUCKET_SEC", 60)
+
+
+class PriceBoardConfig:
+    # memory mapped file shared by processes of a host , eg /dev/shm/sensi_price_board , board is disabled if empty
+    path = Environment.get_string("PRICE_BOARD_PATH", "")
+    # max tokens on the board , tokens beyond it are served from redis
+    capacity = Environment.get_int("PRICE_BOARD_CAPACITY", 200000)
+    # reads racing with a write are retried these many times before falling back to redis
+    max_read_retries = Environment.get_int("PRICE_BOARD_MAX_READ_RETRIES", 5)
+
+
+class InstrumentCatalogConfig:
+    # max underlying symbols whose derivatives are kept in memory , least recently used symbols are evicted
+    max_symbols = Environment.get_int("INSTRUMENT_CATALOG_MAX_SYMBOLS", 256)
+    # catalog version is re-read from redis at this interval in case a version bump message was missed
+    version_check_interval_ms = Environment.get_int("INSTRUMENT_CATALOG_VERSION_CHECK_INTERVAL_MS", 30000)
+
+
+class PriceStreamConfig:
+    # max tokens a single streaming connection can subscribe to
+    max_tokens_per_connection = Environment.get_int("PRICE_STREAM_MAX_TOKENS_PER_CONNECTION", 5000)
+    # keep alive comment is sent on idle sse streams at this interval
+    sse_keepalive_sec = Environment.get_int("PRICE_STREAM_SSE_KEEPALIVE_SEC", 15)
 
 
 class AppConfig:
     # node_id unique for app server instance to identify itself
     node_id = Environment.get_string("NODE_ID", str(uuid.uuid4().hex))
+    # embedded / external , see IngestModes
+    ingest_mode = Environment.get_string("INGEST_MODE", "embedded")
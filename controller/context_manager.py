@@ -5,7 +5,7 @@ from fastapi import Depends, Request
 from sqlalchemy.orm import Session
 
 from config.settings import AppConfig
-from data_adapter.db import get_db, db_session
+from data_adapter.db import get_db, db_session, SessionLocal
 from logger import logger
 
 # we are using context variables to store request level context , as FASTAPI
@@ -40,6 +40,16 @@ def build_non_request_context():
     context_log_meta.set({'api_id': context_api_id.get()})
 
 
+async def build_stream_context():
+    """method to build context for streaming connections (websocket/sse) , these are not bound to request lifecycle
+    so db session put in context should be released with remove_db_session as soon as stream has resolved
+    what to subscribe to"""
+    context_db_session.set(SessionLocal())
+    context_api_id.set(str(uuid.uuid4()))
+    context_log_meta.set({'api_id': context_api_id.get(), 'node_id': AppConfig.node_id})
+    logger.info(extra={"api_id": context_api_id.get()}, msg="STREAM_INITIATED")
+
+
 def get_db_session() -> Session:
     """only this function should be used for session creation for any type of request
     if session is already present in context_var then context_db_session would be returned
@@ -0,0 +1,96 @@
+import asyncio
+
+import orjson
+from fastapi import APIRouter, Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from config.settings import PriceStreamConfig
+from controller.context_manager import build_stream_context, remove_db_session, context_log_meta
+from data_adapter.price_stream import PriceStreamHub, PriceStreamSubscriber
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import PriceStreamCommandModel
+from usecases.price_stream_usecase import PriceStreamUseCase
+
+price_stream_router = APIRouter(prefix="", tags=["sensi", "price_stream"])
+
+
+def push_error(subscriber: PriceStreamSubscriber, response: GenericResponseModel):
+    subscriber.push_message(orjson.dumps({"type": "error", "message": response.payload or "something went wrong"}))
+
+
+async def send_messages(websocket: WebSocket, subscriber: PriceStreamSubscriber):
+    """send snapshot and conflated price deltas of subscriber to websocket"""
+    while True:
+        for message in await subscriber.next_messages():
+            await websocket.send_text(message.decode())
+
+
+#  websocket to stream prices of subscribed symbols and tokens
+@price_stream_router.websocket("/price-stream")
+async def price_stream_websocket(websocket: WebSocket, _=Depends(build_stream_context)):
+    """
+    Stream prices over websocket
+    client sends {"action": "subscribe"|"unsubscribe", "symbols": [...], "tokens": [...]} and receives a snapshot
+    of current prices of newly subscribed tokens followed by deltas {"type": "delta", "prices": {token: price}}
+    :param _: build_stream_context dependency injection handles the stream context
+    """
+    await websocket.accept()
+    subscriber = PriceStreamSubscriber()
+    sender = asyncio.create_task(send_messages(websocket, subscriber))
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                command = PriceStreamCommandModel.parse_raw(data)
+            except Exception as e:
+                push_error(subscriber, GenericResponseModel(success=False, payload=f"invalid command : {e}"))
+                continue
+            response: GenericResponseModel = await PriceStreamUseCase.handle_command(subscriber, command)
+            # catalog may have loaded instruments from db , release the connection while stream stays open
+            remove_db_session()
+            if not response.success:
+                push_error(subscriber, response)
+    except WebSocketDisconnect:
+        logger.info(extra=context_log_meta.get(), msg="price_stream_websocket: client disconnected")
+    finally:
+        sender.cancel()
+        PriceStreamHub.get_instance().unregister(subscriber)
+
+
+#  server sent events fallback of price stream for clients that can not use websocket
+@price_stream_router.get("/price-stream/sse")
+async def price_stream_sse(request: Request, _=Depends(build_stream_context), symbols: str = Query(""),
+                           tokens: str = Query("")):
+    """
+    Stream prices as server sent events
+    :param _: build_stream_context dependency injection handles the stream context
+    :param symbols: comma separated underlying symbols
+    :param tokens: comma separated tokens
+    :return: event stream of snapshot followed by price deltas
+    """
+    subscriber = PriceStreamSubscriber()
+    response: GenericResponseModel = await PriceStreamUseCase.subscribe(
+        subscriber, symbols=[symbol for symbol in symbols.split(",") if symbol],
+        tokens=[token for token in tokens.split(",") if token])
+    remove_db_session()
+    if not response.success:
+        push_error(subscriber, response)
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    messages = await asyncio.wait_for(subscriber.next_messages(),
+                                                      timeout=PriceStreamConfig.sse_keepalive_sec)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": keep-alive\n\n"
+                    continue
+                for message in messages:
+                    yield b"data: " + message + b"\n\n"
+        finally:
+            PriceStreamHub.get_instance().unregister(subscriber)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
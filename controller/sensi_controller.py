@@ -1,35 +1,88 @@
 import http
+from datetime import date
 
-from fastapi import APIRouter, Depends, Path
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Path, Header, Query
 
 from controller.context_manager import build_request_context
 from models.base import GenericResponseModel
+from models.sensi_models import DerivativeFilterModel
+from usecases.history_usecase import HistoryUseCase
 from usecases.sensi_usecase import SensiUseCase
-from utils.utils import build_api_response
+from utils.utils import build_encoded_api_response, build_api_response
 
 sensi_router = APIRouter(prefix="", tags=["sensi", "sensi_underlying", "sensi_derivative"])
 
 
 #  api to list all underlying
 @sensi_router.get("/underlying-prices", status_code=http.HTTPStatus.OK)
-async def get_underlying_prices(_=Depends(build_request_context)):
+async def get_underlying_prices(_=Depends(build_request_context),
+                                if_none_match: Optional[str] = Header(None),
+                                max_age: Optional[float] = Query(None, gt=0)):
     """
     Get underlying prices
     :param _: build_request_context dependency injection handles the request context
+    :param if_none_match: etag of the prices snapshot client already has , 304 is returned if unchanged
+    :param max_age: seconds , older prices are returned as null and every price carries price_updated_at
     :return:
     """
-    response: GenericResponseModel = SensiUseCase.get_underlying_prices()
-    return build_api_response(response)
+    response: GenericResponseModel = await SensiUseCase.get_underlying_prices(if_none_match=if_none_match,
+                                                                              max_age=max_age)
+    return build_encoded_api_response(response)
 
 
 # api to list all derivative prices for underlying symbol
 @sensi_router.get("/derivative-prices/{symbol}", status_code=http.HTTPStatus.OK)
-async def get_derivative_prices(_=Depends(build_request_context), symbol: str = Path(...)):
+async def get_derivative_prices(_=Depends(build_request_context), symbol: str = Path(...),
+                                if_none_match: Optional[str] = Header(None),
+                                expiry: Optional[date] = Query(None), instrument_type: Optional[str] = Query(None),
+                                min_strike: Optional[float] = Query(None), max_strike: Optional[float] = Query(None),
+                                strikes_around_atm: Optional[int] = Query(None, ge=0),
+                                cursor: Optional[str] = Query(None), limit: Optional[int] = Query(None, ge=1),
+                                greeks: bool = Query(False), max_age: Optional[float] = Query(None, gt=0)):
     """
     Get derivative prices for underlying symbol
     :param _: build_request_context dependency injection handles the request context
     :param symbol: underlying symbol
+    :param if_none_match: etag of the prices snapshot client already has , 304 is returned if unchanged
+    :param expiry: only derivatives expiring on this date
+    :param instrument_type: only derivatives of this type , eg CE / PE / FUT
+    :param min_strike: only derivatives with strike at least this
+    :param max_strike: only derivatives with strike at most this
+    :param strikes_around_atm: only these many strikes on each side of strike closest to live underlying price
+    :param cursor: next_cursor of previous page
+    :param limit: derivatives in a page , with any filter response is paginated in (expiry , strike) order
+    :param greeks: add iv , delta , gamma , theta and vega of options computed from live prices
+    :param max_age: seconds , older prices are returned as null and every price carries price_updated_at
+    :return:
+    """
+    filters = DerivativeFilterModel(expiry=expiry, instrument_type=instrument_type, min_strike=min_strike,
+                                    max_strike=max_strike, strikes_around_atm=strikes_around_atm, cursor=cursor,
+                                    limit=limit)
+    response: GenericResponseModel = await SensiUseCase.get_derivatives_by_underlying_symbol(
+        symbol=symbol, if_none_match=if_none_match, filters=filters, with_greeks=greeks, max_age=max_age)
+    return build_encoded_api_response(response)
+
+
+# api to get tick history or ohlc bars of a token
+@sensi_router.get("/price-history/{token}", status_code=http.HTTPStatus.OK)
+async def get_price_history(_=Depends(build_request_context), token: str = Path(...),
+                            resolution: str = Query("1m"), start: Optional[float] = Query(None),
+                            end: Optional[float] = Query(None), limit: Optional[int] = Query(None, ge=1),
+                            cursor: Optional[str] = Query(None)):
+    """
+    Get tick history or ohlc bars of token
+    :param _: build_request_context dependency injection handles the request context
+    :param token: token of underlying or derivative
+    :param resolution: tick , 1s or 1m
+    :param start: epoch seconds , from the oldest entry kept if not given
+    :param end: epoch seconds , till the latest entry if not given
+    :param limit: max entries , response carries next_cursor when more entries are left in the range
+    :param cursor: next_cursor of previous page
     :return:
     """
-    response: GenericResponseModel = SensiUseCase.get_derivatives_by_underlying_symbol(symbol=symbol)
+    response: GenericResponseModel = await HistoryUseCase.get_price_history(token=token, resolution=resolution,
+                                                                            start=start, end=end, limit=limit,
+                                                                            cursor=cursor)
     return build_api_response(response)
@@ -4,6 +4,18 @@ from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 
 from data_adapter.db import db_engine
+from data_adapter.instrument_catalog import InstrumentCatalog
+from data_adapter.price_board import PriceBoard
+from data_adapter.price_stream import PriceStreamHub
+from data_adapter.price_table import PriceTable
+from data_adapter.tick_recorder import TickRecorder
+from data_adapter.tick_writer import TickWriter
+from data_adapter.token_registry import TokenRegistry
+from data_adapter.ws import WS, WSReconnectSupervisor
+from usecases.analytics_usecase import AnalyticsUseCase
+from usecases.handoff_usecase import HandoffUseCase
+from usecases.node_health_usecase import NodeHealthUseCase
+from usecases.sensi_usecase import SensiUseCase
 
 router = APIRouter(tags=["health_checks", "status"])
 
@@ -21,3 +33,23 @@ async def deep_status_check():
         return JSONResponse(status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR,
                             content={'error': "db not connected"})
     return JSONResponse(status_code=http.HTTPStatus.OK, content={'db': is_db_ok})
+
+
+@router.get("/metrics", status_code=http.HTTPStatus.OK)
+async def metrics():
+    """node level counters of the price pipeline"""
+    return JSONResponse(status_code=http.HTTPStatus.OK,
+                        content={"tick_writer": TickWriter.get_instance().get_stats(),
+                                 "tick_recorder": TickRecorder.get_instance().get_stats(),
+                                 "price_table": PriceTable.get_instance().get_stats(),
+                                 "token_registry": TokenRegistry.get_instance().get_stats(),
+                                 "price_board": PriceBoard.get_instance().get_stats(),
+                                 "instrument_catalog": InstrumentCatalog.get_instance().get_stats(),
+                                 "price_stream": PriceStreamHub.get_instance().get_stats(),
+                                 "broker_ws": WS.get_instance().get_stats(),
+                                 "ws_reconnects": WSReconnectSupervisor.get_instance().get_stats(),
+                                 "node_health": NodeHealthUseCase.get_stats(),
+                                 "handoff": HandoffUseCase.get_stats(),
+                                 "option_analytics": AnalyticsUseCase.get_stats(),
+                                 "topic_latency": {topic: latency.get_stats() for topic, latency in
+                                                   SensiUseCase.topic_latency.items()}})
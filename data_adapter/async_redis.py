@@ -0,0 +1,406 @@
+from typing import List, Dict, Set, Optional, Tuple
+
+from redis.asyncio import Redis, BlockingConnectionPool
+from redis.asyncio.client import PubSub
+from redis.exceptions import ResponseError
+
+from config.settings import REDIS
+from controller.context_manager import context_log_meta
+from logger import logger
+from utils.utils import Singleton
+
+
+@Singleton
+class AsyncCache:
+    """asyncio counterpart of Cache , to be used from coroutines running on the app event loop so that redis
+    round trips do not block the loop. Connections come from a bounded pool , commands wait for a free connection
+    when the pool is exhausted instead of opening unbounded connections.
+    Cache should still be used from celery workers and background threads."""
+
+    def __init__(self):
+        """initiate redis connection pool"""
+        self.__redis_url = REDIS.url
+        self._redis = self.__init_redis()
+        # ZMSCORE needs redis 6.2 , scores are read with a ZSCORE per member on older servers
+        self.__zmscore_supported = True
+
+    def __init_redis(self):
+        try:
+            pool = BlockingConnectionPool.from_url(self.__redis_url, max_connections=REDIS.max_connections,
+                                                   timeout=REDIS.pool_timeout, encoding="utf-8",
+                                                   decode_responses=True)
+            redis = Redis(connection_pool=pool)
+        except Exception as e:
+            logger.error(f"error in initiating async redis for url : {self.__redis_url} error : {e}")
+            return None
+        return redis
+
+    def __validate(self, key='default_valid') -> bool:
+        if not (self._redis and key):
+            return False
+        return True
+
+    async def sadd(self, key: str, values: List[str]) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return await self._redis.sadd(key, *values)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis sadd : {e}")
+            return 0
+
+    async def hdel(self, key: str, fields: List[str]) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return await self._redis.hdel(key, *fields)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hdel : {e}")
+            return 0
+
+    async def smembers(self, key: str) -> Set[str]:
+        try:
+            if not self.__validate(key=key):
+                return set()
+            return set(await self._redis.smembers(key))
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis smembers : {e}")
+            return set()
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            if not self.__validate(key=key):
+                return None
+            return await self._redis.get(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis get : {e}")
+            return None
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None, only_if_absent: bool = False) -> bool:
+        """set key , expiring after ttl_ms if given
+        :return False if key was not set , eg only_if_absent and key exists"""
+        try:
+            if not self.__validate(key=key):
+                return False
+            return bool(await self._redis.set(key, value, px=ttl_ms, nx=only_if_absent))
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis set : {e}")
+            return False
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        try:
+            if not self.__validate() or not keys:
+                return [None] * len(keys)
+            return await self._redis.mget(keys)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis mget : {e}")
+            return [None] * len(keys)
+
+    async def delete(self, keys: List[str]) -> int:
+        try:
+            if not self.__validate() or not keys:
+                return 0
+            return await self._redis.delete(*keys)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis delete : {e}")
+            return 0
+
+    async def hset(self, key: str, mapping: dict) -> bool:
+        try:
+            if not self.__validate(key=key):
+                return False
+            return await self._redis.hset(name=key, mapping=mapping)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hset : {e}")
+            return False
+
+    async def hset_multiple(self, key_mappings: Dict[str, dict]) -> bool:
+        """set fields on multiple hashes in a single pipelined round trip"""
+        try:
+            if not self.__validate() or not key_mappings:
+                return False
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                for key, mapping in key_mappings.items():
+                    pipeline.hset(name=key, mapping=mapping)
+                await pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hset_multiple : {e}")
+            return False
+
+    async def hset_multiple_and_publish(self, topic: str, msg: str, key_mappings: Dict[str, dict],
+                                        key_scores: Dict[str, dict] = None,
+                                        key_members_to_remove: Dict[str, List[str]] = None) -> bool:
+        """set fields on multiple hashes , scores of sorted set members , remove set members and publish on given
+        topic in a single pipelined round trip"""
+        try:
+            if not self.__validate() or not key_mappings:
+                return False
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                for key, mapping in key_mappings.items():
+                    pipeline.hset(name=key, mapping=mapping)
+                for key, scores in (key_scores or {}).items():
+                    pipeline.zadd(key, scores)
+                for key, members in (key_members_to_remove or {}).items():
+                    pipeline.srem(key, *members)
+                pipeline.publish(topic, msg)
+                await pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hset_multiple_and_publish : {e}")
+            return False
+
+    async def xadd_multiple(self, stream_entries: List[Tuple[str, str, dict, int]],
+                            key_mappings: Dict[str, dict] = None,
+                            key_fields_to_delete: Dict[str, List[str]] = None) -> int:
+        """append entries (key , entry id , fields , approximate max length of stream) to streams , delete and set
+        hash fields , all in a single pipelined round trip. hash fields are deleted before they are set
+        :return number of entries appended , an entry whose id is not newer than the last entry of its stream is
+        rejected by redis without failing the others"""
+        try:
+            if not self.__validate() or not (stream_entries or key_mappings or key_fields_to_delete):
+                return 0
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                for key, entry_id, fields, max_length in stream_entries:
+                    pipeline.xadd(key, fields, id=entry_id, maxlen=max_length, approximate=True)
+                for key, fields in (key_fields_to_delete or {}).items():
+                    pipeline.hdel(key, *fields)
+                for key, mapping in (key_mappings or {}).items():
+                    pipeline.hset(name=key, mapping=mapping)
+                results = await pipeline.execute(raise_on_error=False)
+            return sum(1 for result in results[:len(stream_entries)] if not isinstance(result, Exception))
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis xadd_multiple : {e}")
+            return 0
+
+    async def xrange(self, key: str, min_id: str = "-", max_id: str = "+",
+                     count: int = None) -> List[Tuple[str, dict]]:
+        """entries of stream with id between min_id and max_id (both inclusive) , oldest first"""
+        try:
+            if not self.__validate(key=key):
+                return []
+            return await self._redis.xrange(key, min=min_id, max=max_id, count=count)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis xrange : {e}")
+            return []
+
+    async def xgroup_create(self, key: str, group: str) -> bool:
+        """create consumer group of stream (and the stream) reading from its first entry , group already present is
+        left as is"""
+        try:
+            if not self.__validate(key=key):
+                return False
+            return await self._redis.xgroup_create(key, group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" in str(e):
+                return True
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis xgroup_create : {e}")
+            return False
+
+    async def xreadgroup(self, key: str, group: str, consumer: str, count: int,
+                         block_ms: int) -> Optional[List[Tuple[str, dict]]]:
+        """entries of stream never delivered to group , delivered to consumer and pending till acked , blocks up to
+        block_ms waiting for entries
+        :return None if stream could not be read , eg group was deleted along with the stream"""
+        try:
+            if not self.__validate(key=key):
+                return None
+            streams = await self._redis.xreadgroup(group, consumer, {key: ">"}, count=count, block=block_ms)
+            return streams[0][1] if streams else []
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis xreadgroup : {e}")
+            return None
+
+    async def xclaim_idle(self, key: str, group: str, consumer: str, min_idle_ms: int,
+                          count: int) -> List[Tuple[str, dict]]:
+        """claim entries pending in group (delivered and not acked) for at least min_idle_ms , from any consumer"""
+        try:
+            if not self.__validate(key=key):
+                return []
+            pending: List[dict] = await self._redis.xpending_range(key, group, min="-", max="+", count=count)
+            entry_ids = [entry["message_id"] for entry in pending if entry["time_since_delivered"] >= min_idle_ms]
+            if not entry_ids:
+                return []
+            # entries acked or claimed by others since they were listed are left out by redis
+            return [entry for entry in await self._redis.xclaim(key, group, consumer, min_idle_ms, entry_ids)
+                    if entry and entry[1]]
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis xclaim_idle : {e}")
+            return []
+
+    async def xack_and_delete(self, key: str, group: str, entry_ids: List[str]) -> int:
+        """ack entries of group and delete them from stream , stream is read by a single group
+        :return number of entries acked"""
+        try:
+            if not self.__validate(key=key) or not entry_ids:
+                return 0
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                pipeline.xack(key, group, *entry_ids)
+                pipeline.xdel(key, *entry_ids)
+                return (await pipeline.execute())[0]
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis xack_and_delete : {e}")
+            return 0
+
+    async def xgroup_delete_idle_consumers(self, key: str, group: str, min_idle_ms: int,
+                                           keep_consumer: str) -> int:
+        """delete consumers of group with no pending entries that did not read for at least min_idle_ms
+        :return number of consumers deleted"""
+        try:
+            if not self.__validate(key=key):
+                return 0
+            deleted = 0
+            for consumer in await self._redis.xinfo_consumers(key, group):
+                if consumer["name"] != keep_consumer and not consumer["pending"] and consumer["idle"] >= min_idle_ms:
+                    await self._redis.xgroup_delconsumer(key, group, consumer["name"])
+                    deleted += 1
+            return deleted
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"error in async redis xgroup_delete_idle_consumers : {e}")
+            return 0
+
+    async def hget(self, key: str, field: str) -> Optional[str]:
+        try:
+            if not self.__validate(key=key):
+                return None
+            return await self._redis.hget(key, field)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hget : {e}")
+            return None
+
+    async def hgetall(self, key: str) -> dict:
+        try:
+            if not self.__validate(key=key):
+                return {}
+            return await self._redis.hgetall(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hgetall : {e}")
+            return {}
+
+    async def mget_and_hgetall(self, keys: List[str], hash_key: str) -> Optional[Tuple[List[Optional[str]], dict]]:
+        """values of keys and whole hash read in a single transaction , so that they are consistent with each other
+        :return None if redis could not be read"""
+        try:
+            if not self.__validate(key=hash_key):
+                return None
+            async with self._redis.pipeline(transaction=True) as pipeline:
+                pipeline.mget(keys)
+                pipeline.hgetall(hash_key)
+                values, mapping = await pipeline.execute()
+            return values, mapping
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis mget_and_hgetall : {e}")
+            return None
+
+    async def hmget(self, key: str, fields: List[str]) -> List[Optional[str]]:
+        """get multiple fields from hash"""
+        try:
+            if not self.__validate(key=key):
+                return [None] * len(fields)
+            return await self._redis.hmget(key, fields)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hget_multiple : {e}")
+            return [None] * len(fields)
+
+    async def hmget_with_scores(self, key: str, score_key: str, fields: List[str]) \
+            -> Tuple[List[Optional[str]], List[Optional[float]]]:
+        """get multiple fields from hash and scores of the same members of a sorted set in a single round trip
+        a failed score lookup only nulls the scores , values of hash are still returned"""
+        try:
+            if not self.__validate(key=key):
+                return [None] * len(fields), [None] * len(fields)
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                pipeline.hmget(key, fields)
+                self.__add_score_lookup(pipeline, score_key, fields)
+                values, *scores = await pipeline.execute(raise_on_error=False)
+            if isinstance(values, Exception):
+                raise values
+            return values, self.__read_scores(scores, len(fields))
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hmget_with_scores : {e}")
+            return [None] * len(fields), [None] * len(fields)
+
+    async def zmscore(self, key: str, members: List[str]) -> List[Optional[float]]:
+        """scores of multiple members of sorted set , None for members not in it"""
+        try:
+            if not self.__validate(key=key) or not members:
+                return [None] * len(members)
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                self.__add_score_lookup(pipeline, key, members)
+                scores = await pipeline.execute(raise_on_error=False)
+            return self.__read_scores(scores, len(members))
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis zmscore : {e}")
+            return [None] * len(members)
+
+    def __add_score_lookup(self, pipeline, key: str, members: List[str]) -> None:
+        if self.__zmscore_supported:
+            pipeline.zmscore(key, members)
+        else:
+            for member in members:
+                pipeline.zscore(key, member)
+
+    def __read_scores(self, replies: list, count: int) -> List[Optional[float]]:
+        """scores out of replies of commands added by __add_score_lookup , all None if lookup failed"""
+        error = next((reply for reply in replies if isinstance(reply, Exception)), None)
+        if error is None:
+            return replies[0] if self.__zmscore_supported else replies
+        if self.__zmscore_supported and isinstance(error, ResponseError) and "unknown command" in str(error).lower():
+            self.__zmscore_supported = False
+            logger.info(extra=context_log_meta.get(), msg=f"async redis: ZMSCORE not supported (redis < 6.2) , "
+                                                          f"reading scores with ZSCORE")
+        else:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis score lookup : {error}")
+        return [None] * count
+
+    async def hkeys(self, key: str) -> List[str]:
+        try:
+            if not self.__validate(key=key):
+                return []
+            return await self._redis.hkeys(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis hkeys : {e}")
+            return []
+
+    async def publish(self, topic: str, msg: str) -> None:
+        """publish message on given topic"""
+        try:
+            if not self.__validate():
+                return
+            await self._redis.publish(topic, msg)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis publish : {e}")
+            return
+
+    async def sadd_and_publish(self, topic: str, msg: str, key: str, values: List[str]) -> int:
+        """add data to set and publish on given topic"""
+        try:
+            if not self.__validate(key=key):
+                return 0
+            async with self._redis.pipeline() as pipeline:
+                pipeline.sadd(key, *values)
+                pipeline.publish(topic, msg)
+                return (await pipeline.execute())[0]
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis sadd_and_publish : {e}")
+            return 0
+
+    async def smembers_and_delete(self, key: str) -> Set[str]:
+        """get smembers and delete key"""
+        try:
+            if not self.__validate(key=key):
+                return set()
+            async with self._redis.pipeline() as pipeline:
+                pipeline.smembers(key)
+                pipeline.delete(key)
+                return set((await pipeline.execute())[0])
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in async redis smembers_and_delete : {e}")
+            return set()
+
+    def pubsub(self) -> Optional[PubSub]:
+        """new pubsub on its own connection , caller owns it and should close it"""
+        if not self.__validate():
+            return None
+        return self._redis.pubsub(ignore_subscribe_messages=True)
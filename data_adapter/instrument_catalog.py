@@ -0,0 +1,152 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import orjson
+
+from config.constants import RedisKeys
+from config.settings import InstrumentCatalogConfig
+from data_adapter.async_redis import AsyncCache
+from data_adapter.sensi_data import SensiUnderlying, SensiDerivative
+from data_adapter.token_registry import TokenRegistry
+from models.sensi_models import SensiResModel
+from utils.utils import Singleton
+
+
+class CatalogEntry:
+    """instruments of a catalog key along with the static part of their json encoding
+    every encoded prefix is the json object of the instrument without its closing brace and with price key last,
+    response is built by splicing encoded live price and closing brace after the prefix"""
+    __slots__ = ("instruments", "tokens", "token_ids", "token_ids_resolved_at", "encoded_prefixes", "version_tag",
+                 "option_inputs")
+
+    def __init__(self, instruments: List[SensiResModel], version_tag: str):
+        self.instruments = instruments
+        self.tokens: List[str] = [instrument.token for instrument in instruments]
+        # registry ids of tokens , resolved on first read of prices
+        self.token_ids: Optional[List[Optional[int]]] = None
+        self.token_ids_resolved_at = 0
+        self.encoded_prefixes: List[bytes] = [
+            orjson.dumps(instrument.dict(exclude={"price"}))[:-1] + b',"price":' for instrument in instruments]
+        # identifies catalog version and key , used as seed of etags of responses built from this entry
+        self.version_tag = version_tag.encode()
+        # arrays of option fields used for greeks , built on first request for greeks
+        self.option_inputs = None
+
+    def get_token_ids(self) -> List[Optional[int]]:
+        """registry ids of tokens , resolved again once registry loaded or released ids since"""
+        registry_version = TokenRegistry.get_instance().get_version()
+        if self.token_ids is None or self.token_ids_resolved_at != registry_version:
+            self.token_ids = TokenRegistry.get_instance().get_ids(self.tokens)
+            self.token_ids_resolved_at = registry_version
+        return self.token_ids
+
+
+@Singleton
+class InstrumentCatalog:
+    """versioned in memory catalog of instrument metadata of the node
+    instrument universe only changes when sync jobs insert rows , sync jobs bump the catalog version in redis and
+    publish it. Catalog serves underlyings and derivatives by symbol from memory and is dropped and lazily reloaded
+    from db only when the published version differs from the version it was loaded at.
+    Derivatives are kept for at most max_symbols underlying symbols , least recently used symbol is evicted."""
+
+    def __init__(self):
+        self.__max_symbols = InstrumentCatalogConfig.max_symbols
+        self.__version_check_interval = InstrumentCatalogConfig.version_check_interval_ms / 1000
+        # version entries were loaded at , -1 till anything is loaded
+        self.__version = -1
+        # latest version published by sync jobs
+        self.__remote_version = 0
+        self.__version_checked_at: Optional[float] = None
+        self.__underlyings: Optional[CatalogEntry] = None
+        self.__derivatives_by_symbol: "OrderedDict[str, CatalogEntry]" = OrderedDict()
+        self.__entities_by_token: Dict[str, SensiResModel] = {}
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__reloads = 0
+        self.__last_load_ms = 0.0
+
+    def set_remote_version(self, version: int) -> None:
+        """register the latest catalog version published by sync jobs"""
+        self.__remote_version = version
+        self.__version_checked_at = time.monotonic()
+
+    async def __ensure_fresh(self) -> None:
+        """drop loaded entries if catalog version has moved since they were loaded"""
+        now = time.monotonic()
+        if self.__version_checked_at is None or now - self.__version_checked_at >= self.__version_check_interval:
+            self.__version_checked_at = now
+            remote_version = await AsyncCache.get_instance().get(RedisKeys.INSTRUMENT_CATALOG_VERSION)
+            if remote_version is not None:
+                self.__remote_version = int(remote_version)
+        if self.__remote_version != self.__version:
+            if self.__version != -1:
+                self.__reloads += 1
+            self.__underlyings = None
+            self.__derivatives_by_symbol.clear()
+            self.__entities_by_token.clear()
+            self.__version = self.__remote_version
+
+    def get_version(self) -> int:
+        """catalog version entries are loaded at , used to seed etags of responses built outside the catalog"""
+        return self.__version
+
+    def __index_by_token(self, entry: CatalogEntry) -> None:
+        for entity in entry.instruments:
+            self.__entities_by_token[entity.token] = entity
+
+    async def get_underlyings(self) -> CatalogEntry:
+        """returns all underlyings , entry is shared across requests and must not be mutated"""
+        await self.__ensure_fresh()
+        if self.__underlyings is None:
+            self.__misses += 1
+            start = time.perf_counter()
+            self.__underlyings = CatalogEntry(SensiUnderlying.get_all_underlying(),
+                                              version_tag=f"{self.__version}:underlyings")
+            self.__last_load_ms = (time.perf_counter() - start) * 1000
+            self.__index_by_token(self.__underlyings)
+        else:
+            self.__hits += 1
+        return self.__underlyings
+
+    async def get_derivatives_by_underlying_symbol(self, symbol: str) -> CatalogEntry:
+        """returns all derivatives of underlying symbol , entry is shared across requests and must not be mutated"""
+        await self.__ensure_fresh()
+        derivatives = self.__derivatives_by_symbol.get(symbol)
+        if derivatives is None:
+            self.__misses += 1
+            start = time.perf_counter()
+            derivatives = CatalogEntry(SensiDerivative.get_all_derivative_by_underlying_symbol(symbol=symbol),
+                                       version_tag=f"{self.__version}:derivatives:{symbol}")
+            self.__last_load_ms = (time.perf_counter() - start) * 1000
+            self.__derivatives_by_symbol[symbol] = derivatives
+            self.__index_by_token(derivatives)
+            if len(self.__derivatives_by_symbol) > self.__max_symbols:
+                _, evicted = self.__derivatives_by_symbol.popitem(last=False)
+                for entity in evicted.instruments:
+                    self.__entities_by_token.pop(entity.token, None)
+                self.__evictions += 1
+        else:
+            self.__hits += 1
+            self.__derivatives_by_symbol.move_to_end(symbol)
+        return derivatives
+
+    async def get_by_token(self, token: str) -> Optional[SensiResModel]:
+        """returns instrument of token if it is loaded in the catalog"""
+        await self.__ensure_fresh()
+        entity = self.__entities_by_token.get(token)
+        return entity.copy() if entity else None
+
+    def get_stats(self) -> dict:
+        """counters of the catalog"""
+        return {
+            "version": self.__version,
+            "symbols": len(self.__derivatives_by_symbol),
+            "tokens": len(self.__entities_by_token),
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "evictions": self.__evictions,
+            "reloads": self.__reloads,
+            "last_load_ms": round(self.__last_load_ms, 3),
+        }
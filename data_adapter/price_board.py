@@ -0,0 +1,293 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import PriceBoardConfig, PriceTableConfig
+from controller.context_manager import context_log_meta
+from data_adapter.token_registry import TokenRegistry
+from logger import logger
+from utils.utils import Singleton
+
+MAGIC = 0x5345_4E53_4942_5232
+# header is magic , capacity , seqlock counter
+HEADER_FIELDS = 3
+SEQ_FIELD = 2
+
+
+@Singleton
+class PriceBoard:
+    """latest prices shared by all processes of a host through a memory mapped file at PRICE_BOARD_PATH
+    layout is fixed , header | token tags (capacity uint64) | prices (capacity float64) | updated at (capacity
+    float64). Slots are indexed by token id of TokenRegistry like PriceTable , so a slot is reused along with the id
+    once the expiry purge releases it and the board holds as many tokens as are live at once. Tokens without an id or
+    with an id beyond capacity are left to redis.
+    Processes of the host may load registry changes at different times , so every slot carries a tag (64 bit hash) of
+    the token it was written for and a read serves a slot only for that token , writers clear slots of ids their
+    registry released. Every process keeps tags of the tokens of its registry in an array indexed by id , so checking
+    slots is an array index and not a hash of every token. Slots of a read / write are gathered and scattered with
+    numpy over views of the mapping instead of element by element.
+    Ingest side (tick writer of any process of the host) writes a flush window under an exclusive file lock , inside a
+    seqlock (counter is odd while writing). Readers do not lock , they copy prices straight from the mapping and retry
+    if the counter moved , so uvicorn workers of the host read prices without a redis round trip.
+    A mapped board is never resized in place (readers of a truncated mapping would fault) , a writer that finds a board
+    of another layout builds a new file and renames it over the path , attached processes notice the new file within
+    a second and remap."""
+
+    def __init__(self):
+        self.__path = PriceBoardConfig.path
+        self.__capacity = PriceBoardConfig.capacity
+        self.__max_staleness = PriceTableConfig.max_staleness_ms / 1000
+        self.__fd: Optional[int] = None
+        self.__header = None
+        self.__tags = None
+        self.__prices = None
+        self.__updated_at = None
+        # tags of tokens of the registry by id , 0 where not built yet
+        self.__token_tags = np.zeros(0, dtype=np.uint64)
+        # registry version token tags (and slots , on writer side) were last checked against , -1 checks all
+        self.__registry_version = -1
+        self.__last_attach_attempt = 0.0
+        self.__last_replace_check = 0.0
+        # counters for observability
+        self.__hits = 0
+        self.__misses = 0
+        self.__retries = 0
+
+    def is_enabled(self) -> bool:
+        return bool(self.__path)
+
+    def __attach(self, create: bool) -> bool:
+        """map board file , writer creates it , readers wait for a writer to create it"""
+        if self.__header is not None and not self.__is_replaced():
+            return True
+        if not self.__path or (not create and time.time() - self.__last_attach_attempt < 1):
+            return False
+        self.__last_attach_attempt = time.time()
+        size = HEADER_FIELDS * 8 + self.__capacity * 24
+        if not create and not os.path.exists(self.__path):
+            return False
+        try:
+            fd = os.open(self.__path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # a writer may have replaced the file while we waited for the lock , next attempt opens the new one
+                board = self.__map(fd, size, create) if os.stat(self.__path).st_ino == os.fstat(fd).st_ino else None
+                if board is None and create and os.fstat(fd).st_nlink:
+                    replaced_fd, board = self.__replace(size)
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+                    fd = replaced_fd
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            if board is None:
+                # board of a different capacity , or not initialised by a writer yet
+                os.close(fd)
+                return False
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"price_board: could not map {self.__path} : {e}")
+            return False
+        tags_end = HEADER_FIELDS * 8 + self.__capacity * 8
+        self.__fd = fd
+        self.__header = board[:HEADER_FIELDS * 8].cast('Q')
+        self.__tags = np.frombuffer(board, dtype=np.uint64, count=self.__capacity, offset=HEADER_FIELDS * 8)
+        self.__prices = np.frombuffer(board, dtype=np.float64, count=self.__capacity, offset=tags_end)
+        self.__updated_at = np.frombuffer(board, dtype=np.float64, count=self.__capacity,
+                                          offset=tags_end + self.__capacity * 8)
+        self.__last_replace_check = time.time()
+        return True
+
+    def __map(self, fd: int, size: int, create: bool) -> Optional[memoryview]:
+        """map locked board file , writer initialises a file it just created (empty , so mapped by nobody)
+        :return None if file has another layout"""
+        if create and os.fstat(fd).st_size == 0:
+            os.ftruncate(fd, size)
+            self.__init_header(fd, size)
+        if os.fstat(fd).st_size != size:
+            return None
+        board = memoryview(mmap.mmap(fd, size))
+        header = board[:HEADER_FIELDS * 8].cast('Q')
+        if header[0] != MAGIC or header[1] != self.__capacity:
+            header.release()
+            board.release()
+            return None
+        header.release()
+        return board
+
+    def __init_header(self, fd: int, size: int) -> None:
+        with mmap.mmap(fd, size) as board:
+            header = memoryview(board)[:HEADER_FIELDS * 8].cast('Q')
+            header[1], header[SEQ_FIELD] = self.__capacity, 0
+            header[0] = MAGIC
+            header.release()
+
+    def __replace(self, size: int) -> Tuple[int, memoryview]:
+        """build a board in a new file and rename it over the board of another layout , processes that mapped the old
+        file keep a valid mapping of it till they remap
+        :return locked fd and mapping of the new board"""
+        temp_path = f"{self.__path}.{os.getpid()}.tmp"
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.ftruncate(fd, size)
+            self.__init_header(fd, size)
+            os.rename(temp_path, self.__path)
+        except Exception:
+            os.close(fd)
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        logger.info(extra=context_log_meta.get(), msg=f"price_board: replaced {self.__path} of another layout")
+        return fd, memoryview(mmap.mmap(fd, size))
+
+    def __is_replaced(self) -> bool:
+        """checks at most once a second if the board file was replaced by a writer , drops the stale mapping if so"""
+        if time.time() - self.__last_replace_check < 1:
+            return False
+        self.__last_replace_check = time.time()
+        try:
+            replaced = os.stat(self.__path).st_ino != os.fstat(self.__fd).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if not replaced:
+            return False
+        logger.info(extra=context_log_meta.get(), msg=f"price_board: {self.__path} was replaced , remapping")
+        os.close(self.__fd)
+        self.__fd = self.__header = self.__tags = self.__prices = self.__updated_at = None
+        # slots of the new board are checked against the registry as a whole on next write
+        self.__registry_version = -1
+        return True
+
+    @staticmethod
+    def build_tag(token: str) -> int:
+        """64 bit hash of token , same in every process (unlike hash()) , 0 is left for empty slots"""
+        return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little") or 1
+
+    def __get_tags(self, slots: np.ndarray) -> np.ndarray:
+        """tags of tokens having slots as ids in the registry of this process , 0 for slot -1 (token not on the board)
+        and ids without a token , tags are looked up by index and only built for ids seen the first time"""
+        registry = TokenRegistry.get_instance()
+        if len(self.__token_tags) < min(registry.get_size(), self.__capacity):
+            self.__token_tags = np.concatenate([self.__token_tags, np.zeros(
+                min(registry.get_size(), self.__capacity) - len(self.__token_tags), dtype=np.uint64)])
+        tags = np.zeros(len(slots), dtype=np.uint64)
+        known = (slots >= 0) & (slots < len(self.__token_tags))
+        tags[known] = self.__token_tags[slots[known]]
+        for i in np.flatnonzero(known & (tags == 0)):
+            token = registry.get_token(int(slots[i]))
+            if token is not None:
+                tags[i] = self.__token_tags[slots[i]] = self.build_tag(token)
+        return tags
+
+    def __sync_registry(self, clear_slots: bool) -> None:
+        """drop tags of ids released since last check , all tags if registry no longer has those releases
+        :param clear_slots: also clear slots of those ids , called by writer under the lock while seqlock counter is
+            odd. A slot another writer already gave to the new token of a reused id is kept"""
+        registry = TokenRegistry.get_instance()
+        released: Optional[List[int]] = registry.get_released_ids(self.__registry_version) if \
+            self.__registry_version >= 0 else None
+        self.__registry_version = registry.get_version()
+        if released is None:
+            self.__token_tags = np.zeros(0, dtype=np.uint64)
+        else:
+            released_ids = np.array(released, dtype=np.int64)
+            self.__token_tags[released_ids[released_ids < len(self.__token_tags)]] = 0
+        if not clear_slots:
+            return
+        # ids not loaded by this process yet may belong to tokens other writers know of , those are left as they are
+        slots = np.arange(min(self.__capacity, registry.get_size())) if released is None else \
+            released_ids[released_ids < self.__capacity]
+        slots = slots[self.__tags[slots] != 0]
+        stale = slots[self.__tags[slots] != self.__get_tags(slots)]
+        self.__tags[stale] = 0
+        self.__updated_at[stale] = 0.0
+
+    def write_many(self, token_prices: Dict[str, float], updated_at: Optional[float] = None) -> int:
+        """write prices of a flush window , called from ingest side
+        :return number of prices written , tokens that do not fit in the board are left to redis"""
+        if not token_prices or not self.__attach(create=True):
+            return 0
+        updated_at = updated_at or time.time()
+        registry = TokenRegistry.get_instance()
+        fcntl.flock(self.__fd, fcntl.LOCK_EX)
+        try:
+            if registry.get_version() != self.__registry_version:
+                self.__header[SEQ_FIELD] += 1
+                try:
+                    self.__sync_registry(clear_slots=True)
+                finally:
+                    self.__header[SEQ_FIELD] += 1
+            # slots and tags are looked up before the seqlock , so readers retry only while prices are copied
+            slots = self.__get_slots(registry.get_ids(list(token_prices)))
+            on_board = slots >= 0
+            slots = slots[on_board]
+            prices = np.array(list(token_prices.values()), dtype=np.float64)[on_board]
+            tags = self.__get_tags(slots)
+            self.__header[SEQ_FIELD] += 1
+            try:
+                self.__tags[slots] = tags
+                self.__prices[slots] = prices
+                self.__updated_at[slots] = updated_at
+            finally:
+                self.__header[SEQ_FIELD] += 1
+        finally:
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
+        return len(slots)
+
+    def __get_slots(self, token_ids: List[Optional[int]]) -> np.ndarray:
+        """slots of token ids , -1 for tokens without an id or with an id beyond capacity"""
+        slots = np.array(token_ids if None not in token_ids else [
+            -1 if token_id is None else token_id for token_id in token_ids], dtype=np.int64)
+        slots[slots >= self.__capacity] = -1
+        return slots
+
+    def get_many(self, tokens: List[str], token_ids: Optional[List[Optional[int]]] = None) \
+            -> Optional[List[Optional[float]]]:
+        """returns prices in order of tokens , None for tokens not present or older than the staleness bound
+        :param token_ids: registry ids of tokens if caller has them
+        :return None if board is not available on this host"""
+        if not self.__attach(create=False):
+            return None
+        registry = TokenRegistry.get_instance()
+        if registry.get_version() != self.__registry_version:
+            self.__sync_registry(clear_slots=False)
+        slots = self.__get_slots(registry.get_ids(tokens) if token_ids is None else token_ids)
+        # tag every slot has to carry , a slot written for another token is not served
+        tags = self.__get_tags(slots)
+        for _ in range(PriceBoardConfig.max_read_retries):
+            seq = self.__header[SEQ_FIELD]
+            if seq % 2:
+                self.__retries += 1
+                continue
+            board_tags, prices, updated_at = self.__tags[slots], self.__prices[slots], self.__updated_at[slots]
+            if self.__header[SEQ_FIELD] == seq:
+                break
+            self.__retries += 1
+        else:
+            # writer kept the board busy , caller falls back to other sources
+            self.__misses += len(tokens)
+            return [None] * len(tokens)
+        served = (tags != 0) & (board_tags == tags) & (updated_at >= time.time() - self.__max_staleness)
+        hits = int(served.sum())
+        self.__hits += hits
+        self.__misses += len(tokens) - hits
+        prices = prices.astype(object)
+        prices[~served] = None
+        return prices.tolist()
+
+    def get_stats(self) -> dict:
+        """hit/miss counters of the price board"""
+        lookups = self.__hits + self.__misses
+        return {
+            "enabled": self.is_enabled(),
+            "attached": self.__header is not None,
+            "capacity": self.__capacity,
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "read_retries": self.__retries,
+            "hit_ratio": round(self.__hits / lookups, 4) if lookups else 0.0,
+        }
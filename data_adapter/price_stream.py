@@ -0,0 +1,127 @@
+import asyncio
+from typing import Dict, Set, List, Iterable
+
+import orjson
+
+from utils.utils import Singleton
+
+
+class PriceStreamSubscriber:
+    """state of a single streaming client connection
+    prices pushed between two sends are conflated to the latest price per token , so a slow client gets the latest
+    value of every token instead of an unbounded backlog. Only tokens whose price changed since the last send
+    are sent to the client (delta encoding)."""
+
+    def __init__(self):
+        self.tokens: Set[str] = set()
+        self.__pending: Dict[str, float] = {}
+        self.__last_sent: Dict[str, float] = {}
+        self.__messages: List[bytes] = []
+        self.__event = asyncio.Event()
+
+    def push(self, token: str, price: float) -> bool:
+        """queue latest price of token for next send
+        :return: True if an unsent price of the token was overwritten"""
+        conflated = token in self.__pending
+        self.__pending[token] = price
+        self.__event.set()
+        return conflated
+
+    def push_message(self, message: bytes) -> None:
+        """queue an already encoded message , sent before pending prices"""
+        self.__messages.append(message)
+        self.__event.set()
+
+    def mark_sent(self, token_prices: Dict[str, float]) -> None:
+        """register prices client already has , eg prices sent in a snapshot"""
+        self.__last_sent.update(token_prices)
+
+    def forget(self, tokens: Iterable[str]) -> None:
+        for token in tokens:
+            self.__pending.pop(token, None)
+            self.__last_sent.pop(token, None)
+
+    async def next_messages(self) -> List[bytes]:
+        """wait till there is something to send and return encoded messages"""
+        while True:
+            await self.__event.wait()
+            self.__event.clear()
+            messages, self.__messages = self.__messages, []
+            pending, self.__pending = self.__pending, {}
+            delta = {token: price for token, price in pending.items() if self.__last_sent.get(token) != price}
+            if delta:
+                self.__last_sent.update(delta)
+                messages.append(orjson.dumps({"type": "delta", "prices": delta}))
+            if messages:
+                return messages
+
+
+@Singleton
+class PriceStreamHub:
+    """fan out of prices to streaming client connections of the node
+    subscribers are indexed by token , so a price update costs a dict lookup plus a push per subscriber of that
+    token. Prices are pushed from broker ws listener on every tick and from price delta feed for tokens
+    subscribed on other nodes. All methods must be called from the app event loop."""
+
+    def __init__(self):
+        self.__subscribers_by_token: Dict[str, Set[PriceStreamSubscriber]] = {}
+        self.__subscribers: Set[PriceStreamSubscriber] = set()
+        self.__pushed = 0
+        self.__conflated = 0
+
+    def subscribe(self, subscriber: PriceStreamSubscriber, tokens: Iterable[str]) -> None:
+        self.__subscribers.add(subscriber)
+        for token in tokens:
+            subscriber.tokens.add(token)
+            self.__subscribers_by_token.setdefault(token, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: PriceStreamSubscriber, tokens: Iterable[str]) -> None:
+        tokens = list(tokens)
+        for token in tokens:
+            subscriber.tokens.discard(token)
+            token_subscribers = self.__subscribers_by_token.get(token)
+            if token_subscribers is None:
+                continue
+            token_subscribers.discard(subscriber)
+            if not token_subscribers:
+                del self.__subscribers_by_token[token]
+        subscriber.forget(tokens)
+
+    def unregister(self, subscriber: PriceStreamSubscriber) -> None:
+        """remove subscriber from all its tokens , to be called when connection closes"""
+        self.unsubscribe(subscriber, list(subscriber.tokens))
+        self.__subscribers.discard(subscriber)
+
+    def publish(self, token: str, price: float) -> None:
+        """push price of token to all its subscribers"""
+        subscribers = self.__subscribers_by_token.get(token)
+        if not subscribers:
+            return
+        for subscriber in subscribers:
+            self.__pushed += 1
+            if subscriber.push(token, price):
+                self.__conflated += 1
+
+    def publish_many(self, token_prices: Dict[str, float]) -> None:
+        for token, price in token_prices.items():
+            self.publish(token, price)
+
+    def publish_stale(self, tokens: Iterable[str]) -> None:
+        """tell subscribers of tokens that their prices stopped updating , first price after that is sent even if
+        unchanged"""
+        stale_tokens_by_subscriber: Dict[PriceStreamSubscriber, List[str]] = {}
+        for token in tokens:
+            for subscriber in self.__subscribers_by_token.get(token, ()):
+                stale_tokens_by_subscriber.setdefault(subscriber, []).append(token)
+        for subscriber, stale_tokens in stale_tokens_by_subscriber.items():
+            subscriber.forget(stale_tokens)
+            subscriber.push_message(orjson.dumps({"type": "stale", "tokens": stale_tokens}))
+
+    def get_stats(self) -> dict:
+        """counters of price stream fan out"""
+        return {
+            "connections": len(self.__subscribers),
+            "tokens": len(self.__subscribers_by_token),
+            "pushed": self.__pushed,
+            "conflated": self.__conflated,
+        }
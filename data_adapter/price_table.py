@@ -0,0 +1,131 @@
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from config.settings import PriceTableConfig
+from data_adapter.token_registry import TokenRegistry
+from utils.utils import Singleton
+
+
+@Singleton
+class PriceTable:
+    """in process snapshot of latest prices , shared by broker ws listener and request handlers of the node
+    prices and their update times are kept in arrays indexed by token id of TokenRegistry , so a read is an array
+    index (get_many_by_ids) or a registry lookup and an array index (get_many) instead of a redis round trip.
+    Tokens not in the registry yet are not kept , readers fall back to price board / redis for them.
+    Along with the time an entry was written to the table (bounded by max staleness) the table keeps the time price
+    was last updated at its source (tick , or ENTITY_PRICE_UPDATED_AT when read back from redis) for staleness checks
+    of callers.
+    Node subscribed to the token from broker ws updates it from ticks directly , other nodes update it from the
+    price delta feed published on redis. Entries of ids released by the registry are dropped before the table is
+    read or written , so a reused id never serves price of the token it belonged to before."""
+
+    def __init__(self):
+        self.__max_staleness = PriceTableConfig.max_staleness_ms / 1000
+        self.__prices = array('d')
+        self.__updated_at = array('d')
+        self.__ticked_at = array('d')
+        self.__tokens = 0
+        self.__registry_version = 0
+        self.__unregistered = 0
+        self.__hits = 0
+        self.__misses = 0
+
+    def __grow(self, size: int) -> None:
+        """arrays cover every id below size"""
+        if size > len(self.__prices):
+            extra = size - len(self.__prices)
+            self.__prices.extend(array('d', bytes(8 * extra)))
+            self.__updated_at.extend(array('d', bytes(8 * extra)))
+            self.__ticked_at.extend(array('d', bytes(8 * extra)))
+
+    def __drop_released(self) -> None:
+        """drop entries of ids released since last check , all entries if registry no longer has those releases"""
+        registry = TokenRegistry.get_instance()
+        if registry.get_version() == self.__registry_version:
+            return
+        released: Optional[List[int]] = registry.get_released_ids(self.__registry_version)
+        self.__registry_version = registry.get_version()
+        for token_id in range(len(self.__updated_at)) if released is None else released:
+            if token_id < len(self.__updated_at) and self.__updated_at[token_id]:
+                self.__updated_at[token_id] = 0.0
+                self.__tokens -= 1
+
+    def update(self, token: str, price: float, updated_at: Optional[float] = None,
+               ticked_at: Optional[float] = None) -> None:
+        """set latest price of token
+        :param ticked_at: time price was updated at its source , same as updated_at if not given"""
+        self.__drop_released()
+        token_id = TokenRegistry.get_instance().get_id(token)
+        if token_id is None:
+            self.__unregistered += 1
+            return
+        if token_id >= len(self.__prices):
+            self.__grow(max(token_id + 1, TokenRegistry.get_instance().get_size()))
+        if not self.__updated_at[token_id]:
+            self.__tokens += 1
+        self.__prices[token_id] = float(price)
+        self.__updated_at[token_id] = updated_at or time.time()
+        self.__ticked_at[token_id] = ticked_at or self.__updated_at[token_id]
+
+    def update_many(self, token_prices: Dict[str, float], updated_at: Optional[float] = None) -> None:
+        """set latest prices of multiple tokens"""
+        updated_at = updated_at or time.time()
+        for token, price in token_prices.items():
+            self.update(token=token, price=price, updated_at=updated_at)
+
+    def remove(self, tokens: List[str]) -> int:
+        """drop tokens from table , eg expired derivatives
+        :return number of tokens removed"""
+        removed = 0
+        for token_id in TokenRegistry.get_instance().get_ids(tokens):
+            if token_id is None or token_id >= len(self.__prices) or not self.__updated_at[token_id]:
+                continue
+            self.__updated_at[token_id] = 0.0
+            self.__tokens -= 1
+            removed += 1
+        return removed
+
+    def get_many(self, tokens: List[str]) -> List[Optional[float]]:
+        """returns prices in order of tokens , None for tokens not present or older than the staleness bound"""
+        return self.get_many_by_ids(TokenRegistry.get_instance().get_ids(tokens))
+
+    def get_many_by_ids(self, token_ids: List[Optional[int]]) -> List[Optional[float]]:
+        """returns prices in order of token ids , None for ids that are None , not present or older than the
+        staleness bound"""
+        self.__drop_released()
+        oldest_allowed = time.time() - self.__max_staleness
+        size = len(self.__prices)
+        prices: List[Optional[float]] = []
+        hits = 0
+        for token_id in token_ids:
+            if token_id is not None and token_id < size and self.__updated_at[token_id] >= oldest_allowed:
+                prices.append(self.__prices[token_id])
+                hits += 1
+            else:
+                prices.append(None)
+        self.__hits += hits
+        self.__misses += len(token_ids) - hits
+        return prices
+
+    def get_ticked_at_by_ids(self, token_ids: List[Optional[int]]) -> List[Optional[float]]:
+        """returns time price was updated at its source in order of token ids , None for ids that are None , not
+        present or older than the staleness bound , ie for prices get_many_by_ids would not serve"""
+        self.__drop_released()
+        oldest_allowed = time.time() - self.__max_staleness
+        size = len(self.__ticked_at)
+        return [self.__ticked_at[token_id] if token_id is not None and token_id < size and
+                self.__updated_at[token_id] >= oldest_allowed else None for token_id in token_ids]
+
+    def get_stats(self) -> dict:
+        """hit/miss counters of the price table"""
+        lookups = self.__hits + self.__misses
+        return {
+            "tokens": self.__tokens,
+            "capacity": len(self.__prices),
+            "unregistered_updates": self.__unregistered,
+            "max_staleness_ms": int(self.__max_staleness * 1000),
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "hit_ratio": round(self.__hits / lookups, 4) if lookups else 0.0,
+        }
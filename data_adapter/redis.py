@@ -1,6 +1,7 @@
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Any
 
 from redis import Redis
+from redis.exceptions import ResponseError
 
 from config.settings import REDIS
 from controller.context_manager import context_log_meta
@@ -17,6 +18,8 @@ class Cache:
         self.__redis_url = REDIS.url
         self._redis = self.__init_redis()
         self._pubsub = self._redis.pubsub()
+        # ZMSCORE needs redis 6.2 , scores are read with a ZSCORE per member on older servers
+        self.__zmscore_supported = True
 
     def __init_redis(self):
         try:
@@ -50,6 +53,145 @@ class Cache:
             logger.error(extra=context_log_meta.get(), msg=f"error in redis smembers : {e}")
             return set()
 
+    def srem(self, key: str, values: List[str]) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.srem(key, *values)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis srem : {e}")
+            return 0
+
+    def zrem(self, key: str, members: List[str]) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.zrem(key, *members)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis zrem : {e}")
+            return 0
+
+    def zmscore(self, key: str, members: List[str]) -> List[Optional[float]]:
+        try:
+            if not self.__validate(key=key) or not members:
+                return [None] * len(members)
+            if self.__zmscore_supported:
+                try:
+                    return self._redis.zmscore(key, members)
+                except ResponseError as e:
+                    if "unknown command" not in str(e).lower():
+                        raise
+                    self.__zmscore_supported = False
+            pipeline = self._redis.pipeline(transaction=False)
+            for member in members:
+                pipeline.zscore(key, member)
+            return pipeline.execute()
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis zmscore : {e}")
+            return [None] * len(members)
+
+    def scard(self, key: str) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.scard(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis scard : {e}")
+            return 0
+
+    def hdel(self, key: str, fields: List[str]) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.hdel(key, *fields)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis hdel : {e}")
+            return 0
+
+    def memory_usage(self, key: str) -> int:
+        """approximate bytes used by key and its value , 0 if key does not exist"""
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.memory_usage(key) or 0
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis memory_usage : {e}")
+            return 0
+
+    def delete(self, keys: List[str]) -> int:
+        try:
+            if not self.__validate():
+                return 0
+            return self._redis.delete(*keys)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis delete : {e}")
+            return 0
+
+    def dbsize(self) -> int:
+        try:
+            if not self.__validate():
+                return 0
+            return self._redis.dbsize()
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis dbsize : {e}")
+            return 0
+
+    def flushdb(self) -> bool:
+        """drop every key of the db , for scratch dbs of load tests"""
+        try:
+            if not self.__validate():
+                return False
+            return self._redis.flushdb()
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis flushdb : {e}")
+            return False
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            if not self.__validate(key=key):
+                return None
+            return self._redis.get(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis get : {e}")
+            return None
+
+    def set(self, key: str, value: str) -> bool:
+        try:
+            if not self.__validate(key=key):
+                return False
+            return self._redis.set(key, value)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis set : {e}")
+            return False
+
+    def incr(self, key: str) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.incr(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis incr : {e}")
+            return 0
+
+    def run_script(self, script: str, keys: List[str], args: List[Any]) -> Any:
+        """run lua script atomically on redis , script is sent once and run by its sha afterwards"""
+        try:
+            if not self.__validate():
+                return None
+            return self._redis.register_script(script)(keys=keys, args=args)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis run_script : {e}")
+            return None
+
+    def mget(self, keys: List[str]) -> List[Optional[str]]:
+        try:
+            if not self.__validate() or not keys:
+                return [None] * len(keys)
+            return self._redis.mget(keys)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis mget : {e}")
+            return [None] * len(keys)
+
     def hset(self, key: str, mapping: dict) -> bool:
         try:
             if not self.__validate(key=key):
@@ -78,6 +220,15 @@ class Cache:
             logger.error(extra=context_log_meta.get(), msg=f"error in redis hget_multiple : {e}")
             return {}
 
+    def hlen(self, key: str) -> int:
+        try:
+            if not self.__validate(key=key):
+                return 0
+            return self._redis.hlen(key)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis hlen : {e}")
+            return 0
+
     def hkeys(self, key: str) -> List[str]:
         try:
             if not self.__validate(key=key):
@@ -110,6 +261,26 @@ class Cache:
             logger.error(extra=context_log_meta.get(), msg=f"error in redis sadd_and_publish : {e}")
             return 0
 
+    def xadd_and_update_set(self, stream_key: str, entries: List[dict], key: str, values_to_add: List[str] = None,
+                            values_to_remove: List[str] = None) -> int:
+        """add / remove values of set and append entries to stream in a single transaction
+        :return number of entries appended"""
+        try:
+            if not self.__validate(key=key) or not entries:
+                return 0
+            pipeline = self._redis.pipeline()
+            if values_to_add:
+                pipeline.sadd(key, *values_to_add)
+            if values_to_remove:
+                pipeline.srem(key, *values_to_remove)
+            for entry in entries:
+                pipeline.xadd(stream_key, entry)
+            pipeline.execute()
+            return len(entries)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"error in redis xadd_and_update_set : {e}")
+            return 0
+
     def smembers_and_delete(self, key: str) -> Set[str]:
         """get smembers and delete key"""
         try:
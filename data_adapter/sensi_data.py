@@ -1,11 +1,16 @@
-from typing import List
+from datetime import date
+from typing import List, Tuple, Dict, Optional
 
-from sqlalchemy import Column, TIMESTAMP, Boolean, Integer, String, Float, ForeignKey, DATE
+from sqlalchemy import Column, TIMESTAMP, Boolean, Integer, String, Float, ForeignKey, DATE, UniqueConstraint, select, \
+    update, func, literal_column, tuple_, Index, false
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import backref, relationship
 
+from config.settings import DB
 from controller.context_manager import get_db_session
 from data_adapter.db import time_now, DBBase
-from models.sensi_models import SensiDerivativeModel, SensiUnderlyingModel, SensiResModel
+from models.sensi_models import SensiDerivativeModel, SensiUnderlyingModel, SensiResModel, DerivativeFilterModel, \
+    OptionChainCursorModel
 
 
 class SensiDBBase:
@@ -24,9 +29,49 @@ class SensiDBBase:
     expiry = Column(DATE, nullable=True)
     strike = Column(Float, nullable=True)
 
+    @classmethod
+    def bulk_upsert(cls, rows: List[dict]) -> List[Tuple[int, str]]:
+        """insert rows (built with build_db_row) in multi row statements of DB_UPSERT_BATCH_SIZE rows
+        rows whose token is already present are updated in place instead of failing the batch on unique token
+        constraint , so a stale cache can not break the sync
+        :return id and token of every inserted or updated row"""
+        db = get_db_session()
+        # a statement can not update same row twice , so only last row of a token is kept
+        rows = list({row['token']: row for row in rows}.values())
+        id_tokens: List[Tuple[int, str]] = []
+        for start in range(0, len(rows), DB.upsert_batch_size):
+            statement = insert(cls.__table__).values(rows[start:start + DB.upsert_batch_size])
+            update_columns = {column: statement.excluded[column] for column in rows[start].keys()
+                              if column != 'token'}
+            update_columns.update({'is_deleted': False, 'updated_at': time_now()})
+            statement = statement.on_conflict_do_update(index_elements=[cls.token], set_=update_columns).returning(
+                cls.id, cls.token)
+            id_tokens.extend((row.id, row.token) for row in db.execute(statement))
+        return id_tokens
+
+    @classmethod
+    def get_rows_by_token(cls, columns: List[str], underlying_id: Optional[int] = None) -> Dict[str, dict]:
+        """returns id , is_deleted and given columns of all rows (deleted ones as well) keyed by token
+        rows are read without building orm objects , to be used for diffing synced data against db"""
+        db = get_db_session()
+        query = select([cls.__table__.c[column] for column in {'id', 'token', 'is_deleted', *columns}])
+        if underlying_id is not None:
+            query = query.where(cls.__table__.c.underlying_id == underlying_id)
+        return {row['token']: dict(row) for row in db.execute(query).mappings()}
+
+    @classmethod
+    def soft_delete_by_tokens(cls, tokens: List[str]) -> int:
+        """mark rows of tokens as deleted"""
+        if not tokens:
+            return 0
+        db = get_db_session()
+        return db.execute(update(cls.__table__).where(cls.__table__.c.token.in_(tokens)).values(
+            is_deleted=True, updated_at=time_now())).rowcount
+
 
 class SensiUnderlying(DBBase, SensiDBBase):
     __tablename__ = 'sensi_underlying'
+    __table_args__ = (UniqueConstraint('token', name='sensi_underlying_un'),)
 
     def __to_model(self) -> SensiUnderlyingModel:
         """converts db model to pydantic model"""
@@ -36,23 +81,28 @@ class SensiUnderlying(DBBase, SensiDBBase):
     def get_all_underlying(cls) -> List[SensiResModel]:
         """returns all underlying data"""
         db = get_db_session()
-        return [underlying.__to_model().build_res_model() for underlying in db.query(cls).all()]
+        return [underlying.__to_model().build_res_model() for underlying in
+                db.query(cls).filter(cls.is_deleted.is_(False)).all()]
 
     @classmethod
     def get_all_underlyings(cls) -> List[SensiUnderlyingModel]:
         """returns all underlying data"""
         db = get_db_session()
-        return [underlying.__to_model() for underlying in db.query(cls).all()]
+        return [underlying.__to_model() for underlying in db.query(cls).filter(cls.is_deleted.is_(False)).all()]
 
     @classmethod
-    def insert_underlyings(cls, underlyings):
+    def get_deleted_tokens(cls, tokens: List[str]) -> List[str]:
+        """returns tokens among given whose rows are deleted"""
+        if not tokens:
+            return []
         db = get_db_session()
-        db.add_all(underlyings)
-        db.flush()
+        return [row.token for row in db.execute(select([cls.__table__.c.token]).where(
+            cls.__table__.c.token.in_(tokens), cls.__table__.c.is_deleted.is_(True)))]
 
 
 class SensiDerivative(DBBase, SensiDBBase):
     __tablename__ = 'sensi_derivative'
+    __table_args__ = (UniqueConstraint('token', name='sensi_derivative_un'),)
 
     underlying_id = Column(Integer, ForeignKey(SensiUnderlying.id), nullable=False)
 
@@ -67,17 +117,104 @@ class SensiDerivative(DBBase, SensiDBBase):
         """returns all derivative data for a given underlying symbol"""
         db = get_db_session()
         return [derivative.__to_model().build_res_model() for derivative in
-                db.query(cls).join(SensiUnderlying).filter(SensiUnderlying.symbol == symbol).all()]
+                db.query(cls).join(SensiUnderlying).filter(SensiUnderlying.symbol == symbol,
+                                                           cls.is_deleted.is_(False)).all()]
+
+    @classmethod
+    def __filter_option_chain(cls, query, symbol: str, filters: DerivativeFilterModel, with_strike_range=True):
+        """derivatives of underlying symbol matching filters , served by option chain indexes
+        expiry and strike are compared through the indexed option chain keys , not the raw columns , so that they
+        narrow the index scan instead of being applied to every derivative of the underlying"""
+        table = cls.__table__
+        query = query.select_from(table.join(SensiUnderlying.__table__)).where(
+            # `= false` , not `is false` , is what postgres matches against predicate of partial indexes
+            SensiUnderlying.__table__.c.symbol == symbol, table.c.is_deleted == false())
+        if filters.expiry is not None:
+            query = query.where(OPTION_CHAIN_EXPIRY_KEY == filters.expiry)
+        if filters.instrument_type is not None:
+            query = query.where(table.c.instrument_type == filters.instrument_type)
+        if with_strike_range and (filters.min_strike is not None or filters.max_strike is not None):
+            # strike key is 0 for derivatives without strike , which a strike range never matches
+            query = query.where(table.c.strike.isnot(None))
+        if with_strike_range and filters.min_strike is not None:
+            query = query.where(OPTION_CHAIN_STRIKE_KEY >= filters.min_strike)
+        if with_strike_range and filters.max_strike is not None:
+            query = query.where(OPTION_CHAIN_STRIKE_KEY <= filters.max_strike)
+        return query
+
+    @classmethod
+    def get_option_chain_page(cls, symbol: str, filters: DerivativeFilterModel, limit: int,
+                              after: Optional[OptionChainCursorModel] = None) \
+            -> Tuple[List[SensiResModel], Optional[OptionChainCursorModel]]:
+        """returns a page of derivatives of underlying symbol matching filters in option chain order
+        (expiry , strike , id) , keyset pagination so that a page costs the same however deep it is
+        :return derivatives of page and cursor of next page , None on last page"""
+        db = get_db_session()
+        table = cls.__table__
+        query = cls.__filter_option_chain(select([
+            table.c.id, table.c.token, table.c.symbol, table.c.underlying, table.c.instrument_type, table.c.expiry,
+            table.c.strike, OPTION_CHAIN_EXPIRY_KEY.label('expiry_key'),
+            OPTION_CHAIN_STRIKE_KEY.label('strike_key')]), symbol=symbol, filters=filters)
+        if after is not None:
+            query = query.where(tuple_(OPTION_CHAIN_EXPIRY_KEY, OPTION_CHAIN_STRIKE_KEY, table.c.id) >
+                                tuple_(after.expiry, after.strike, after.id))
+        rows = db.execute(query.order_by(OPTION_CHAIN_EXPIRY_KEY, OPTION_CHAIN_STRIKE_KEY, table.c.id).limit(
+            limit + 1)).mappings().all()
+        derivatives = [SensiResModel(token=row['token'], symbol=row['symbol'], underlying=row['underlying'],
+                                     instrument_type=row['instrument_type'], expiry=row['expiry'],
+                                     strike=row['strike']) for row in rows[:limit]]
+        if len(rows) <= limit:
+            return derivatives, None
+        last_row = rows[limit - 1]
+        return derivatives, OptionChainCursorModel(expiry=last_row['expiry_key'], strike=last_row['strike_key'],
+                                                   id=last_row['id'])
+
+    @classmethod
+    def get_option_chain_strikes(cls, symbol: str, filters: DerivativeFilterModel) -> List[float]:
+        """returns distinct strikes of derivatives of underlying symbol matching filters (strike range aside) in
+        ascending order"""
+        db = get_db_session()
+        table = cls.__table__
+        query = cls.__filter_option_chain(select([table.c.strike]).distinct(), symbol=symbol, filters=filters,
+                                          with_strike_range=False).where(table.c.strike.isnot(None))
+        return [row.strike for row in db.execute(query.order_by(table.c.strike))]
+
+    @classmethod
+    def get_expired_derivatives(cls, expired_before: date) -> List[Tuple[str, str]]:
+        """returns token and underlying token of derivatives not yet deleted whose expiry is before given date"""
+        db = get_db_session()
+        return [(row.token, row.underlying_token) for row in db.execute(
+            select([cls.__table__.c.token, SensiUnderlying.__table__.c.token.label('underlying_token')]).join(
+                SensiUnderlying.__table__).where(cls.__table__.c.expiry < expired_before,
+                                                 cls.__table__.c.is_deleted.is_(False)))]
 
     @classmethod
-    def insert_derivatives(cls, derivatives):
+    def get_deleted_derivatives(cls, tokens: List[str]) -> List[Tuple[str, str]]:
+        """returns token and underlying token of derivatives among tokens whose rows are deleted"""
+        if not tokens:
+            return []
         db = get_db_session()
-        db.add_all(derivatives)
-        db.flush()
+        return [(row.token, row.underlying_token) for row in db.execute(
+            select([cls.__table__.c.token, SensiUnderlying.__table__.c.token.label('underlying_token')]).join(
+                SensiUnderlying.__table__).where(cls.__table__.c.token.in_(tokens),
+                                                 cls.__table__.c.is_deleted.is_(True)))]
 
     @classmethod
     def get_all_derivatives_by_underlying_token(cls, token: str) -> List[SensiDerivativeModel]:
         """returns all derivative data for a given underlying token"""
         db = get_db_session()
         return [derivative.__to_model() for derivative in
-                db.query(cls).join(SensiUnderlying).filter(SensiUnderlying.token == token).all()]
+                db.query(cls).join(SensiUnderlying).filter(SensiUnderlying.token == token,
+                                                           cls.is_deleted.is_(False)).all()]
+
+
+# option chain order , derivatives without expiry / strike sort last / at zero so that keyset pagination does not skip
+# them. Indexes (same in scripts/init_db.sql) serve filters of option chain along with its order
+OPTION_CHAIN_EXPIRY_KEY = func.coalesce(SensiDerivative.__table__.c.expiry, literal_column("'9999-12-31'"))
+OPTION_CHAIN_STRIKE_KEY = func.coalesce(SensiDerivative.__table__.c.strike, literal_column("0"))
+Index('sensi_derivative_chain_idx', SensiDerivative.__table__.c.underlying_id, OPTION_CHAIN_EXPIRY_KEY,
+      OPTION_CHAIN_STRIKE_KEY, SensiDerivative.__table__.c.id,
+      postgresql_where=SensiDerivative.__table__.c.is_deleted == false())
+Index('sensi_derivative_type_chain_idx', SensiDerivative.__table__.c.underlying_id,
+      SensiDerivative.__table__.c.instrument_type, OPTION_CHAIN_EXPIRY_KEY, OPTION_CHAIN_STRIKE_KEY,
+      SensiDerivative.__table__.c.id, postgresql_where=SensiDerivative.__table__.c.is_deleted == false())
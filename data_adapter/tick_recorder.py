@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from config.constants import RedisKeys, HistoryResolutions
+from config.settings import TickHistoryConfig, TickWriterConfig
+from controller.context_manager import context_log_meta
+from data_adapter.async_redis import AsyncCache
+from logger import logger
+from utils.utils import Singleton, LatencyStats
+
+
+@Singleton
+class TickRecorder:
+    """tick history stage of broker ws listener , unlike tick writer every tick is kept
+    ticks are appended to a capped stream per token (TICK_HISTORY:{token}) and rolled up into ohlc bars of every
+    resolution of HistoryResolutions as they arrive. A bar is closed when a tick of a later bucket arrives or its bucket
+    has passed , closed bars are appended to a capped stream per token and resolution (OHLC_BARS:{resolution}:{token})
+    and bars still open are kept in hash OPEN_OHLC_BARS:{resolution}. Stream entry ids are times in ms , so a range
+    query is an XRANGE whose cost grows with the range and not with the history kept.
+    Ticks and bars are buffered and written once per flush window in a single pipelined round trip."""
+
+    def __init__(self):
+        self.__flush_interval = TickWriterConfig.flush_interval_ms / 1000
+        self.__ticks: List[Tuple[str, float, float]] = []
+        # bar is [bucket start , open , high , low , close , ticks] , per resolution and token
+        self.__open_bars: Dict[str, Dict[str, list]] = {resolution: {} for resolution in
+                                                        HistoryResolutions.BAR_SECONDS}
+        self.__closed_bars: Dict[str, List[Tuple[str, list]]] = {resolution: [] for resolution in
+                                                                 HistoryResolutions.BAR_SECONDS}
+        # tokens whose open bar changed since last flush
+        self.__updated_tokens: Dict[str, set] = {resolution: set() for resolution in HistoryResolutions.BAR_SECONDS}
+        self.__last_closed_bucket: Dict[str, int] = {resolution: 0 for resolution in HistoryResolutions.BAR_SECONDS}
+        # last tick id (ms , sequence) per token , ticks of a token in the same ms get increasing sequence numbers
+        self.__last_tick_ids: Dict[str, Tuple[int, int]] = {}
+        # counters for observability
+        self.__ticks_recorded = 0
+        self.__bars_closed = 0
+        self.__entries_rejected = 0
+        self.__flush_latency = LatencyStats()
+
+    def is_enabled(self) -> bool:
+        return bool(TickHistoryConfig.enabled)
+
+    def add_tick(self, token: str, price: float, received_at: float = None) -> None:
+        """record tick and update open bars of token"""
+        if token is None or price is None:
+            return
+        token, price, received_at = str(token), float(price), received_at or time.time()
+        self.__ticks.append((token, received_at, price))
+        for resolution, bar_seconds in HistoryResolutions.BAR_SECONDS.items():
+            bucket = int(received_at // bar_seconds) * bar_seconds
+            bar = self.__open_bars[resolution].get(token)
+            if bar is not None and bucket <= bar[0]:
+                bar[2], bar[3], bar[4], bar[5] = max(bar[2], price), min(bar[3], price), price, bar[5] + 1
+            else:
+                if bar is not None:
+                    self.__closed_bars[resolution].append((token, bar))
+                self.__open_bars[resolution][token] = [bucket, price, price, price, price, 1]
+            self.__updated_tokens[resolution].add(token)
+
+    def __build_tick_id(self, token: str, received_at: float) -> str:
+        ms, sequence = int(received_at * 1000), 0
+        last_ms, last_sequence = self.__last_tick_ids.get(token, (0, 0))
+        if ms <= last_ms:
+            ms, sequence = last_ms, last_sequence + 1
+        self.__last_tick_ids[token] = (ms, sequence)
+        return f"{ms}-{sequence}"
+
+    async def flush(self) -> int:
+        """write buffered ticks , bars closed in the window and open bars that changed to redis
+        :return number of stream entries written"""
+        now = time.time()
+        ticks, self.__ticks = self.__ticks, []
+        stream_entries: List[Tuple[str, str, dict, int]] = [
+            (RedisKeys.TICK_HISTORY.format(token), self.__build_tick_id(token, received_at), {"p": price},
+             TickHistoryConfig.max_ticks_per_token) for token, received_at, price in ticks]
+        key_mappings: Dict[str, dict] = {}
+        key_fields_to_delete: Dict[str, List[str]] = {}
+        for resolution, bar_seconds in HistoryResolutions.BAR_SECONDS.items():
+            open_bars = self.__open_bars[resolution]
+            closed_bars, self.__closed_bars[resolution] = self.__closed_bars[resolution], []
+            current_bucket = int(now // bar_seconds) * bar_seconds
+            if current_bucket > self.__last_closed_bucket[resolution]:
+                # bars of tokens that did not tick since their bucket passed are closed once per bucket
+                passed_tokens = [token for token, bar in open_bars.items() if bar[0] < current_bucket]
+                closed_bars.extend((token, open_bars.pop(token)) for token in passed_tokens)
+                if passed_tokens:
+                    key_fields_to_delete[RedisKeys.OPEN_OHLC_BARS.format(resolution)] = passed_tokens
+                self.__last_closed_bucket[resolution] = current_bucket
+            stream_entries.extend((RedisKeys.OHLC_BARS.format(resolution, token), f"{bar[0] * 1000}-0",
+                                   {"o": bar[1], "h": bar[2], "l": bar[3], "c": bar[4], "n": bar[5]},
+                                   TickHistoryConfig.max_bars_per_token) for token, bar in closed_bars)
+            self.__bars_closed += len(closed_bars)
+            updated_tokens, self.__updated_tokens[resolution] = self.__updated_tokens[resolution], set()
+            open_bar_mapping = {token: ",".join(map(str, open_bars[token])) for token in updated_tokens if
+                                token in open_bars}
+            if open_bar_mapping:
+                key_mappings[RedisKeys.OPEN_OHLC_BARS.format(resolution)] = open_bar_mapping
+        if not (stream_entries or key_mappings or key_fields_to_delete):
+            return 0
+        start = time.perf_counter()
+        written = await AsyncCache.get_instance().xadd_multiple(stream_entries=stream_entries,
+                                                                key_mappings=key_mappings,
+                                                                key_fields_to_delete=key_fields_to_delete)
+        self.__flush_latency.record((time.perf_counter() - start) * 1000)
+        self.__ticks_recorded += len(ticks)
+        # entries not newer than the last entry of their stream (eg a bar closed by previous owner of the token) or
+        # lost while redis was unreachable
+        self.__entries_rejected += len(stream_entries) - written
+        return written
+
+    async def run(self):
+        """flush the buffer every flush window , should run as a background task next to broker ws listener"""
+        while True:
+            await asyncio.sleep(self.__flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(extra=context_log_meta.get(), msg=f"tick_recorder: exception in flush : {e}")
+
+    def get_stats(self) -> dict:
+        """counters of tick history recording"""
+        return {
+            "enabled": self.is_enabled(),
+            "ticks_recorded": self.__ticks_recorded,
+            "pending_ticks": len(self.__ticks),
+            "open_bars": {resolution: len(open_bars) for resolution, open_bars in self.__open_bars.items()},
+            "bars_closed": self.__bars_closed,
+            "entries_rejected": self.__entries_rejected,
+            "flush_latency": self.__flush_latency.get_stats(),
+        }
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Dict
+
+from config.constants import RedisKeys
+from config.settings import AppConfig, TickWriterConfig
+from controller.context_manager import context_log_meta
+from data_adapter.price_board import PriceBoard
+from data_adapter.price_stream import PriceStreamHub
+from data_adapter.price_table import PriceTable
+from data_adapter.async_redis import AsyncCache
+from logger import logger
+from models.sensi_models import PriceDeltaModel
+from utils.utils import Singleton, LatencyStats
+
+
+@Singleton
+class TickWriter:
+    """tick ingestion stage between broker websocket and redis
+    quotes are buffered in memory and only the latest price per token is kept within a flush window , buffer is
+    written to redis with one pipelined round trip per window instead of a round trip per message. Update time of
+    every token written in the window goes to ENTITY_PRICE_UPDATED_AT in the same round trip.
+    """
+
+    def __init__(self):
+        self.__flush_interval = TickWriterConfig.flush_interval_ms / 1000
+        self.__max_batch_size = TickWriterConfig.max_batch_size
+        self.__buffer: Dict[str, float] = {}
+        # counters for observability
+        self.__ticks_received = 0
+        self.__ticks_coalesced = 0
+        self.__flush_latency = LatencyStats()
+
+    def add_tick(self, token: str, price: float) -> None:
+        """buffer the latest price for token , older price of same token in the window is overwritten"""
+        self.__ticks_received += 1
+        if token is None or price is None:
+            return
+        if token in self.__buffer:
+            self.__ticks_coalesced += 1
+        self.__buffer[token] = price
+        # local price table is updated on every tick , other nodes receive it from delta feed on flush
+        PriceTable.get_instance().update(token=token, price=price)
+        PriceStreamHub.get_instance().publish(token=token, price=price)
+
+    def is_batch_full(self) -> bool:
+        """listener may not yield to the event loop under a burst , so it should flush once the batch is full
+        instead of waiting for the flush window"""
+        return len(self.__buffer) >= self.__max_batch_size
+
+    async def flush(self) -> int:
+        """write buffered prices to redis in a single pipeline
+        :return: number of tokens written"""
+        if not self.__buffer:
+            return 0
+        prices, self.__buffer = self.__buffer, {}
+        start = time.perf_counter()
+        updated_at = time.time()
+        if PriceBoard.get_instance().is_enabled():
+            # processes of this host read prices from the board instead of redis
+            PriceBoard.get_instance().write_many(prices, updated_at=updated_at)
+        # prices of the window are published as a delta for price tables of other nodes , tokens that ticked are no
+        # longer stale
+        await AsyncCache.get_instance().hset_multiple_and_publish(
+            topic=RedisKeys.TOPIC_FOR_PRICE_DELTA, key_mappings={RedisKeys.ENTITY_PRICE_DATA: prices},
+            key_scores={RedisKeys.ENTITY_PRICE_UPDATED_AT: dict.fromkeys(prices, updated_at)},
+            key_members_to_remove={RedisKeys.STALE_ENTITY_TOKENS: list(prices)},
+            msg=PriceDeltaModel(node_id=AppConfig.node_id, updated_at=updated_at, prices=prices).json())
+        self.__flush_latency.record((time.perf_counter() - start) * 1000)
+        return len(prices)
+
+    async def run(self):
+        """flush the buffer every flush window , should run as a background task on the app event loop"""
+        while True:
+            await asyncio.sleep(self.__flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(extra=context_log_meta.get(), msg=f"tick_writer: exception in flush : {e}")
+
+    def get_stats(self) -> dict:
+        """counters of tick ingestion"""
+        return {
+            "ticks_received": self.__ticks_received,
+            "ticks_coalesced": self.__ticks_coalesced,
+            "pending_tokens": len(self.__buffer),
+            "flush_latency": self.__flush_latency.get_stats(),
+        }
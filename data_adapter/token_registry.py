@@ -0,0 +1,249 @@
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Any, Tuple
+
+from config.constants import RedisKeys
+from controller.context_manager import context_log_meta
+from data_adapter.async_redis import AsyncCache
+from data_adapter.redis import Cache
+from logger import logger
+from utils.utils import Singleton
+
+# tokens assigned / ids loaded in a single redis round trip
+BATCH_SIZE = 5000
+# refresh asked for by lookup misses happens at most once in this interval
+MIN_REFRESH_INTERVAL_SEC = 1
+# releases kept for readers of the registry (price table , catalog entries) to catch up with , a reader further
+# behind drops everything it keeps by id
+RELEASE_LOG_SIZE = 64
+# assigns an id to every token that has none , oldest released id first else next id of the sequence , atomically so
+# that concurrent syncs never give two ids to a token
+ASSIGN_IDS_SCRIPT = """
+local ids = {}
+local reused = 0
+for i, token in ipairs(ARGV) do
+    local token_id = redis.call('HGET', KEYS[1], token)
+    if not token_id then
+        token_id = redis.call('LPOP', KEYS[4])
+        if token_id then
+            reused = reused + 1
+        else
+            token_id = redis.call('INCR', KEYS[3]) - 1
+        end
+        redis.call('HSET', KEYS[1], token, token_id)
+        redis.call('HSET', KEYS[2], token_id, token)
+    end
+    ids[i] = tonumber(token_id)
+end
+if reused > 0 then
+    redis.call('INCR', KEYS[5])
+end
+return ids
+"""
+# drops ids of tokens and queues them for reuse
+RELEASE_IDS_SCRIPT = """
+local ids = {}
+for _, token in ipairs(ARGV) do
+    local token_id = redis.call('HGET', KEYS[1], token)
+    if token_id then
+        redis.call('HDEL', KEYS[1], token)
+        redis.call('HDEL', KEYS[2], token_id)
+        redis.call('RPUSH', KEYS[3], token_id)
+        ids[#ids + 1] = tonumber(token_id)
+    end
+end
+if #ids > 0 then
+    redis.call('INCR', KEYS[4])
+end
+return ids
+"""
+
+
+@Singleton
+class TokenRegistry:
+    """dense integer ids of tokens , same on every process of the cluster
+    sync jobs assign an id to a token once when it is synced (TOKEN_IDS , TOKENS_BY_ID , TOKEN_ID_SEQUENCE in redis) ,
+    ids start at 0 , so in memory structures index arrays by token id instead of keeping a dict of their own.
+    Expiry purge releases ids of purged tokens to FREE_TOKEN_IDS and syncs reassign them oldest first , so the id space
+    stays as large as the most tokens live at once instead of growing with every contract ever listed.
+    Every process keeps both directions of the mapping in memory , a token -> id dict and an id -> token list , and
+    loads only ids assigned since its last refresh while TOKEN_ID_GENERATION is unchanged. Once an id is released or
+    reassigned the generation moves and the mapping is loaded again as a whole.
+    version goes up with every change of the in process mapping , readers keeping data by id (price table) drop data
+    of ids released since the version they last saw"""
+
+    def __init__(self):
+        self.__ids: Dict[str, int] = {}
+        self.__tokens: List[Optional[str]] = []
+        self.__generation: Optional[str] = None
+        self.__version = 0
+        # version at which ids were released and the ids , and latest version dropped from this log
+        self.__releases: Deque[Tuple[int, List[int]]] = deque()
+        self.__releases_dropped_at = 0
+        # set when a lookup misses , eg ticks of a token synced after last refresh
+        self.__refresh_pending = True
+        self.__refreshed_at = 0.0
+        self.__misses = 0
+        self.__refreshes = 0
+        self.__reloads = 0
+
+    def assign_ids(self, tokens: List[str]) -> Dict[str, int]:
+        """assign ids to tokens that have none , called from sync jobs before tokens are handed over to nodes
+        :return id of every token"""
+        token_ids: Dict[str, int] = {}
+        for start in range(0, len(tokens), BATCH_SIZE):
+            batch = [str(token) for token in tokens[start:start + BATCH_SIZE]]
+            ids: Optional[List[int]] = Cache.get_instance().run_script(
+                ASSIGN_IDS_SCRIPT, keys=[RedisKeys.TOKEN_IDS, RedisKeys.TOKENS_BY_ID, RedisKeys.TOKEN_ID_SEQUENCE,
+                                         RedisKeys.FREE_TOKEN_IDS, RedisKeys.TOKEN_ID_GENERATION], args=batch)
+            if ids is None:
+                logger.error(extra=context_log_meta.get(), msg=f"assign_ids: could not assign ids to tokens")
+                break
+            token_ids.update(zip(batch, ids))
+        return token_ids
+
+    def release_ids(self, tokens: List[str]) -> int:
+        """release ids of tokens for reuse , called from expiry purge once tokens are unsubscribed and their prices
+        purged. Tokens are dropped from the mapping of this process , other processes drop them on their next refresh
+        :return number of ids released"""
+        released = 0
+        for start in range(0, len(tokens), BATCH_SIZE):
+            batch = [str(token) for token in tokens[start:start + BATCH_SIZE]]
+            ids: Optional[List[int]] = Cache.get_instance().run_script(
+                RELEASE_IDS_SCRIPT, keys=[RedisKeys.TOKEN_IDS, RedisKeys.TOKENS_BY_ID, RedisKeys.FREE_TOKEN_IDS,
+                                          RedisKeys.TOKEN_ID_GENERATION], args=batch)
+            if ids is None:
+                logger.error(extra=context_log_meta.get(), msg=f"release_ids: could not release ids of tokens")
+                break
+            released += len(ids)
+            for token in batch:
+                token_id = self.__ids.pop(token, None)
+                if token_id is not None:
+                    self.__tokens[token_id] = None
+            self.__add_release([token_id for token_id in ids if token_id < len(self.__tokens)])
+        return released
+
+    def __add_release(self, ids: List[int]) -> None:
+        self.__version += 1
+        if not ids:
+            return
+        self.__releases.append((self.__version, ids))
+        if len(self.__releases) > RELEASE_LOG_SIZE:
+            self.__releases_dropped_at = self.__releases.popleft()[0]
+
+    async def refresh(self) -> int:
+        """load ids assigned since last refresh , whole mapping if ids were released or reassigned since
+        :return number of ids loaded"""
+        self.__refresh_pending = False
+        self.__refreshed_at = time.monotonic()
+        sequence, generation = await AsyncCache.get_instance().mget([RedisKeys.TOKEN_ID_SEQUENCE,
+                                                                    RedisKeys.TOKEN_ID_GENERATION])
+        if sequence is None:
+            return 0
+        if generation != self.__generation:
+            return await self.__reload()
+        loaded = 0
+        while len(self.__tokens) < int(sequence):
+            ids = range(len(self.__tokens), min(len(self.__tokens) + BATCH_SIZE, int(sequence)))
+            tokens: List[Optional[str]] = await AsyncCache.get_instance().hmget(RedisKeys.TOKENS_BY_ID,
+                                                                                fields=[str(i) for i in ids])
+            if None in tokens:
+                # id and token are written together and a released id moves the generation , so a missing token
+                # means redis could not be read or ids were released meanwhile , next refresh finds out
+                self.__refresh_pending = True
+                break
+            loaded += self.add_tokens(ids.start, tokens)
+        if loaded:
+            self.__refreshes += 1
+        return loaded
+
+    async def __reload(self) -> int:
+        """load whole mapping along with generation it belongs to , ids whose token changed are released
+        :return number of ids loaded"""
+        snapshot: Optional[Tuple[List[Optional[str]], dict]] = await AsyncCache.get_instance().mget_and_hgetall(
+            [RedisKeys.TOKEN_ID_SEQUENCE, RedisKeys.TOKEN_ID_GENERATION], RedisKeys.TOKENS_BY_ID)
+        if snapshot is None:
+            self.__refresh_pending = True
+            return 0
+        (sequence, generation), tokens_by_id = snapshot
+        # ids at the end of the sequence may all be free , they are loaded as holes so that refreshes resume after them
+        tokens: List[Optional[str]] = [None] * int(sequence or 0)
+        for token_id, token in tokens_by_id.items():
+            tokens[int(token_id)] = token
+        released = [token_id for token_id, token in enumerate(self.__tokens) if token is not None and (
+            token_id >= len(tokens) or tokens[token_id] != token)]
+        self.__tokens = tokens
+        self.__ids = {token: token_id for token_id, token in enumerate(tokens) if token is not None}
+        self.__generation = generation
+        self.__add_release(released)
+        self.__reloads += 1
+        return len(self.__ids)
+
+    def add_tokens(self, first_id: int, tokens: List[str]) -> int:
+        """add tokens having consecutive ids from first_id , ids already loaded are skipped
+        :return number of tokens added"""
+        tokens = tokens[max(len(self.__tokens) - first_id, 0):]
+        if first_id > len(self.__tokens):
+            # ids are loaded in order , a gap would shift every id after it
+            return 0
+        for token_id, token in enumerate(tokens, start=len(self.__tokens)):
+            self.__ids[token] = token_id
+        self.__tokens.extend(tokens)
+        if tokens:
+            self.__version += 1
+        return len(tokens)
+
+    async def refresh_if_pending(self) -> int:
+        """refresh if a lookup missed since last refresh , misses of tokens that never get an id refresh at most once
+        per MIN_REFRESH_INTERVAL_SEC"""
+        if not self.__refresh_pending or time.monotonic() - self.__refreshed_at < MIN_REFRESH_INTERVAL_SEC:
+            return 0
+        return await self.refresh()
+
+    def get_id(self, token: Any) -> Optional[int]:
+        """id of token , token may be str or int as sent by broker"""
+        token_id = self.__ids.get(token)
+        if token_id is None and type(token) is not str:
+            token_id = self.__ids.get(str(token))
+        if token_id is None:
+            self.__misses += 1
+            self.__refresh_pending = True
+        return token_id
+
+    def get_ids(self, tokens: List[Any]) -> List[Optional[int]]:
+        token_ids = [self.__ids.get(token) for token in tokens]
+        if None in token_ids:
+            # misses and tokens sent as int go through get_id
+            token_ids = [self.get_id(token) if token_id is None else token_id for token, token_id in
+                         zip(tokens, token_ids)]
+        return token_ids
+
+    def get_token(self, token_id: int) -> Optional[str]:
+        return self.__tokens[token_id] if 0 <= token_id < len(self.__tokens) else None
+
+    def get_size(self) -> int:
+        """every loaded id is less than this"""
+        return len(self.__tokens)
+
+    def get_version(self) -> int:
+        """goes up with every change of the mapping of this process"""
+        return self.__version
+
+    def get_released_ids(self, since_version: int) -> Optional[List[int]]:
+        """ids released or given to another token after since_version
+        :return None if releases after since_version are no longer kept"""
+        if since_version < self.__releases_dropped_at:
+            return None
+        return [token_id for version, ids in self.__releases if version > since_version for token_id in ids]
+
+    def get_stats(self) -> dict:
+        """counters of the registry"""
+        return {
+            "tokens": len(self.__ids),
+            "id_space": len(self.__tokens),
+            "generation": self.__generation,
+            "misses": self.__misses,
+            "refreshes": self.__refreshes,
+            "reloads": self.__reloads,
+            "refresh_pending": self.__refresh_pending,
+        }
@@ -1,29 +1,231 @@
+import asyncio
+import random
+import time
+import zlib
+from typing import Dict, List, Optional, Callable, Awaitable
+
 import websockets
 
 from config.settings import BrokerConfig
-from utils.utils import Singleton
+from controller.context_manager import context_log_meta
+from logger import logger
+from utils.utils import Singleton, LatencyStats
 
 
-@Singleton
-class WS:
-    """abstract layer for websockets , using singleton pattern here to avoid multiple connections
-    for the same application instance
-    We would be creating single websocket connection for the application instance and utilizing it for all the
-    websocket related operations"""
+class WSConnection:
+    """single websocket connection to broker , tokens of a partition are subscribed over it"""
 
-    def __init__(self):
-        self.__url = BrokerConfig.ws_url
+    def __init__(self, url: str, index: int):
+        self.index = index
+        self.__url = url
         self.__ws = None
+        # counters for observability
+        self.__messages_received = 0
+        self.__messages_since_connect = 0
+        self.__connected_at: Optional[float] = None
+        self.__last_message_at: Optional[float] = None
+        self.__reconnects = 0
+        # set when connection is found broken , prices of its partition are stale till first tick after reconnect
+        self.__disconnected_at: Optional[float] = None
+        self.awaiting_first_tick = False
+        self.__time_to_first_tick = LatencyStats()
 
     async def connect(self):
-        """ideally connect should be called only once"""
-        self.__ws = await websockets.connect(self.__url)
+        """open a new connection , an existing one is closed only after it is replaced so that its receive loop
+        finds the new connection open and moves to it instead of reconnecting again"""
+        old_ws, self.__ws = self.__ws, await websockets.connect(self.__url)
+        self.__connected_at = time.time()
+        self.__messages_since_connect = 0
+        self.awaiting_first_tick = True
+        if old_ws is not None:
+            self.__reconnects += 1
+            try:
+                await old_ws.close()
+            except Exception:
+                # failure to close a broken socket is not an error
+                pass
+
+    def is_open(self) -> bool:
+        return self.__ws is not None and self.__ws.open
+
+    def get_connected_at(self) -> Optional[float]:
+        return self.__connected_at
+
+    def get_last_message_at(self) -> Optional[float]:
+        """time of last message (tick , ping or error) received , time of connect if nothing was received since"""
+        if self.__connected_at is None:
+            return None
+        return max(self.__last_message_at or 0.0, self.__connected_at)
+
+    def mark_disconnected(self) -> None:
+        if self.__disconnected_at is None:
+            self.__disconnected_at = time.time()
+
+    def is_stale(self) -> bool:
+        return self.__disconnected_at is not None
+
+    def register_first_tick(self) -> None:
+        """first quote after (re)connect , measured from when connection was found broken (or from connect on first
+        connect) , ends the stale window of the partition"""
+        self.awaiting_first_tick = False
+        self.__time_to_first_tick.record((time.time() - (self.__disconnected_at or self.__connected_at)) * 1000)
+        self.__disconnected_at = None
 
     async def send(self, msg):
         await self.__ws.send(msg)
 
     async def recv(self):
-        return await self.__ws.recv()
+        msg = await self.__ws.recv()
+        self.__messages_received += 1
+        self.__messages_since_connect += 1
+        self.__last_message_at = time.time()
+        return msg
+
+    async def close(self):
+        if self.__ws is not None:
+            await self.__ws.close()
+
+    def get_stats(self) -> dict:
+        connected_for = time.time() - self.__connected_at if self.__connected_at else 0
+        return {
+            "open": self.is_open(),
+            "messages_received": self.__messages_received,
+            "messages_per_sec": round(self.__messages_since_connect / connected_for, 2) if connected_for else 0.0,
+            "reconnects": self.__reconnects,
+            "silent_for_sec": round(time.time() - self.get_last_message_at(), 3) if self.__connected_at else 0.0,
+            "stale_for_sec": round(time.time() - self.__disconnected_at, 3) if self.__disconnected_at else 0.0,
+            "time_to_first_tick": self.__time_to_first_tick.get_stats(),
+        }
+
+
+@Singleton
+class WS:
+    """abstract layer for websockets , using singleton pattern here to avoid multiple pools
+    for the same application instance
+    Application instance keeps BROKER_WS_CONNECTIONS websocket connections to broker and tokens are partitioned
+    across them by a stable hash of token , so ticks of the node are received on multiple sockets and a broken
+    connection only affects tokens of its own partition"""
+
+    def __init__(self):
+        self.connections: List[WSConnection] = [WSConnection(url=BrokerConfig.ws_url, index=index) for index in
+                                                range(max(BrokerConfig.ws_connections, 1))]
+
+    def get_connection_index(self, token: str) -> int:
+        """connection a token is subscribed over , crc32 is stable across processes unlike hash()"""
+        return zlib.crc32(token.encode()) % len(self.connections)
+
+    def partition(self, tokens: List[str]) -> Dict[int, List[str]]:
+        """tokens grouped by connection they belong to"""
+        tokens_by_connection: Dict[int, List[str]] = {}
+        for token in tokens:
+            tokens_by_connection.setdefault(self.get_connection_index(token), []).append(token)
+        return tokens_by_connection
+
+    async def connect(self, connection_index: Optional[int] = None):
+        """(re)connect a single connection or all connections if index is not given"""
+        for connection in self.connections if connection_index is None else [self.connections[connection_index]]:
+            await connection.connect()
+
+    async def send(self, msg, connection_index: int = 0):
+        await self.connections[connection_index].send(msg)
 
     async def close(self):
-        await self.__ws.close()
+        for connection in self.connections:
+            await connection.close()
+
+    def get_stats(self) -> List[dict]:
+        """counters of every connection"""
+        return [connection.get_stats() for connection in self.connections]
+
+
+@Singleton
+class WSReconnectSupervisor:
+    """single place broker ws connections of the node are (re)connected from
+    listener (connection closed , ERROR frame) and worker (ping timeout on WS_RECONNECT topic) both ask the supervisor.
+    Reconnects of a connection are serialized , a request is skipped if the connection was reconnected after the
+    request was made , so concurrent paths finding the same broken connection reconnect it once. Attempts back off
+    exponentially with jitter while broker is unreachable. on_disconnect is awaited when a connection that was up is
+    found broken (eg to mark prices of its partition stale) and on_connect once it is connected again (eg to replay
+    subscriptions of its partition)."""
+
+    def __init__(self):
+        self.__locks: Dict[int, asyncio.Lock] = {}
+        self.__on_connect: Optional[Callable[[int], Awaitable]] = None
+        self.__on_disconnect: Optional[Callable[[int], Awaitable]] = None
+        # counters for observability
+        self.__reconnects_by_reason: Dict[str, int] = {}
+        self.__skipped = 0
+        self.__failed_attempts = 0
+
+    def set_callbacks(self, on_connect: Callable[[int], Awaitable] = None,
+                      on_disconnect: Callable[[int], Awaitable] = None) -> None:
+        self.__on_connect = on_connect
+        self.__on_disconnect = on_disconnect
+
+    @staticmethod
+    def get_backoff(attempt: int) -> float:
+        """exponential backoff with equal jitter , half of the capped delay is fixed and half is random so that nodes
+        that lost broker together do not retry in lockstep"""
+        delay = min(BrokerConfig.ws_reconnect_max_backoff_sec, BrokerConfig.ws_reconnect_backoff_sec * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def is_reconnecting(self, connection_index: int) -> bool:
+        lock = self.__locks.get(connection_index)
+        return lock is not None and lock.locked()
+
+    def request_reconnect(self, connection_index: Optional[int] = None, reason: str = "") -> None:
+        """reconnect a connection or all connections in background tasks , for callers that must not wait for broker
+        eg redis topic consumer"""
+        connections = WS.get_instance().connections
+        for connection in connections if connection_index is None else [connections[connection_index]]:
+            asyncio.create_task(self.reconnect(connection.index, reason=reason))
+
+    async def reconnect(self, connection_index: int, reason: str = "") -> bool:
+        """(re)connect connection till it succeeds
+        :return False if skipped because connection was reconnected after this request"""
+        connection = WS.get_instance().connections[connection_index]
+        requested_at = time.time()
+        async with self.__locks.setdefault(connection_index, asyncio.Lock()):
+            connected_at = connection.get_connected_at()
+            if connected_at is not None and connected_at >= requested_at and connection.is_open():
+                self.__skipped += 1
+                return False
+            if connected_at is not None and not connection.is_stale():
+                connection.mark_disconnected()
+                await self.__run_callback(self.__on_disconnect, connection_index)
+            attempt = 0
+            while True:
+                try:
+                    await connection.connect()
+                    break
+                except Exception as e:
+                    self.__failed_attempts += 1
+                    backoff = self.get_backoff(attempt)
+                    logger.error(extra=context_log_meta.get(),
+                                 msg=f"ws_supervisor: connection {connection_index} could not connect : {e} , "
+                                     f"retrying in {backoff:.2f} sec")
+                    await asyncio.sleep(backoff)
+                    attempt += 1
+            self.__reconnects_by_reason[reason] = self.__reconnects_by_reason.get(reason, 0) + 1
+            logger.info(extra=context_log_meta.get(),
+                        msg=f"ws_supervisor: connection {connection_index} connected , reason : {reason}")
+            await self.__run_callback(self.__on_connect, connection_index)
+        return True
+
+    @staticmethod
+    async def __run_callback(callback: Optional[Callable[[int], Awaitable]], connection_index: int) -> None:
+        if callback is None:
+            return
+        try:
+            await callback(connection_index)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"ws_supervisor: exception in callback of connection {connection_index} : {e}")
+
+    def get_stats(self) -> dict:
+        """counters of reconnects"""
+        return {
+            "reconnects_by_reason": self.__reconnects_by_reason,
+            "skipped": self.__skipped,
+            "failed_attempts": self.__failed_attempts,
+        }
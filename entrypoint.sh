@@ -10,6 +10,12 @@ run_service() {
   env $(cat /code/config/.env | xargs) /usr/local/bin/uvicorn server.app:app --host=0.0.0.0 --port=19093 --workers=4
 }
 
+# broker ws listener and tick writer in a process of their own , used with INGEST_MODE=external on app servers
+run_ingest() {
+  echo "Generated config, starting sensi ingest..."
+  env $(cat /code/config/.env | xargs)  /usr/local/bin/python -m server.ingest
+}
+
 run_worker() {
   echo "Generated config, starting sensi workers..."
   env $(cat /code/config/.env | xargs)  /usr/local/bin/celery -A worker.scheduler beat
@@ -35,6 +41,10 @@ case "$CMD_TO_EXECUTE" in
   "run_scheduler")
     run_scheduler
     exit $?
+  ;;
+  "run_ingest")
+    run_ingest
+    exit $?
 esac
 
 exec "$@"
\ No newline at end of file
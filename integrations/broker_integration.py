@@ -1,16 +1,20 @@
+import asyncio
 import json
-from datetime import datetime
-from typing import List
+from typing import List, Optional, Callable, Awaitable
 
-from config.constants import RedisKeys
-from config.settings import BrokerConfig, AppConfig
+import httpx
+import orjson
+from websockets.exceptions import ConnectionClosed
+
+from config.settings import BrokerConfig, DerivativeSyncConfig
 from controller.context_manager import context_log_meta
-from data_adapter.redis import Cache
-from data_adapter.ws import WS
+from data_adapter.tick_recorder import TickRecorder
+from data_adapter.tick_writer import TickWriter
+from data_adapter.ws import WS, WSConnection, WSReconnectSupervisor
 from logger import logger
 from models.sensi_models import BrokerWSIncomingMessage
 from models.sensi_models import SensiBrokerResModel, BrokerWSDataTypes
-from utils.utils import make_request
+from utils.utils import make_request, make_async_request, HostRateLimiter
 
 
 class BrokerIntegration:
@@ -40,34 +44,76 @@ class BrokerIntegration:
         return [SensiBrokerResModel(**derivative) for derivative in response_data.get("payload")]
 
     @staticmethod
-    async def broker_ws_listener():
-        """connect to websocket and listen for incoming messages
-        This should run in a separate thread which should not block the main thread or event loop"""
-        await WS.get_instance().connect()
+    async def fetch_derivatives_payload_by_underlying_token_async(
+            client: httpx.AsyncClient, rate_limiter: HostRateLimiter, underlying_token: str) -> Optional[List[dict]]:
+        """fetch all derivatives by underlying token from broker over a shared keep-alive client
+        payload is returned as received so that it can be compared with last synced payload before parsing
+        :return None if broker could not be reached or responded with an error"""
+        response_data, status_code = await make_async_request(
+            client, BrokerConfig.url + BrokerConfig.derivative_url.format(underlying_token), rate_limiter,
+            max_retries=DerivativeSyncConfig.max_retries, backoff_base_ms=DerivativeSyncConfig.backoff_base_ms)
+        if status_code != 200 or not response_data.get("success"):
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"fetch_derivatives_payload_by_underlying_token_async: Error in fetching derivatives "
+                             f"from broker status_code: {status_code} response_data: {response_data}")
+            return None
+        return response_data.get("payload") or []
+
+    @staticmethod
+    async def broker_ws_listener(on_connect: Callable[[int], Awaitable] = None,
+                                 on_disconnect: Callable[[int], Awaitable] = None):
+        """connect all broker websocket connections of the node and listen on each of them in its own task
+        This should run in a separate thread which should not block the main thread or event loop
+        :param on_connect: awaited with connection index every time a connection is (re)established , eg to restore
+        subscriptions of its tokens
+        :param on_disconnect: awaited with connection index when a connection that was up is found broken"""
+        WSReconnectSupervisor.get_instance().set_callbacks(on_connect=on_connect, on_disconnect=on_disconnect)
+        await asyncio.gather(*[BrokerIntegration.broker_ws_connection_listener(connection) for
+                               connection in WS.get_instance().connections])
+
+    @staticmethod
+    async def broker_ws_connection_listener(connection: WSConnection):
+        """listen for incoming messages on a single connection , connection reconnects through the supervisor and
+        resubscribes on its own without affecting other connections"""
+        await WSReconnectSupervisor.get_instance().reconnect(connection.index, reason="startup")
         while True:
             try:
-                data = await WS.get_instance().recv()
-                message_from_broker = BrokerWSIncomingMessage.parse_raw(data)
-                # logger.debug(extra=context_log_meta.get(),
-                #              msg=f"broker_ws_listener: message_from_broker: {message_from_broker}")
-                if message_from_broker.data_type == BrokerWSDataTypes.ERROR:
-                    logger.error(extra=context_log_meta.get(),
-                                 msg=f"broker_ws_listener: Error in message from broker: {message_from_broker}"
-                                     f"trying to reconnect to websocket")
-                    # try to reconnect
-                    await WS.get_instance().connect()
-                elif message_from_broker.data_type == BrokerWSDataTypes.QUOTE:
-                    Cache.get_instance().hset(key=RedisKeys.ENTITY_PRICE_DATA,
-                                              mapping={message_from_broker.payload.get("token"):
-                                                           message_from_broker.payload.get("price")})
-                # register the last ping recieved time in cache
-                Cache.get_instance().hset(key=RedisKeys.LAST_PING_TIME_FROM_WS,
-                                          mapping={AppConfig.node_id: datetime.now().timestamp()})
+                data = await connection.recv()
+                message = orjson.loads(data)
+                # quotes are decoded without the model , ping , error and unknown messages are validated with it
+                quote = BrokerWSIncomingMessage.get_quote(message)
+                if quote is not None:
+                    if connection.awaiting_first_tick:
+                        connection.register_first_tick()
+                    # prices are buffered and written to cache in batches by tick writer
+                    TickWriter.get_instance().add_tick(token=quote[0], price=quote[1])
+                    if TickRecorder.get_instance().is_enabled():
+                        # every tick is kept as history and rolled up into ohlc bars
+                        TickRecorder.get_instance().add_tick(token=quote[0], price=quote[1])
+                    if TickWriter.get_instance().is_batch_full():
+                        await TickWriter.get_instance().flush()
+                else:
+                    message_from_broker = BrokerWSIncomingMessage.parse_obj(message)
+                    # logger.debug(extra=context_log_meta.get(),
+                    #              msg=f"broker_ws_listener: message_from_broker: {message_from_broker}")
+                    if message_from_broker.data_type == BrokerWSDataTypes.ERROR:
+                        logger.error(extra=context_log_meta.get(),
+                                     msg=f"broker_ws_listener: Error in message from broker on connection "
+                                         f"{connection.index}: {message_from_broker} trying to reconnect to websocket")
+                        # try to reconnect
+                        await WSReconnectSupervisor.get_instance().reconnect(connection.index, reason="error frame")
+            except ConnectionClosed as e:
+                # connection may already have been replaced (eg reconnect asked by watchdog) , then recv moves to it
+                if connection.is_open():
+                    continue
+                logger.error(extra=context_log_meta.get(),
+                             msg=f"broker_ws_listener: connection {connection.index} closed : {e} reconnecting")
+                await WSReconnectSupervisor.get_instance().reconnect(connection.index, reason="connection closed")
             except Exception as e:
                 logger.error(extra=context_log_meta.get(),
                              msg=f"broker_ws_listener: exception in broker_ws_listener: {e}")
 
     @staticmethod
-    async def broker_ws_sender(data: json):
-        """send data to websocket"""
-        await WS.get_instance().send(data)
+    async def broker_ws_sender(data: json, connection_index: int = 0):
+        """send data to websocket connection"""
+        await WS.get_instance().send(data, connection_index=connection_index)
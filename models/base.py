@@ -7,3 +7,11 @@ class GenericResponseModel(BaseModel):
     """Generic response model for all usecase and controller responses"""
     success: bool = True
     payload: Optional[Any] = None
+
+
+class EncodedPayloadModel(BaseModel):
+    """payload already encoded as json , body is None when client already has the snapshot identified by etag"""
+    etag: str
+    body: Optional[bytes] = None
+    # cursor of next page for paginated payloads , None on last page
+    next_cursor: Optional[str] = None
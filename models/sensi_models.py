@@ -1,7 +1,9 @@
+import base64
 import enum
-from datetime import datetime
-from typing import Optional, Any, List
+from datetime import datetime, date
+from typing import Optional, Any, List, Dict, Tuple
 
+import orjson
 from pydantic.main import BaseModel
 
 
@@ -13,20 +15,15 @@ class SensiBrokerResModel(BaseModel):
     expiry: Optional[Any] = None
     strike: Optional[float] = 0
 
-    def build_underlying_db_model(self):
-        """builds underlying db model from response model"""
-        from data_adapter.sensi_data import SensiUnderlying
-        res_dict = self.dict(exclude_unset=True)
-        res_dict['expiry'] = None if not res_dict.get('expiry') else res_dict.get('expiry')
-        return SensiUnderlying(**res_dict)
-
-    def build_derivative_db_model(self, underlying_id: int):
-        """builds derivative db model from response model"""
-        from data_adapter.sensi_data import SensiDerivative
-        res_dict = self.dict(exclude_unset=True)
-        res_dict['underlying_id'] = underlying_id
-        res_dict['expiry'] = None if not res_dict.get('expiry') else res_dict.get('expiry')
-        return SensiDerivative(**res_dict)
+    def build_db_row(self, underlying_id: Optional[int] = None) -> dict:
+        """builds column values of underlying / derivative row from response model
+        every row has same keys so that rows can be inserted in a single multi row statement , fields not sent by
+        broker are left null"""
+        row = {field: getattr(self, field) if field in self.__fields_set__ else None for field in self.__fields__}
+        row['expiry'] = row.get('expiry') or None
+        if underlying_id is not None:
+            row['underlying_id'] = underlying_id
+        return row
 
 
 class SensiResModel(SensiBrokerResModel):
@@ -61,6 +58,49 @@ class SensiDerivativeModel(SensiBase):
     underlying_data: SensiUnderlyingModel
 
 
+class DerivativeFilterModel(BaseModel):
+    """filters of option chain of an underlying , pushed down to db , all are optional"""
+    expiry: Optional[date] = None
+    instrument_type: Optional[str] = None
+    min_strike: Optional[float] = None
+    max_strike: Optional[float] = None
+    # strikes on each side of at the money strike , resolved into strike range from live underlying price
+    strikes_around_atm: Optional[int] = None
+    cursor: Optional[str] = None
+    limit: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        return not self.dict(exclude_none=True)
+
+
+class OptionChainCursorModel(BaseModel):
+    """position of last derivative of a page in option chain order (expiry , strike , id)
+    strike range resolved from strikes_around_atm on first page is carried along , so that later pages keep the window
+    of the first page while live price moves"""
+    expiry: date
+    strike: float
+    id: int
+    min_strike: Optional[float] = None
+    max_strike: Optional[float] = None
+
+    def build_cursor(self) -> str:
+        """opaque cursor sent to client"""
+        position = [self.expiry, self.strike, self.id]
+        if self.min_strike is not None or self.max_strike is not None:
+            position += [self.min_strike, self.max_strike]
+        return base64.urlsafe_b64encode(orjson.dumps(position)).decode()
+
+    @classmethod
+    def parse_cursor(cls, cursor: str):
+        """raises ValueError for a cursor not built by build_cursor"""
+        try:
+            expiry, strike, id, *strike_range = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+            min_strike, max_strike = strike_range or (None, None)
+            return cls(expiry=expiry, strike=strike, id=id, min_strike=min_strike, max_strike=max_strike)
+        except Exception as e:
+            raise ValueError(f"invalid cursor : {cursor}") from e
+
+
 class UnderlyingCacheModel(BaseModel):
     """Sensi underlying cache model"""
     token: str
@@ -77,6 +117,100 @@ class UnderlyingCacheModel(BaseModel):
         return cls(token=token, id=int(id))
 
 
+class InstrumentSyncReportModel(BaseModel):
+    """work done to sync a single broker payload , underlyings list or derivatives of an underlying
+    skipped is set when payload hash matched the last synced payload and nothing was diffed or written"""
+    key: str
+    success: bool = True
+    skipped: bool = False
+    fetched: int = 0
+    added: int = 0
+    updated: int = 0
+    deleted: int = 0
+    fetch_ms: float = 0
+    write_ms: float = 0
+
+
+class DerivativeSyncReportModel(BaseModel):
+    """summary of derivative sync across all underlyings"""
+    total_ms: float = 0
+    underlyings: int = 0
+    failed: int = 0
+    skipped: int = 0
+    # derivatives of skipped underlyings , which were not diffed against db
+    skipped_derivatives: int = 0
+    added: int = 0
+    updated: int = 0
+    deleted: int = 0
+    underlying_reports: List[InstrumentSyncReportModel] = []
+
+
+class ExpiryPurgeReportModel(BaseModel):
+    """work done by purge of expired derivatives"""
+    expired: int = 0
+    # tokens of rows deleted earlier (diff sync , failed purge) that were still subscribed , unassigned , priced or
+    # holding a token id
+    deleted_released: int = 0
+    # expired tokens handed over to each node to unsubscribe from broker ws
+    unsubscribed_by_node: Dict[str, int] = {}
+    subscriptions_before: int = 0
+    subscriptions_after: int = 0
+    price_entries_removed: int = 0
+    # ids of token registry released for reuse
+    token_ids_released: int = 0
+    redis_bytes_before: int = 0
+    redis_bytes_after: int = 0
+    reclaimed_bytes: int = 0
+
+
+class StalePriceScanReportModel(BaseModel):
+    """work done by a stale price scan"""
+    # tokens with no tick since this time (epoch sec) are stale
+    cutoff: float = 0
+    # tokens that went stale since previous scan
+    newly_stale: int = 0
+    stale: int = 0
+
+
+class ShardLoadReportModel(BaseModel):
+    """broker ws subscriptions owned by live nodes"""
+    live_nodes: int = 0
+    tokens_by_node: Dict[str, int] = {}
+    # tokens of most loaded node over mean tokens per node
+    max_to_mean: float = 0
+    moved: int = 0
+
+
+class PriceHistoryModel(BaseModel):
+    """ticks ({t , p}) or ohlc bars ({t , o , h , l , c , n}) of a token in a time range , t is epoch seconds"""
+    token: str
+    resolution: str
+    entries: List[dict] = []
+    # id of last entry returned when entries were cut at the query limit , sent back as cursor for the next page ,
+    # None when range is complete
+    next_cursor: Optional[str] = None
+
+
+class TopicMessageModel(BaseModel):
+    """message published on redis topics , published_at is used to measure publish to consume latency"""
+    data: str
+    published_at: Optional[float] = None
+
+    def build_message(self) -> str:
+        return f"{self.data}::{self.published_at}"
+
+    @classmethod
+    def parse_message(cls, message: str):
+        data, separator, published_at = message.rpartition("::")
+        if not separator:
+            # message published without timestamp
+            return cls(data=message)
+        try:
+            return cls(data=data, published_at=float(published_at))
+        except ValueError:
+            return cls(data=message)
+
+
 class BrokerWSCommands(str, enum.Enum):
     """Broker websocket commands"""
     SUBSCRIBE = "subscribe"
@@ -108,3 +242,61 @@ class BrokerWSIncomingMessage(BaseModel):
     """Broker websocket incoming message model"""
     data_type: BrokerWSDataTypes
     payload: Optional[Any] = {}
+
+    @staticmethod
+    def get_quote(message: Any) -> Optional[Tuple[Any, Any]]:
+        """token and price of a decoded QUOTE message without building the model , quotes are almost every message
+        received from broker so validating each of them is the largest cost of the listener
+        :return None if message is not a quote , it should then be parsed with the model"""
+        if type(message) is not dict or message.get("data_type") != "quote":
+            return None
+        payload = message.get("payload")
+        if type(payload) is not dict:
+            return None
+        return payload.get("token"), payload.get("price")
+
+
+class HandoffEntryModel(BaseModel):
+    """entry of handoff stream of a node , tokens node has to subscribe / unsubscribe from broker ws"""
+    command: BrokerWSCommands
+    tokens: List[str]
+    published_at: float = 0.0
+
+    def build_entry(self) -> dict:
+        return {"command": self.command.value, "tokens": ",".join(self.tokens), "published_at": self.published_at}
+
+    @classmethod
+    def parse_entry(cls, fields: dict):
+        return cls(command=fields["command"], tokens=fields["tokens"].split(",") if fields.get("tokens") else [],
+                   published_at=fields.get("published_at", 0.0))
+
+
+class HandoffReportModel(BaseModel):
+    """entries of handoff stream handled by a node in a single read / reclaim"""
+    entries: int = 0
+    subscribed: int = 0
+    unsubscribed: int = 0
+    reclaimed: int = 0
+
+
+class PriceDeltaModel(BaseModel):
+    """latest prices of a flush window published by the node subscribed to them on broker ws"""
+    node_id: str
+    updated_at: float
+    prices: Dict[str, float] = {}
+    # tokens whose prices stopped updating , eg broker ws connection of their partition was lost
+    stale: List[str] = []
+
+
+class PriceStreamActions(str, enum.Enum):
+    """actions a client can send on price stream websocket"""
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
+
+
+class PriceStreamCommandModel(BaseModel):
+    """price stream websocket command , symbols are underlying symbols and subscribe the underlying along with
+    all its derivatives"""
+    action: PriceStreamActions
+    symbols: List[str] = []
+    tokens: List[str] = []
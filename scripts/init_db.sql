@@ -35,3 +35,9 @@ CREATE TABLE public.sensi_derivative (
 	CONSTRAINT sensi_derivatives_fk FOREIGN KEY (underlying_id) REFERENCES public.sensi_underlying(id)
 );
 CREATE INDEX sensi_derivatives_underlying_id_idx ON public.sensi_derivative USING btree (underlying_id);
+-- option chain queries filter by underlying (+ instrument type) , expiry and strike range and page in
+-- (expiry , strike , id) order , same expressions as OPTION_CHAIN_*_KEY in data_adapter/sensi_data.py
+CREATE INDEX sensi_derivative_chain_idx ON public.sensi_derivative USING btree (underlying_id,
+	COALESCE(expiry, '9999-12-31'), COALESCE(strike, 0), id) WHERE is_deleted = false;
+CREATE INDEX sensi_derivative_type_chain_idx ON public.sensi_derivative USING btree (underlying_id, instrument_type,
+	COALESCE(expiry, '9999-12-31'), COALESCE(strike, 0), id) WHERE is_deleted = false;
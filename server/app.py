@@ -1,17 +1,15 @@
 #!/usr/bin/env python3
 import asyncio
-import threading
 
 import uvicorn
 from fastapi import FastAPI
 
-from config.constants import RedisKeys
-from config.settings import AppConfig
-from controller import status, sensi_controller
+from config.constants import IngestModes
+from config.settings import AppConfig, ShardConfig
+from controller import status, sensi_controller, price_stream_controller
 from data_adapter import db
-from data_adapter.redis import Cache
-from integrations.broker_integration import BrokerIntegration
 from logger import logger
+from server.ingest import start_ingest, stop_ingest
 from usecases.sensi_usecase import SensiUseCase
 
 app = FastAPI()
@@ -20,33 +18,7 @@ db.DBBase.metadata.create_all(bind=db.db_engine)
 
 app.include_router(status.router)
 app.include_router(sensi_controller.sensi_router)
-
-"""we are trying to bound the asynchronous functions to a thread so that we can run them in a synchronous manner
-inside the background threads
-We would create a new event loop for each thread and run the asynchronous functions in that event loop
-"""
-
-
-async def redis_subscriber_callback():
-    await SensiUseCase.subscribe_and_poll_topic_data()
-
-
-def redis_subscriber_between_callback():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(redis_subscriber_callback())
-    loop.close()
-
-
-# async def broker_ws_listener_callback():
-#     await BrokerIntegration.broker_ws_listener()
-#
-#
-# def broker_ws_callback_listener():
-#     loop = asyncio.new_event_loop()
-#     asyncio.set_event_loop(loop)
-#     loop.run_until_complete(broker_ws_listener_callback())
-#     loop.close()
+app.include_router(price_stream_controller.price_stream_router)
 
 
 @app.on_event("startup")
@@ -54,18 +26,16 @@ async def startup_event():
     """this is the startup event which will be called when the fastapi server starts"""
     logger.info("Startup Event Triggered node_id: {}".format(AppConfig.node_id))
     try:
-        """start a background thread to subscribe to redis and poll for broker ws listener"""
-        logger.info("Starting background thread for redis subscriber")
-        _redis_subscriber_thread = threading.Thread(target=redis_subscriber_between_callback, args=())
-        _redis_subscriber_thread.start()
-        logger.info("Starting background thread for broker ws listener")
-        # _broker_ws_listener_thread = threading.Thread(target=broker_ws_callback_listener, args=())
-        # _broker_ws_listener_thread.start()
-
-        #  for WS we can use existing app server event loop instead of creating new event loop in a new thread
-        asyncio.create_task(BrokerIntegration.broker_ws_listener())
-        # register the node id in redis nodes list
-        Cache.get_instance().hset(key=RedisKeys.NODE_IDS_IN_CLUSTER, mapping={AppConfig.node_id: 1})
+        # redis topics (ws reconnect , price deltas , catalog version) are consumed on the app event
+        # loop , so work for the ws sender is handed over without a second event loop
+        logger.info("Starting redis topic consumer")
+        asyncio.create_task(SensiUseCase.consume_topic_data())
+        if AppConfig.ingest_mode == IngestModes.EMBEDDED:
+            # API requests share this event loop , heartbeat gets a ttl that outlasts their blocking work
+            await start_ingest(heartbeat_ttl_ms=ShardConfig.embedded_heartbeat_ttl_ms)
+        else:
+            # prices reach the price table of this node through the price delta feed of ingest processes
+            logger.info("Ingest mode {} , broker ws is not connected by app server".format(AppConfig.ingest_mode))
         logger.info("Startup Event Completed node_id = {}".format(AppConfig.node_id))
     except Exception as e:
         logger.error(f"Error while connecting to websocket {e}")
@@ -74,6 +44,8 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutdown Event Triggered")
+    if AppConfig.ingest_mode == IngestModes.EMBEDDED:
+        await stop_ingest()
     # TODO : handle closing down of threads and ws connection and redis connection
 
 
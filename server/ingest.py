@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""broker tick ingestion of a node , broker ws listener with its connections , tick writer and redis topic consumer
+In embedded ingest mode these run on the event loop of the app server. In external ingest mode they run in
+dedicated ingest processes started with 'python -m server.ingest' , so a burst of ticks does not compete with
+API requests for the event loop and GIL of app servers. Ingest process is a node of its own , it registers itself
+in NODE_IDS_IN_CLUSTER , owns ws subscriptions and hands prices over to app servers through ENTITY_PRICE_DATA and
+the price delta feed. Multiple ingest processes share tokens between them like app nodes do."""
+import asyncio
+import signal
+import time
+
+from config.constants import RedisKeys
+from config.settings import AppConfig, ShardConfig
+from data_adapter.async_redis import AsyncCache
+from data_adapter.tick_recorder import TickRecorder
+from data_adapter.tick_writer import TickWriter
+from integrations.broker_integration import BrokerIntegration
+from logger import logger
+from usecases.handoff_usecase import HandoffUseCase
+from usecases.node_health_usecase import NodeHealthUseCase
+from usecases.sensi_usecase import SensiUseCase
+
+
+async def start_ingest(heartbeat_ttl_ms: int = ShardConfig.heartbeat_ttl_ms):
+    """start ingestion tasks on the running event loop and register the node
+    :param heartbeat_ttl_ms: ttl of heartbeat of the node , longer for an event loop shared with API requests"""
+    NodeHealthUseCase.heartbeat_ttl_ms = heartbeat_ttl_ms
+    logger.info("Starting broker ws listener")
+    #  for WS we can use existing event loop instead of creating new event loop in a new thread
+    # tokens owned by the node (NODE_ID_WS_ENTITY_MAPPING) are subscribed again whenever a ws connection
+    # (re)connects , each connection resubscribes only tokens of its own partition
+    # prices of a connection found broken are marked stale till its first tick after reconnect
+    asyncio.create_task(BrokerIntegration.broker_ws_listener(on_connect=SensiUseCase.resubscribe_owned_entities,
+                                                             on_disconnect=SensiUseCase.mark_partition_stale))
+    # tick writer flushes prices buffered by broker ws listener to redis
+    asyncio.create_task(TickWriter.get_instance().run())
+    if TickRecorder.get_instance().is_enabled():
+        # tick recorder writes tick history and ohlc bars
+        asyncio.create_task(TickRecorder.get_instance().run())
+    # tokens handed over to the node wait in its handoff stream till read , including those handed over before start
+    asyncio.create_task(HandoffUseCase.run())
+    # register the node id in redis nodes list after its first heartbeat , node is live while heartbeat is written
+    await NodeHealthUseCase.beat()
+    await AsyncCache.get_instance().hset(key=RedisKeys.NODE_IDS_IN_CLUSTER, mapping={AppConfig.node_id: time.time()})
+    # heartbeat and silent connection watchdog of this node , detection and takeover of dead nodes
+    asyncio.create_task(NodeHealthUseCase.run_heartbeat())
+    asyncio.create_task(NodeHealthUseCase.run_monitor())
+
+
+async def stop_ingest():
+    """write out ticks still buffered and mark node as not alive so that other nodes take over its tokens right away"""
+    await TickWriter.get_instance().flush()
+    if TickRecorder.get_instance().is_enabled():
+        await TickRecorder.get_instance().flush()
+    await AsyncCache.get_instance().hset(key=RedisKeys.NODE_IDS_IN_CLUSTER, mapping={AppConfig.node_id: 0})
+    await NodeHealthUseCase.stop()
+
+
+async def run():
+    """entrypoint of an ingest process , runs till SIGTERM / SIGINT"""
+    logger.info("Ingest process started node_id: {}".format(AppConfig.node_id))
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+    # redis topics carry price deltas , catalog versions and reconnect requests
+    asyncio.create_task(SensiUseCase.consume_topic_data())
+    await start_ingest()
+    await stop.wait()
+    logger.info("Ingest process stopping node_id: {}".format(AppConfig.node_id))
+    await stop_ingest()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import asyncio
+import socket
+
+import httpx
+import orjson
+import websockets
+
+from benchmarks.fake_broker import FakeBroker
+from config.settings import BrokerConfig
+from integrations.broker_integration import BrokerIntegration
+from models.sensi_models import BrokerWSIncomingMessage, SensiBrokerResModel
+from usecases.sensi_usecase import SensiUseCase
+from utils.utils import HostRateLimiter
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def receive_quote(ws) -> tuple:
+    """first quote on the connection , pings are skipped"""
+    while True:
+        quote = BrokerWSIncomingMessage.get_quote(orjson.loads(await ws.recv()))
+        if quote is not None:
+            return quote
+
+
+async def run_smoke(monkeypatch) -> None:
+    broker = FakeBroker(underlyings=2, derivatives_per_underlying=10, tick_rate=200)
+    rest_port, ws_port = get_free_port(), get_free_port()
+    server = await broker.start(rest_port, ws_port)
+    monkeypatch.setattr(BrokerConfig, "url", f"http://127.0.0.1:{rest_port}")
+    try:
+        # sync fetch blocks , it is run off the loop serving the broker
+        underlyings = await asyncio.to_thread(BrokerIntegration.fetch_all_underlyings)
+        assert [underlying.token for underlying in underlyings] == [u["token"] for u in broker.underlyings]
+        async with httpx.AsyncClient() as client:
+            payload = await BrokerIntegration.fetch_derivatives_payload_by_underlying_token_async(
+                client, HostRateLimiter(100), underlyings[0].token)
+        derivatives = [SensiBrokerResModel(**derivative) for derivative in payload]
+        assert len(derivatives) == 10
+        assert {derivative.underlying for derivative in derivatives} == {underlyings[0].symbol}
+        rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(payload, {})
+        assert (len(rows_to_insert), rows_to_update, tokens_to_delete) == (10, [], [])
+
+        tokens = [derivative.token for derivative in derivatives[:3]]
+        async with websockets.connect(f"ws://127.0.0.1:{ws_port}") as ws:
+            await ws.send(orjson.dumps({"msg_command": "subscribe", "tokens": tokens}).decode())
+            token, price = await asyncio.wait_for(receive_quote(ws), timeout=5)
+            assert token in tokens
+            assert price > 0
+            await ws.send(orjson.dumps({"msg_command": "unsubscribe", "tokens": tokens}).decode())
+            await asyncio.sleep(0.1)
+            assert broker.get_subscribed_tokens() == set()
+        assert broker.counters["ticks_sent"] > 0
+    finally:
+        await server.stop()
+
+
+def test_instruments_and_quotes_from_fake_broker(monkeypatch):
+    asyncio.run(run_smoke(monkeypatch))
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from data_adapter.async_redis import AsyncCache
+from data_adapter.price_table import PriceTable
+from models.sensi_models import BrokerWSCommands, HandoffEntryModel
+from usecases.handoff_usecase import HandoffUseCase
+from usecases.sensi_usecase import SensiUseCase
+
+
+class Broker:
+    """stands in for broker ws , price table and redis of the node , keeps what handoff sends to them"""
+
+    def __init__(self, owned_tokens):
+        self.owned_tokens = owned_tokens
+        self.commands = []
+        self.removed = []
+        self.acked = []
+
+    async def get_owned_tokens(self):
+        return self.owned_tokens
+
+    async def send_ws_command(self, command, tokens):
+        self.commands.append((command, list(tokens)))
+
+    def remove(self, tokens):
+        self.removed.extend(tokens)
+
+    async def xack_and_delete(self, key, group, entry_ids):
+        self.acked.extend(entry_ids)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = Broker(owned_tokens=["1", "2", "5"])
+    monkeypatch.setattr(SensiUseCase, "get_owned_tokens", broker.get_owned_tokens)
+    monkeypatch.setattr(SensiUseCase, "send_ws_command", broker.send_ws_command)
+    monkeypatch.setattr(AsyncCache, "get_instance", lambda: broker)
+    monkeypatch.setattr(PriceTable, "get_instance", lambda: broker)
+    monkeypatch.setattr(HandoffUseCase, "counters", {counter: 0 for counter in HandoffUseCase.counters})
+    return broker
+
+
+def build_entry(entry_id: str, command: BrokerWSCommands, tokens):
+    return entry_id, HandoffEntryModel(command=command, tokens=tokens).build_entry()
+
+
+ENTRIES = [
+    build_entry("1-0", BrokerWSCommands.SUBSCRIBE, ["1", "2", "3"]),
+    build_entry("2-0", BrokerWSCommands.SUBSCRIBE, ["4", "5"]),
+    build_entry("3-0", BrokerWSCommands.UNSUBSCRIBE, ["2", "6"]),
+    build_entry("4-0", BrokerWSCommands.SUBSCRIBE, ["6"]),
+]
+
+
+def test_entries_are_sent_as_read(broker):
+    report = asyncio.run(HandoffUseCase.handle_entries(ENTRIES))
+    assert broker.commands == [(BrokerWSCommands.SUBSCRIBE, ["1", "2", "3", "4", "5"]),
+                               (BrokerWSCommands.UNSUBSCRIBE, ["2", "6"]),
+                               (BrokerWSCommands.SUBSCRIBE, ["6"])]
+    assert broker.removed == ["2", "6"]
+    assert broker.acked == ["1-0", "2-0", "3-0", "4-0"]
+    assert (report.entries, report.subscribed, report.unsubscribed, report.reclaimed) == (4, 6, 2, 0)
+
+
+def test_reclaimed_entries_only_move_tokens_towards_current_ownership(broker):
+    report = asyncio.run(HandoffUseCase.handle_entries(ENTRIES, reclaimed=True))
+    # tokens no longer owned are not subscribed , tokens owned again are not unsubscribed
+    assert broker.commands == [(BrokerWSCommands.SUBSCRIBE, ["1", "2", "5"]),
+                               (BrokerWSCommands.UNSUBSCRIBE, ["6"])]
+    assert broker.removed == ["6"]
+    assert broker.acked == ["1-0", "2-0", "3-0", "4-0"]
+    assert (report.entries, report.subscribed, report.unsubscribed, report.reclaimed) == (4, 3, 1, 4)
+    assert HandoffUseCase.counters["reclaimed"] == 4
+
+
+def test_reclaimed_entries_with_nothing_left_to_send_are_acked(broker):
+    broker.owned_tokens = []
+    report = asyncio.run(HandoffUseCase.handle_entries(ENTRIES[:2], reclaimed=True))
+    assert broker.commands == []
+    assert broker.acked == ["1-0", "2-0"]
+    assert (report.subscribed, report.unsubscribed) == (0, 0)
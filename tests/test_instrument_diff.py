@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+from usecases.sensi_usecase import SensiUseCase
+
+EXPIRY = date.today() + timedelta(days=7)
+
+
+def build_row(token: str, strike: float = 1000.0, expiry=EXPIRY.isoformat()) -> dict:
+    """row built from broker payload , dates are iso strings"""
+    return {"token": token, "symbol": f"SYM{token}", "underlying": "SYM", "instrument_type": "CE", "expiry": expiry,
+            "strike": strike}
+
+
+def build_row_in_db(token: str, strike: float = 1000.0, expiry=EXPIRY, is_deleted: bool = False) -> dict:
+    """row as read from db , dates are date objects"""
+    return {**build_row(token, strike=strike, expiry=expiry), "is_deleted": is_deleted}
+
+
+def test_unchanged_rows_are_left_alone():
+    rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+        [build_row("1"), build_row("2")], {"1": build_row_in_db("1"), "2": build_row_in_db("2")})
+    assert (rows_to_insert, rows_to_update, tokens_to_delete) == ([], [], [])
+
+
+def test_new_changed_and_missing_rows():
+    rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+        [build_row("1"), build_row("2", strike=1100.0), build_row("4")],
+        {"1": build_row_in_db("1"), "2": build_row_in_db("2"), "3": build_row_in_db("3")})
+    assert [row["token"] for row in rows_to_insert] == ["4"]
+    assert [row["token"] for row in rows_to_update] == ["2"]
+    assert tokens_to_delete == ["3"]
+
+
+def test_deleted_rows_sent_again_are_updated_and_not_deleted_again():
+    rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+        [build_row("1")], {"1": build_row_in_db("1", is_deleted=True), "2": build_row_in_db("2", is_deleted=True)})
+    assert rows_to_insert == []
+    assert [row["token"] for row in rows_to_update] == ["1"]
+    assert tokens_to_delete == []
+
+
+def test_expired_rows_sent_by_broker_are_treated_as_not_sent():
+    expired = (date.today() - timedelta(days=1)).isoformat()
+    rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+        [build_row("1", expiry=expired), build_row("2", expiry=expired)], {"1": build_row_in_db("1")})
+    assert (rows_to_insert, rows_to_update, tokens_to_delete) == ([], [], ["1"])
+
+
+def test_rows_without_expiry():
+    rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+        [build_row("1", expiry=None)], {"1": build_row_in_db("1", expiry=None)})
+    assert (rows_to_insert, rows_to_update, tokens_to_delete) == ([], [], [])
+
+
+def test_normalize_field():
+    normalize_field = SensiUseCase._SensiUseCase__normalize_field
+    assert normalize_field(date(2026, 10, 22)) == "2026-10-22"
+    assert normalize_field("2026-10-22") == "2026-10-22"
+    assert normalize_field(1000.0) == 1000.0
+    assert normalize_field(None) is None
@@ -0,0 +1,62 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from data_adapter.sensi_data import SensiDerivative
+from models.sensi_models import OptionChainCursorModel, DerivativeFilterModel, SensiResModel
+from usecases.sensi_usecase import SensiUseCase
+
+
+def test_cursor_round_trip():
+    cursor = OptionChainCursorModel(expiry=date(2026, 10, 22), strike=1050.5, id=42)
+    assert OptionChainCursorModel.parse_cursor(cursor.build_cursor()) == cursor
+
+
+def test_cursor_round_trip_with_strike_window():
+    cursor = OptionChainCursorModel(expiry=date(2026, 10, 22), strike=1050.5, id=42, min_strike=1000, max_strike=1100)
+    parsed = OptionChainCursorModel.parse_cursor(cursor.build_cursor())
+    assert parsed == cursor
+    assert (parsed.min_strike, parsed.max_strike) == (1000, 1100)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "W10=", "WyJ4IiwxLDJd",
+                                    "WyIyMDI2LTEwLTIyIiwxLDIsM10=", "eyJhIjoxfQ=="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        OptionChainCursorModel.parse_cursor(cursor)
+
+
+def test_later_pages_reuse_strike_window(monkeypatch):
+    """strike window of first page travels in cursor , later pages do not resolve it again from live price"""
+    pages = []
+
+    async def resolve_strikes_around_atm(symbol, filters):
+        return filters.copy(update={"min_strike": 1000.0, "max_strike": 1100.0})
+
+    def get_option_chain_page(symbol, filters, limit, after=None):
+        pages.append((filters.min_strike, filters.max_strike))
+        derivative = SensiResModel(token="1", symbol="SYM", underlying="SYM", instrument_type="CE",
+                                   expiry=date(2026, 10, 22), strike=1000.0)
+        return [derivative], OptionChainCursorModel(expiry=date(2026, 10, 22), strike=1000.0, id=len(pages))
+
+    async def build_encoded_prices_payload(entry, **kwargs):
+        return type("Payload", (), {})()
+
+    monkeypatch.setattr(SensiUseCase, "resolve_strikes_around_atm", resolve_strikes_around_atm)
+    monkeypatch.setattr(SensiDerivative, "get_option_chain_page", get_option_chain_page)
+    monkeypatch.setattr(SensiUseCase, "build_encoded_prices_payload", build_encoded_prices_payload)
+
+    first = asyncio.run(SensiUseCase.get_option_chain("SYM", DerivativeFilterModel(strikes_around_atm=1)))
+    assert first.success
+    next_cursor = OptionChainCursorModel.parse_cursor(first.payload.next_cursor)
+    assert (next_cursor.min_strike, next_cursor.max_strike) == (1000.0, 1100.0)
+
+    async def moved_price(symbol, filters):
+        return filters.copy(update={"min_strike": 2000.0, "max_strike": 2100.0})
+
+    monkeypatch.setattr(SensiUseCase, "resolve_strikes_around_atm", moved_price)
+    second = asyncio.run(SensiUseCase.get_option_chain("SYM", DerivativeFilterModel(
+        strikes_around_atm=1, cursor=first.payload.next_cursor)))
+    assert second.success
+    assert pages == [(1000.0, 1100.0), (1000.0, 1100.0)]
@@ -0,0 +1,100 @@
+import asyncio
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import orjson
+
+from config.settings import OptionAnalyticsConfig
+from data_adapter.instrument_catalog import CatalogEntry
+from models.sensi_models import SensiResModel
+from usecases.analytics_usecase import AnalyticsUseCase
+from utils.option_greeks import implied_volatility, option_price
+
+RATE = 0.065
+
+
+def build_grid():
+    """calls and puts over strikes from deep in to deep out of the money , expiries and volatilities"""
+    rows = [(strike, years, volatility, is_call) for strike in (600, 900, 1000, 1100, 1500)
+            for years in (2 / 365, 0.1, 1) for volatility in (0.1, 0.3, 0.8) for is_call in (True, False)]
+    strike, years, volatility, is_call = zip(*rows)
+    return (np.full(len(rows), 1000.0), np.array(strike, dtype=float), np.array(years), np.array(volatility),
+            np.array(is_call))
+
+
+def test_recovers_volatility_of_black_scholes_prices():
+    spot, strike, years, volatility, is_call = build_grid()
+    price = option_price(spot, strike, years, volatility, is_call, RATE)
+    solved = implied_volatility(price, spot, strike, years, is_call, RATE)
+    # prices a tick size away from intrinsic carry no information on volatility , those are left out
+    lower_bound = np.where(is_call, np.maximum(spot - strike * np.exp(-RATE * years), 0),
+                           np.maximum(strike * np.exp(-RATE * years) - spot, 0))
+    informative = price - lower_bound > 0.05
+    assert informative.sum() > len(price) / 2
+    np.testing.assert_allclose(solved[informative], volatility[informative], atol=1e-3)
+
+
+def test_expired_options_are_not_solved():
+    price = np.array([50.0, 50.0])
+    solved = implied_volatility(price, np.full(2, 1000.0), np.full(2, 1000.0), np.array([0.0, -0.1]),
+                                np.array([True, False]), RATE)
+    assert np.isnan(solved).all()
+
+
+def test_prices_outside_no_arbitrage_bounds_are_not_solved():
+    spot, strike, years = np.full(4, 1000.0), np.array([900.0, 900.0, 1100.0, 1100.0]), np.full(4, 0.1)
+    is_call = np.array([True, True, False, False])
+    # below intrinsic value and above spot / discounted strike
+    price = np.array([90.0, 1000.0, 90.0, 1100.0])
+    assert np.isnan(implied_volatility(price, spot, strike, years, is_call, RATE)).all()
+
+
+def test_nan_prices_are_not_solved():
+    solved = implied_volatility(np.array([np.nan]), np.array([1000.0]), np.array([1000.0]), np.array([0.1]),
+                                np.array([True]), RATE)
+    assert np.isnan(solved).all()
+
+
+def build_entry(expiry: date) -> CatalogEntry:
+    return CatalogEntry([
+        SensiResModel(token="1", symbol="SYMCE", underlying="SYM", instrument_type="CE", expiry=expiry, strike=1000.0),
+        SensiResModel(token="2", symbol="SYMFUT", underlying="SYM", instrument_type="FUT", expiry=expiry)],
+        version_tag="test")
+
+
+def test_greeks_move_with_valuation_time():
+    entry = build_entry(date.today() + timedelta(days=30))
+    valued_at = datetime.now().timestamp()
+    today, next_week = [orjson.loads(b'{' + AnalyticsUseCase.build_encoded_greeks(
+        entry, [40.0, 1000.0], underlying_price=1000.0, valued_at=at)[0][1:] + b'}') for at in
+        (valued_at, valued_at + 7 * 24 * 3600)]
+    assert today["iv"] < next_week["iv"]
+    assert AnalyticsUseCase.build_encoded_greeks(entry, [40.0, 1000.0], underlying_price=1000.0,
+                                                 valued_at=valued_at)[1] == \
+        b',"iv":null,"delta":null,"gamma":null,"theta":null,"vega":null'
+
+
+def test_valuation_time_is_start_of_bucket(monkeypatch):
+    monkeypatch.setattr(OptionAnalyticsConfig, "time_bucket_sec", 60)
+    valued_at = AnalyticsUseCase.get_valuation_time()
+    assert valued_at % 60 == 0
+    assert 0 <= datetime.now().timestamp() - valued_at < 60
+
+
+def test_encoded_greeks_are_cached_per_snapshot(monkeypatch):
+    solves = []
+    build_encoded_greeks = AnalyticsUseCase.build_encoded_greeks
+
+    def counting_build(*args, **kwargs):
+        solves.append(1)
+        return build_encoded_greeks(*args, **kwargs)
+
+    monkeypatch.setattr(AnalyticsUseCase, "build_encoded_greeks", counting_build)
+    monkeypatch.setattr(AnalyticsUseCase, "greeks_by_snapshot", OrderedDict())
+    entry = build_entry(date.today() + timedelta(days=30))
+    valued_at = AnalyticsUseCase.get_valuation_time()
+    for snapshot_key in ("a", "a", "b"):
+        asyncio.run(AnalyticsUseCase.get_encoded_greeks(entry, [40.0, 1000.0], underlying_price=1000.0,
+                                                        valued_at=valued_at, snapshot_key=snapshot_key))
+    assert len(solves) == 2
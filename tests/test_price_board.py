@@ -0,0 +1,158 @@
+import mmap
+import os
+
+import pytest
+
+from config.settings import PriceBoardConfig
+from data_adapter import price_board
+from data_adapter.price_board import PriceBoard, SEQ_FIELD
+from data_adapter.redis import Cache
+from data_adapter.token_registry import TokenRegistry
+
+TOKENS = ["101", "102", "103", "104"]
+
+
+class Clock:
+    """stands in for time module of the board , remap checks are at most once a second"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class ReleasingCache:
+    """stands in for redis of the registry , releases every id asked for"""
+
+    def __init__(self, registry: TokenRegistry):
+        self.registry = registry
+
+    def run_script(self, script, keys, args):
+        return [token_id for token_id in self.registry.get_ids(args) if token_id is not None]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(price_board, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = str(tmp_path / "price_board")
+    monkeypatch.setattr(PriceBoardConfig, "path", path)
+    monkeypatch.setattr(PriceBoardConfig, "capacity", 4)
+    return path
+
+
+def build_registry(tokens) -> TokenRegistry:
+    registry = TokenRegistry._cls()
+    registry.add_tokens(0, tokens)
+    return registry
+
+
+def use_registry(monkeypatch, registry: TokenRegistry) -> None:
+    """registry of the process the next board call runs in"""
+    monkeypatch.setattr(TokenRegistry, "get_instance", lambda: registry)
+
+
+def test_prices_written_are_read_by_another_process(path, clock, monkeypatch):
+    use_registry(monkeypatch, build_registry(TOKENS))
+    writer, reader = PriceBoard._cls(), PriceBoard._cls()
+    assert reader.get_many(TOKENS) is None
+    assert writer.write_many({"101": 10.5, "103": 30}, updated_at=clock.now) == 2
+    # reader looks for the board again a second after it was not found
+    assert reader.get_many(TOKENS) is None
+    clock.now += 1
+    assert reader.get_many(TOKENS + ["999"]) == [10.5, None, 30.0, None, None]
+    # token ids of the caller are used as they are
+    assert reader.get_many(["103"], token_ids=[2]) == [30.0]
+
+
+def test_stale_prices_are_not_served(path, clock, monkeypatch):
+    use_registry(monkeypatch, build_registry(TOKENS))
+    board = PriceBoard._cls()
+    board.write_many({"101": 10.0}, updated_at=clock.now - 3600)
+    assert board.get_many(["101"]) == [None]
+
+
+def test_tokens_beyond_capacity_or_without_id_are_skipped(path, clock, monkeypatch):
+    use_registry(monkeypatch, build_registry(TOKENS + ["105"]))
+    board = PriceBoard._cls()
+    assert board.write_many({"101": 1.0, "105": 5.0, "999": 9.0}, updated_at=clock.now) == 1
+    assert board.get_many(["101", "105", "999"]) == [1.0, None, None]
+    assert board.get_many(["101", "105"], token_ids=[None, 4]) == [None, None]
+
+
+def test_long_tokens_are_kept(path, clock, monkeypatch):
+    long_token = "NIFTY" * 20
+    use_registry(monkeypatch, build_registry([long_token]))
+    board = PriceBoard._cls()
+    assert board.write_many({long_token: 1.0}, updated_at=clock.now) == 1
+    assert board.get_many([long_token]) == [1.0]
+
+
+def test_odd_seqlock_counter_exhausts_retries(path, clock, monkeypatch):
+    use_registry(monkeypatch, build_registry(TOKENS))
+    board = PriceBoard._cls()
+    board.write_many({"101": 1.0}, updated_at=clock.now)
+    # writer died inside a write , counter stays odd
+    fd = os.open(path, os.O_RDWR)
+    with mmap.mmap(fd, 0) as mapping:
+        header = memoryview(mapping)[:(SEQ_FIELD + 1) * 8].cast('Q')
+        header[SEQ_FIELD] += 1
+        assert board.get_many(["101", "102"]) == [None, None]
+        assert board.get_stats()["read_retries"] == PriceBoardConfig.max_read_retries
+        header[SEQ_FIELD] += 1
+        header.release()
+    os.close(fd)
+    assert board.get_many(["101"]) == [1.0]
+
+
+def test_reader_remaps_replaced_board(path, clock, monkeypatch):
+    use_registry(monkeypatch, build_registry(TOKENS))
+    reader = PriceBoard._cls()
+    PriceBoard._cls().write_many({"101": 1.0}, updated_at=clock.now)
+    assert reader.get_many(["101"]) == [1.0]
+    os.unlink(path)
+    PriceBoard._cls().write_many({"101": 2.0}, updated_at=clock.now)
+    # old mapping is served till the next check , a second after it was mapped
+    assert reader.get_many(["101"]) == [1.0]
+    clock.now += 1
+    assert reader.get_many(["101"]) == [2.0]
+
+
+def test_board_of_another_capacity_is_replaced(path, clock, monkeypatch):
+    use_registry(monkeypatch, build_registry(TOKENS + ["105"]))
+    PriceBoard._cls().write_many({"101": 1.0}, updated_at=clock.now)
+    monkeypatch.setattr(PriceBoardConfig, "capacity", 8)
+    reader = PriceBoard._cls()
+    assert reader.get_many(["101"]) is None
+    assert PriceBoard._cls().write_many({"105": 5.0}, updated_at=clock.now) == 1
+    clock.now += 1
+    assert reader.get_many(["101", "105"]) == [None, 5.0]
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith(".tmp")]
+
+
+def test_slot_of_released_id_is_reused(path, clock, monkeypatch):
+    # writer process loads the release and the reassigned id , reader process is still behind
+    writer_registry, reader_registry = build_registry(TOKENS), build_registry(TOKENS)
+    writer, reader = PriceBoard._cls(), PriceBoard._cls()
+    use_registry(monkeypatch, writer_registry)
+    writer.write_many({"101": 1.0, "102": 2.0}, updated_at=clock.now)
+    monkeypatch.setattr(Cache, "get_instance", lambda: ReleasingCache(writer_registry))
+    assert writer_registry.release_ids(["101"]) == 1
+    writer.write_many({"102": 2.5}, updated_at=clock.now)
+    use_registry(monkeypatch, reader_registry)
+    # slot of the released id is cleared by the writer
+    assert reader.get_many(["101", "102"]) == [None, 2.5]
+    # id 0 is given to a new token , slot carries it and is not served for the token it belonged to before
+    reassigned_registry = build_registry(["201"] + TOKENS[1:])
+    use_registry(monkeypatch, reassigned_registry)
+    assert writer.write_many({"201": 20.0}, updated_at=clock.now) == 1
+    use_registry(monkeypatch, reader_registry)
+    assert reader.get_many(["101"]) == [None]
+    use_registry(monkeypatch, reassigned_registry)
+    assert PriceBoard._cls().get_many(["201", "102"]) == [20.0, 2.5]
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from data_adapter.async_redis import AsyncCache
+from usecases.history_usecase import HistoryUseCase, MAX_ENTRY_SEQUENCE
+
+
+def parse_id(entry_id: str, default_sequence: int):
+    if entry_id in ("-", "+"):
+        return (-1, 0) if entry_id == "-" else (float("inf"), 0)
+    ms, _, sequence = entry_id.partition("-")
+    return int(ms), int(sequence) if sequence else default_sequence
+
+
+class Streams:
+    """stands in for AsyncCache , XRANGE over streams kept in memory"""
+
+    def __init__(self, streams):
+        self.streams = streams
+
+    async def xrange(self, key, min_id="-", max_id="+", count=None):
+        low, high = parse_id(min_id, 0), parse_id(max_id, MAX_ENTRY_SEQUENCE)
+        entries = [(entry_id, fields) for entry_id, fields in self.streams.get(key, [])
+                   if low <= parse_id(entry_id, 0) <= high]
+        return entries[:count] if count else entries
+
+    async def hget(self, key, field):
+        return None
+
+
+TICKS = [("1000500-0", {"p": "10"}), ("1000500-1", {"p": "11"}), ("1000500-2", {"p": "12"}),
+         ("1000600-0", {"p": "13"})]
+
+
+@pytest.fixture(autouse=True)
+def streams(monkeypatch):
+    streams = Streams({"TICK_HISTORY:1": TICKS})
+    monkeypatch.setattr(AsyncCache, "get_instance", lambda: streams)
+    return streams
+
+
+def get_pages(limit: int, **kwargs):
+    pages, cursor = [], None
+    while True:
+        response = asyncio.run(HistoryUseCase.get_price_history("1", "tick", limit=limit, cursor=cursor, **kwargs))
+        assert response.success
+        pages.append(response.payload.entries)
+        cursor = response.payload.next_cursor
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 5])
+def test_pages_keep_ticks_of_the_same_ms(limit):
+    pages = get_pages(limit)
+    assert [tick["p"] for page in pages for tick in page] == [10.0, 11.0, 12.0, 13.0]
+    assert all(len(page) <= limit for page in pages)
+
+
+def test_pages_stay_within_end():
+    pages = get_pages(1, start=1000.5, end=1000.5)
+    assert [tick["p"] for page in pages for tick in page] == [10.0, 11.0, 12.0]
+
+
+def test_id_after():
+    assert HistoryUseCase.get_id_after("1000500-1") == "1000500-2"
+    assert HistoryUseCase.get_id_after(f"1000500-{MAX_ENTRY_SEQUENCE}") == "1000501-0"
+
+
+@pytest.mark.parametrize("cursor", ["1000500", "x-0", "1000500-0-1", "-1-0", f"1-{MAX_ENTRY_SEQUENCE + 1}"])
+def test_invalid_cursor(cursor):
+    response = asyncio.run(HistoryUseCase.get_price_history("1", "tick", cursor=cursor))
+    assert not response.success
+    assert response.payload == "Invalid cursor"
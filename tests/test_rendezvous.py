@@ -0,0 +1,40 @@
+from collections import Counter
+
+from utils.utils import get_rendezvous_owner
+
+TOKENS = [str(token) for token in range(10000, 30000)]
+NODE_IDS = ["node-a", "node-b", "node-c", "node-d"]
+
+
+def get_owners(node_ids):
+    return {token: get_rendezvous_owner(token, node_ids) for token in TOKENS}
+
+
+def test_owner_does_not_depend_on_node_order():
+    assert get_owners(NODE_IDS) == get_owners(list(reversed(NODE_IDS)))
+
+
+def test_tokens_are_spread_over_nodes():
+    counts = Counter(get_owners(NODE_IDS).values())
+    assert set(counts) == set(NODE_IDS)
+    assert max(counts.values()) < 1.1 * len(TOKENS) / len(NODE_IDS)
+
+
+def test_node_leaving_moves_only_its_tokens():
+    before = get_owners(NODE_IDS)
+    after = get_owners([node_id for node_id in NODE_IDS if node_id != "node-b"])
+    moved = {token for token in TOKENS if before[token] != after[token]}
+    assert moved == {token for token in TOKENS if before[token] == "node-b"}
+
+
+def test_node_joining_takes_tokens_only_for_itself():
+    before = get_owners(NODE_IDS)
+    after = get_owners(NODE_IDS + ["node-e"])
+    moved = [token for token in TOKENS if before[token] != after[token]]
+    assert moved and all(after[token] == "node-e" for token in moved)
+    # about a fifth of tokens move to the fifth node
+    assert abs(len(moved) - len(TOKENS) / 5) < 0.1 * len(TOKENS) / 5
+
+
+def test_single_node_owns_everything():
+    assert set(get_owners(["node-a"]).values()) == {"node-a"}
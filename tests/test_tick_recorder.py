@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from data_adapter import tick_recorder
+from data_adapter.async_redis import AsyncCache
+from data_adapter.tick_recorder import TickRecorder
+
+
+class RecordingCache:
+    """stands in for AsyncCache , keeps what a flush would write"""
+
+    def __init__(self):
+        self.flushes = []
+
+    async def xadd_multiple(self, stream_entries, key_mappings, key_fields_to_delete):
+        self.flushes.append((stream_entries, key_mappings, key_fields_to_delete))
+        return len(stream_entries)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RecordingCache()
+    monkeypatch.setattr(AsyncCache, "get_instance", lambda: cache)
+    return cache
+
+
+def flush_at(recorder: TickRecorder, now: float, monkeypatch) -> None:
+    monkeypatch.setattr(tick_recorder.time, "time", lambda: now)
+    asyncio.run(recorder.flush())
+
+
+def get_bars(stream_entries, resolution: str):
+    return {entry_id: fields for key, entry_id, fields, _ in stream_entries if key == f"OHLC_BARS:{resolution}:1"}
+
+
+def test_tick_of_later_bucket_closes_bar(cache, monkeypatch):
+    recorder = TickRecorder._cls()
+    for received_at, price in ((1000.2, 10), (1000.7, 12), (1000.9, 9), (1001.1, 11)):
+        recorder.add_tick("1", price, received_at=received_at)
+    flush_at(recorder, 1001.5, monkeypatch)
+    stream_entries, key_mappings, key_fields_to_delete = cache.flushes[-1]
+    assert get_bars(stream_entries, "1s") == {"1000000-0": {"o": 10.0, "h": 12.0, "l": 9.0, "c": 9.0, "n": 3}}
+    assert get_bars(stream_entries, "1m") == {}
+    assert key_mappings["OPEN_OHLC_BARS:1s"] == {"1": "1001,11.0,11.0,11.0,11.0,1"}
+    assert key_mappings["OPEN_OHLC_BARS:1m"] == {"1": "960,10.0,12.0,9.0,11.0,4"}
+    assert key_fields_to_delete == {}
+    assert len([entry for entry in stream_entries if entry[0] == "TICK_HISTORY:1"]) == 4
+
+
+def test_bar_is_closed_once_its_bucket_passed_without_ticks(cache, monkeypatch):
+    recorder = TickRecorder._cls()
+    recorder.add_tick("1", 10, received_at=1001.1)
+    flush_at(recorder, 1001.5, monkeypatch)
+    flush_at(recorder, 1003.0, monkeypatch)
+    stream_entries, key_mappings, key_fields_to_delete = cache.flushes[-1]
+    assert get_bars(stream_entries, "1s") == {"1001000-0": {"o": 10.0, "h": 10.0, "l": 10.0, "c": 10.0, "n": 1}}
+    assert key_fields_to_delete == {"OPEN_OHLC_BARS:1s": ["1"]}
+    # minute bucket has not passed yet
+    assert get_bars(stream_entries, "1m") == {}
+    assert recorder.get_stats()["open_bars"] == {"1s": 0, "1m": 1}
+    flush_at(recorder, 1021.0, monkeypatch)
+    stream_entries, _, key_fields_to_delete = cache.flushes[-1]
+    assert get_bars(stream_entries, "1m") == {"960000-0": {"o": 10.0, "h": 10.0, "l": 10.0, "c": 10.0, "n": 1}}
+    assert key_fields_to_delete == {"OPEN_OHLC_BARS:1m": ["1"]}
+
+
+def test_late_tick_updates_open_bar(cache, monkeypatch):
+    recorder = TickRecorder._cls()
+    recorder.add_tick("1", 10, received_at=1001.5)
+    # tick received out of order still belongs to the open bar , bars never move back in time
+    recorder.add_tick("1", 8, received_at=1000.9)
+    flush_at(recorder, 1001.6, monkeypatch)
+    _, key_mappings, _ = cache.flushes[-1]
+    assert key_mappings["OPEN_OHLC_BARS:1s"] == {"1": "1001,10.0,10.0,8.0,8.0,2"}
+
+
+def test_ticks_of_same_ms_get_increasing_ids(cache, monkeypatch):
+    recorder = TickRecorder._cls()
+    for price in (10, 11, 12):
+        recorder.add_tick("1", price, received_at=1000.5)
+    flush_at(recorder, 1000.6, monkeypatch)
+    stream_entries, _, _ = cache.flushes[-1]
+    assert [entry_id for key, entry_id, _, _ in stream_entries if key == "TICK_HISTORY:1"] == \
+        ["1000500-0", "1000500-1", "1000500-2"]
+
+
+def test_ticks_without_price_are_ignored(cache, monkeypatch):
+    recorder = TickRecorder._cls()
+    recorder.add_tick("1", None, received_at=1000.5)
+    recorder.add_tick(None, 10, received_at=1000.5)
+    flush_at(recorder, 1000.6, monkeypatch)
+    assert cache.flushes == []
@@ -0,0 +1,47 @@
+import orjson
+import pytest
+from pydantic import ValidationError
+
+from models.sensi_models import BrokerWSIncomingMessage, BrokerWSDataTypes
+
+
+def test_quote_is_decoded_without_the_model():
+    message = orjson.loads(b'{"data_type": "quote", "payload": {"token": "12345", "price": 101.25}}')
+    assert BrokerWSIncomingMessage.get_quote(message) == ("12345", 101.25)
+
+
+def test_quote_keeps_token_as_sent():
+    assert BrokerWSIncomingMessage.get_quote({"data_type": "quote", "payload": {"token": 12345, "price": 1}}) == \
+        (12345, 1)
+
+
+def test_quote_matches_payload_parsed_with_the_model():
+    message = {"data_type": "quote", "payload": {"token": "12345", "price": 101.25}}
+    parsed = BrokerWSIncomingMessage.parse_obj(message)
+    assert parsed.data_type == BrokerWSDataTypes.QUOTE
+    assert BrokerWSIncomingMessage.get_quote(message) == (parsed.payload["token"], parsed.payload["price"])
+
+
+def test_quote_with_missing_fields():
+    assert BrokerWSIncomingMessage.get_quote({"data_type": "quote", "payload": {}}) == (None, None)
+
+
+@pytest.mark.parametrize("message", [
+    {"data_type": "ping"},
+    {"data_type": "error", "payload": "bad token"},
+    {"data_type": "quote", "payload": None},
+    {"data_type": "quote", "payload": ["12345", 101.25]},
+    {"payload": {"token": "12345", "price": 101.25}},
+    ["quote"],
+    "quote",
+    None,
+])
+def test_messages_that_are_not_quotes_are_left_to_the_model(message):
+    assert BrokerWSIncomingMessage.get_quote(message) is None
+
+
+def test_unknown_message_is_rejected_by_the_model():
+    message = {"data_type": "trade", "payload": {}}
+    assert BrokerWSIncomingMessage.get_quote(message) is None
+    with pytest.raises(ValidationError):
+        BrokerWSIncomingMessage.parse_obj(message)
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from config.settings import OptionAnalyticsConfig
+from data_adapter.instrument_catalog import CatalogEntry
+from utils.option_greeks import implied_volatility, greeks
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+GREEK_FIELDS = ("iv", "delta", "gamma", "theta", "vega")
+
+
+class AnalyticsUseCase:
+    """implied volatility and greeks of option chains
+    a chain is solved at once over numpy arrays built from strike , expiry and instrument type of catalog entry and
+    live prices. Time to expiry is measured from the start of the current OPTION_ANALYTICS_TIME_BUCKET_SEC bucket ,
+    so greeks of a snapshot (etag of prices and time bucket) are fixed and theta still moves with time. Results are
+    encoded once per snapshot and kept for OPTION_ANALYTICS_CACHE_SIZE snapshots , so clients polling an unchanged
+    snapshot do not solve it again. Solving runs in a worker thread , off the event loop serving requests"""
+    # encoded greeks of every instrument of entry keyed by price snapshot , least recently used snapshot is evicted
+    greeks_by_snapshot: "OrderedDict[str, List[bytes]]" = OrderedDict()
+
+    @staticmethod
+    def get_valuation_time() -> float:
+        """start of current time bucket , greeks are valued at it"""
+        bucket_sec = max(OptionAnalyticsConfig.time_bucket_sec, 1)
+        return time.time() // bucket_sec * bucket_sec
+
+    @staticmethod
+    async def get_encoded_greeks(entry: CatalogEntry, prices: List[Optional[float]], underlying_price: Optional[float],
+                                 valued_at: float, snapshot_key: str) -> List[bytes]:
+        """json members ,"iv":..,"delta":.. of every instrument of entry to be spliced before its closing brace ,
+        from cache of snapshots or solved in a worker thread"""
+        encoded_greeks = AnalyticsUseCase.greeks_by_snapshot.get(snapshot_key)
+        if encoded_greeks is not None:
+            AnalyticsUseCase.greeks_by_snapshot.move_to_end(snapshot_key)
+            return encoded_greeks
+        encoded_greeks = await asyncio.to_thread(AnalyticsUseCase.build_encoded_greeks, entry, prices,
+                                                 underlying_price=underlying_price, valued_at=valued_at)
+        AnalyticsUseCase.greeks_by_snapshot[snapshot_key] = encoded_greeks
+        if len(AnalyticsUseCase.greeks_by_snapshot) > OptionAnalyticsConfig.cache_size:
+            AnalyticsUseCase.greeks_by_snapshot.popitem(last=False)
+        return encoded_greeks
+
+    @staticmethod
+    def build_encoded_greeks(entry: CatalogEntry, prices: List[Optional[float]], underlying_price: Optional[float],
+                             valued_at: float) -> List[bytes]:
+        """solves json members of greeks of every instrument of entry , valued at epoch seconds valued_at
+        members are null for futures , instruments without price and prices that can not be solved"""
+        strike, expires_at, is_call, is_option = AnalyticsUseCase.get_option_inputs(entry)
+        rate = OptionAnalyticsConfig.risk_free_rate_bps / 10000
+        years = np.maximum(expires_at - valued_at, 0) / SECONDS_PER_YEAR
+        option_price = np.array([np.nan if price is None else price for price in prices], dtype=float)
+        spot = np.full(len(prices), np.nan if underlying_price is None else underlying_price)
+        volatility = np.where(is_option, implied_volatility(option_price, spot, strike, years, is_call, rate), np.nan)
+        columns = {"iv": volatility, **greeks(spot, strike, years, volatility, is_call, rate)}
+        values = zip(*[[None if value != value else value for value in np.round(columns[field], 6).tolist()] for
+                       field in GREEK_FIELDS])
+        return [b',' + orjson.dumps(dict(zip(GREEK_FIELDS, instrument_values)))[1:-1] for instrument_values in values]
+
+    @staticmethod
+    def get_option_inputs(entry: CatalogEntry) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """strike , expiry time (epoch seconds) , is call and is option arrays of entry , built once per entry"""
+        if entry.option_inputs is None:
+            expiry_time = datetime.strptime(OptionAnalyticsConfig.expiry_time, "%H:%M").time()
+            expires_at = []
+            for instrument in entry.instruments:
+                expiry = instrument.expiry
+                if isinstance(expiry, str):
+                    expiry = date.fromisoformat(expiry)
+                expires_at.append(datetime.combine(expiry, expiry_time).timestamp() if expiry else np.nan)
+            instrument_types = [instrument.instrument_type for instrument in entry.instruments]
+            entry.option_inputs = (
+                np.array([np.nan if instrument.strike is None else instrument.strike for instrument in
+                          entry.instruments], dtype=float),
+                np.array(expires_at, dtype=float),
+                np.array([instrument_type == "CE" for instrument_type in instrument_types], dtype=bool),
+                np.array([instrument_type in ("CE", "PE") for instrument_type in instrument_types], dtype=bool))
+        return entry.option_inputs
+
+    @staticmethod
+    def get_stats() -> dict:
+        return {"cached_snapshots": len(AnalyticsUseCase.greeks_by_snapshot)}
@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Dict
+
+import httpx
+
+from config.constants import RedisKeys
+from config.settings import DerivativeSyncConfig
+from controller.context_manager import context_log_meta, context_db_session
+from data_adapter.db import SessionLocal
+from data_adapter.redis import Cache
+from data_adapter.sensi_data import SensiDerivative
+from data_adapter.token_registry import TokenRegistry
+from integrations.broker_integration import BrokerIntegration
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import SensiBrokerResModel, UnderlyingCacheModel, InstrumentSyncReportModel, \
+    DerivativeSyncReportModel
+from usecases.sensi_usecase import SensiUseCase
+from utils.utils import HostRateLimiter, build_payload_hash
+
+
+class DerivativeSyncUseCase:
+    """sync of derivatives of all underlyings from broker
+    derivatives of multiple underlyings are fetched at a time over a keep-alive connection pool , bounded by
+    DERIVATIVE_SYNC_CONCURRENCY and a per host rate limit. Underlyings whose broker payload hash matches the hash of
+    last synced payload are skipped , derivatives of others are diffed field by field against db and the resulting
+    inserts , updates and soft deletes are written on a single writer thread while fetches of other underlyings are
+    still in flight. Every underlying is committed on its own so that cache is updated only with committed changes.
+    an instance is meant for a single sync run"""
+
+    def __init__(self):
+        self.__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="derivative_sync_writer")
+        self.__writer_db = SessionLocal()
+        # writer runs in a copy of caller's context (log meta) with its own db session , as scoped session of the
+        # caller thread must not be used from writer thread
+        self.__writer_context = contextvars.copy_context()
+        self.__writer_context.run(context_db_session.set, self.__writer_db)
+
+    def sync_derivatives_data(self) -> GenericResponseModel:
+        """
+        Sync derivative data for all underlyings
+        :return GenericResponseModel: payload is DerivativeSyncReportModel
+        """
+        try:
+            return asyncio.run(self.__sync_all_underlyings())
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in sync_derivatives_data error : {e}")
+            return GenericResponseModel(success=False)
+        finally:
+            self.__writer.shutdown(wait=True)
+            self.__writer_db.close()
+
+    async def __sync_all_underlyings(self) -> GenericResponseModel:
+        start = time.perf_counter()
+        underlyings_from_system: List[UnderlyingCacheModel] = SensiUseCase.get_underlyings_token_id_from_cache()
+        if not underlyings_from_system:
+            logger.error(extra=context_log_meta.get(), msg=f"no underlyings found in db")
+            return GenericResponseModel(success=False)
+        # hashes of last synced payloads of all underlyings in a single redis round trip
+        synced_payload_hashes: List[Optional[str]] = Cache.get_instance().hmget(
+            RedisKeys.DERIVATIVES_PAYLOAD_HASH, [underlying.token for underlying in underlyings_from_system]) or \
+            [None] * len(underlyings_from_system)
+        semaphore = asyncio.Semaphore(DerivativeSyncConfig.concurrency)
+        rate_limiter = HostRateLimiter(DerivativeSyncConfig.rate_limit_per_host)
+        limits = httpx.Limits(max_connections=DerivativeSyncConfig.concurrency,
+                              max_keepalive_connections=DerivativeSyncConfig.concurrency)
+        async with httpx.AsyncClient(timeout=DerivativeSyncConfig.request_timeout_sec, limits=limits) as client:
+            results: List[Tuple[InstrumentSyncReportModel, List[str]]] = await asyncio.gather(
+                *[self.__sync_underlying(client, semaphore, rate_limiter, underlying, synced_payload_hash)
+                  for underlying, synced_payload_hash in zip(underlyings_from_system, synced_payload_hashes)])
+        underlying_reports: List[InstrumentSyncReportModel] = [underlying_report for underlying_report, _ in results]
+        report = DerivativeSyncReportModel(
+            underlyings=len(results), underlying_reports=underlying_reports,
+            failed=sum(1 for underlying_report in underlying_reports if not underlying_report.success),
+            skipped=sum(1 for underlying_report in underlying_reports if underlying_report.skipped),
+            skipped_derivatives=sum(underlying_report.fetched for underlying_report in underlying_reports if
+                                    underlying_report.skipped),
+            added=sum(underlying_report.added for underlying_report in underlying_reports),
+            updated=sum(underlying_report.updated for underlying_report in underlying_reports),
+            deleted=sum(underlying_report.deleted for underlying_report in underlying_reports))
+        if report.added or report.updated or report.deleted:
+            SensiUseCase.publish_catalog_version()
+        # add newly added derivatives to set of tokens to subscribe from ws
+        derivative_tokens_to_subscribe_from_ws: List[str] = [token for _, tokens in results for token in tokens]
+        if derivative_tokens_to_subscribe_from_ws:
+            SensiUseCase.publish_synced_entity_data(derivative_tokens_to_subscribe_from_ws)
+        report.total_ms = round((time.perf_counter() - start) * 1000, 3)
+        logger.info(extra=context_log_meta.get(),
+                    msg=f"sync_derivatives_data: synced {report.underlyings} underlyings in {report.total_ms} ms "
+                        f"failed : {report.failed} skipped : {report.skipped} added : {report.added} updated : "
+                        f"{report.updated} deleted : {report.deleted} report : {report.json()}")
+        return GenericResponseModel(success=not report.failed, payload=report)
+
+    async def __sync_underlying(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                                rate_limiter: HostRateLimiter, underlying: UnderlyingCacheModel,
+                                synced_payload_hash: Optional[str]) -> Tuple[InstrumentSyncReportModel, List[str]]:
+        """fetch derivatives of underlying and hand them over to writer thread if payload changed since last sync
+        :return report of underlying and tokens of derivatives to subscribe from ws"""
+        report = InstrumentSyncReportModel(key=underlying.token)
+        # semaphore bounds only broker calls , so a fetch slot is free again while derivatives are being written
+        async with semaphore:
+            start = time.perf_counter()
+            payload: Optional[List[dict]] = \
+                await BrokerIntegration.fetch_derivatives_payload_by_underlying_token_async(
+                    client, rate_limiter, underlying_token=underlying.token)
+            report.fetch_ms = round((time.perf_counter() - start) * 1000, 3)
+        if payload is None:
+            report.success = False
+            return report, []
+        report.fetched = len(payload)
+        payload_hash = build_payload_hash(payload)
+        if payload_hash == synced_payload_hash:
+            report.skipped = True
+            return report, []
+        tokens_to_subscribe: Optional[List[str]] = await asyncio.get_running_loop().run_in_executor(
+            self.__writer, self.__writer_context.run, self.__write_derivatives, underlying, payload, payload_hash,
+            report)
+        if tokens_to_subscribe is None:
+            report.success = False
+            return report, []
+        return report, tokens_to_subscribe
+
+    def __write_derivatives(self, underlying: UnderlyingCacheModel, payload: List[dict], payload_hash: str,
+                            report: InstrumentSyncReportModel) -> Optional[List[str]]:
+        """runs on writer thread , applies diff of payload against db and commits it
+        :return tokens of derivatives to subscribe from ws , None if write failed"""
+        start = time.perf_counter()
+        try:
+            rows_from_broker: List[dict] = [SensiBrokerResModel(**derivative).build_db_row(
+                underlying_id=underlying.id) for derivative in payload]
+            rows_in_db: Dict[str, dict] = SensiDerivative.get_rows_by_token(
+                columns=list(rows_from_broker[0]) if rows_from_broker else [], underlying_id=underlying.id)
+            rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+                rows_from_broker, rows_in_db)
+            upserted_derivatives = SensiDerivative.bulk_upsert(rows_to_insert + rows_to_update)
+            SensiDerivative.soft_delete_by_tokens(tokens_to_delete)
+            self.__writer_db.commit()
+        except Exception as e:
+            self.__writer_db.rollback()
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"exception in writing derivatives of underlying : {underlying.token} error : {e}")
+            report.write_ms = round((time.perf_counter() - start) * 1000, 3)
+            return None
+        # update cached derivatives with committed changes
+        if upserted_derivatives:
+            # ids are assigned before tokens are handed over to nodes and catalog version is bumped
+            TokenRegistry.get_instance().assign_ids([token for _, token in upserted_derivatives])
+            SensiUseCase.add_derivatives_in_cache(underlying_token=underlying.token,
+                                                  derivatives=[token for _, token in upserted_derivatives])
+        if tokens_to_delete:
+            SensiUseCase.remove_derivatives_from_cache(underlying_token=underlying.token, derivatives=tokens_to_delete)
+            SensiUseCase.release_deleted_tokens(tokens_to_delete)
+        Cache.get_instance().hset(RedisKeys.DERIVATIVES_PAYLOAD_HASH, {underlying.token: payload_hash})
+        report.added, report.updated, report.deleted = len(rows_to_insert), len(rows_to_update), len(tokens_to_delete)
+        report.write_ms = round((time.perf_counter() - start) * 1000, 3)
+        return SensiUseCase.get_tokens_to_subscribe(rows_to_insert, rows_to_update, rows_in_db)
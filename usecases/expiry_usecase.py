@@ -0,0 +1,112 @@
+from datetime import date
+from typing import List, Dict, Set, Tuple
+
+from config.constants import RedisKeys
+from config.settings import ExpiryPurgeConfig
+from controller.context_manager import context_log_meta, get_db_session
+from data_adapter.redis import Cache
+from data_adapter.sensi_data import SensiDerivative, SensiUnderlying
+from data_adapter.token_registry import TokenRegistry
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import ExpiryPurgeReportModel
+from usecases.sensi_usecase import SensiUseCase
+from usecases.shard_usecase import ShardUseCase
+
+
+class ExpiryUseCase:
+    """lifecycle of expired derivatives
+    derivatives whose expiry has passed are marked deleted in db , handed over to the node holding their broker ws
+    subscription to be unsubscribed and dropped from every redis structure , and their token ids are released for
+    reuse , so that subscriptions , redis , token registry and price table do not keep growing with contracts that can
+    no longer trade. Purge is also the backstop for instruments deleted earlier and not released , every deleted
+    token still subscribed , unassigned , priced or holding a token id is released too"""
+
+    @staticmethod
+    def purge_expired_derivatives() -> GenericResponseModel:
+        """
+        Purge derivatives expired before today
+        :return GenericResponseModel: payload is ExpiryPurgeReportModel
+        """
+        try:
+            report = ExpiryPurgeReportModel()
+            expired_derivatives = SensiDerivative.get_expired_derivatives(expired_before=date.today())
+            expired_tokens: List[str] = [token for token, _ in expired_derivatives]
+            node_ids: List[str] = Cache.get_instance().hkeys(RedisKeys.NODE_IDS_IN_CLUSTER)
+            node_mapping_keys: List[str] = [RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(node_id) for node_id in node_ids]
+            # rows deleted earlier (by a diff sync , or by a purge that failed after its db commit) whose tokens are
+            # still subscribed , waiting for a node , priced or holding an id are released along with newly expired ones
+            deleted_derivatives, deleted_underlyings = ExpiryUseCase.get_unreleased_deleted_tokens(
+                node_mapping_keys, excluded_tokens=set(expired_tokens))
+            if not expired_derivatives and not deleted_derivatives and not deleted_underlyings:
+                logger.info(extra=context_log_meta.get(), msg=f"purge_expired_derivatives: no expired derivatives")
+                return GenericResponseModel(success=True, payload=report)
+            tokens_by_underlying: Dict[str, List[str]] = {}
+            for token, underlying_token in expired_derivatives + deleted_derivatives:
+                tokens_by_underlying.setdefault(underlying_token, []).append(token)
+            tokens_to_release: List[str] = expired_tokens + [token for token, _ in deleted_derivatives] + \
+                deleted_underlyings
+            keys_to_purge: List[str] = [RedisKeys.ENTITY_PRICE_DATA, RedisKeys.ENTITY_PRICE_UPDATED_AT,
+                                        RedisKeys.STALE_ENTITY_TOKENS, RedisKeys.UNASSIGNED_ENTITY_TOKENS,
+                                        RedisKeys.TOKEN_IDS, RedisKeys.TOKENS_BY_ID] + \
+                node_mapping_keys + [RedisKeys.DERIVATIVES_DATA.format(underlying_token) for underlying_token in
+                                     tokens_by_underlying]
+            report.expired = len(expired_tokens)
+            report.deleted_released = len(tokens_to_release) - len(expired_tokens)
+            report.redis_bytes_before = ExpiryUseCase.get_memory_usage(keys_to_purge)
+            report.subscriptions_before = sum(Cache.get_instance().scard(key) for key in node_mapping_keys)
+
+            # rows are deleted first so that a sync running meanwhile does not add tokens back to cache
+            for batch in ExpiryUseCase.build_batches(expired_tokens):
+                SensiDerivative.soft_delete_by_tokens(batch)
+            get_db_session().commit()
+
+            for underlying_token, tokens in tokens_by_underlying.items():
+                for batch in ExpiryUseCase.build_batches(tokens):
+                    SensiUseCase.remove_derivatives_from_cache(underlying_token=underlying_token, derivatives=batch)
+            for batch in ExpiryUseCase.build_batches(tokens_to_release):
+                # node holding the ws subscription unsubscribes tokens handed over in its handoff stream
+                for node_id, unsubscribed in ShardUseCase.unassign_tokens(batch).items():
+                    report.unsubscribed_by_node[node_id] = report.unsubscribed_by_node.get(node_id, 0) + unsubscribed
+                # prices , tick history and ohlc bars of contracts that can no longer trade
+                report.price_entries_removed += SensiUseCase.remove_prices_from_cache(batch)
+                # ids last , processes still holding prices by id drop them once they see the release
+                report.token_ids_released += TokenRegistry.get_instance().release_ids(batch)
+            SensiUseCase.publish_catalog_version()
+
+            report.subscriptions_after = sum(Cache.get_instance().scard(key) for key in node_mapping_keys)
+            report.redis_bytes_after = ExpiryUseCase.get_memory_usage(keys_to_purge)
+            report.reclaimed_bytes = report.redis_bytes_before - report.redis_bytes_after
+            logger.info(extra=context_log_meta.get(), msg=f"purge_expired_derivatives: report : {report.json()}")
+            return GenericResponseModel(success=True, payload=report)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in purge_expired_derivatives error : {e}")
+            return GenericResponseModel(success=False)
+
+    @staticmethod
+    def get_unreleased_deleted_tokens(node_mapping_keys: List[str], excluded_tokens: Set[str]) \
+            -> Tuple[List[Tuple[str, str]], List[str]]:
+        """tokens owned by a node , waiting for a live node , priced in redis or holding a token id whose rows are
+        deleted in db
+        :return token and underlying token of such derivatives , tokens of such underlyings"""
+        tokens: Set[str] = set(Cache.get_instance().hkeys(RedisKeys.ENTITY_PRICE_DATA))
+        tokens |= set(Cache.get_instance().hkeys(RedisKeys.TOKEN_IDS))
+        tokens |= Cache.get_instance().smembers(RedisKeys.UNASSIGNED_ENTITY_TOKENS)
+        for node_mapping_key in node_mapping_keys:
+            tokens |= Cache.get_instance().smembers(node_mapping_key)
+        deleted_derivatives: List[Tuple[str, str]] = []
+        deleted_underlyings: List[str] = []
+        for batch in ExpiryUseCase.build_batches(list(tokens - excluded_tokens)):
+            deleted_derivatives.extend(SensiDerivative.get_deleted_derivatives(batch))
+            deleted_underlyings.extend(SensiUnderlying.get_deleted_tokens(batch))
+        return deleted_derivatives, deleted_underlyings
+
+    @staticmethod
+    def build_batches(tokens: List[str]) -> List[List[str]]:
+        return [tokens[start:start + ExpiryPurgeConfig.purge_batch_size] for start in
+                range(0, len(tokens), ExpiryPurgeConfig.purge_batch_size)]
+
+    @staticmethod
+    def get_memory_usage(keys: List[str]) -> int:
+        """approximate bytes used by keys in redis"""
+        return sum(Cache.get_instance().memory_usage(key) for key in keys)
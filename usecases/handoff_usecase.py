@@ -0,0 +1,131 @@
+import asyncio
+import time
+import uuid
+from typing import Dict, List, Tuple, Set
+
+from config.constants import RedisKeys
+from config.settings import AppConfig, HandoffConfig
+from controller.context_manager import context_log_meta
+from data_adapter.async_redis import AsyncCache
+from data_adapter.price_table import PriceTable
+from logger import logger
+from models.sensi_models import BrokerWSCommands, HandoffEntryModel, HandoffReportModel
+from usecases.sensi_usecase import SensiUseCase
+from utils.utils import LatencyStats
+
+
+class HandoffUseCase:
+    """tokens handed over to this node by worker (newly synced , moved from other node , expired) , read from handoff
+    stream NODE_HANDOFF:{node_id} through consumer group NODE_HANDOFF_GROUP instead of a set raced for by a
+    pubsub notice. Every process of the node is a consumer of its own , it claims up to HANDOFF_CLAIM_COUNT entries a
+    read and acks (and deletes) them only once they are sent to broker ws , so entries of a process that died before
+    sending them stay pending and are claimed again after HANDOFF_RECLAIM_IDLE_MS by the next process of the node.
+    Entries appended while node was not reading wait in the stream , nothing depends on node listening at the time."""
+    # consumer name of this process , node id and a suffix that changes with every start
+    consumer = f"{AppConfig.node_id}:{uuid.uuid4().hex[:8]}"
+    handoff_latency = LatencyStats()
+    counters: Dict[str, int] = {"entries": 0, "subscribed": 0, "unsubscribed": 0, "reclaimed": 0,
+                                "consumers_deleted": 0}
+
+    @staticmethod
+    async def run():
+        """read handoff stream of the node till cancelled , should run as a background task next to broker ws
+        listener"""
+        stream_key = RedisKeys.NODE_HANDOFF.format(AppConfig.node_id)
+        group_created = False
+        reclaimed_at = 0.0
+        while True:
+            try:
+                if not group_created:
+                    # group reads from first entry , entries appended before it was created are not skipped
+                    group_created = await AsyncCache.get_instance().xgroup_create(stream_key,
+                                                                                  RedisKeys.NODE_HANDOFF_GROUP)
+                    if not group_created:
+                        await asyncio.sleep(1)
+                        continue
+                if time.monotonic() - reclaimed_at >= HandoffConfig.reclaim_idle_ms / 1000:
+                    reclaimed_at = time.monotonic()
+                    await HandoffUseCase.reclaim()
+                entries = await AsyncCache.get_instance().xreadgroup(
+                    stream_key, RedisKeys.NODE_HANDOFF_GROUP, HandoffUseCase.consumer,
+                    count=HandoffConfig.claim_count, block_ms=HandoffConfig.block_ms)
+                if entries is None:
+                    # group is gone along with the stream , eg node was declared dead and its stream deleted
+                    group_created = False
+                    await asyncio.sleep(1)
+                    continue
+                if entries:
+                    await HandoffUseCase.handle_entries(entries)
+            except Exception as e:
+                logger.error(extra=context_log_meta.get(), msg=f"handoff: exception in run : {e}")
+                await asyncio.sleep(1)
+
+    @staticmethod
+    async def reclaim() -> int:
+        """claim entries delivered to a consumer of the node (a process that died or failed to send them) and not
+        acked for HANDOFF_RECLAIM_IDLE_MS , and drop consumers of dead processes
+        :return number of entries reclaimed"""
+        stream_key = RedisKeys.NODE_HANDOFF.format(AppConfig.node_id)
+        reclaimed = 0
+        while True:
+            entries = await AsyncCache.get_instance().xclaim_idle(
+                stream_key, RedisKeys.NODE_HANDOFF_GROUP, HandoffUseCase.consumer,
+                min_idle_ms=HandoffConfig.reclaim_idle_ms, count=HandoffConfig.claim_count)
+            if not entries:
+                break
+            # claiming resets idle time of entries , entries failing again are not claimed again in this pass
+            await HandoffUseCase.handle_entries(entries, reclaimed=True)
+            reclaimed += len(entries)
+        HandoffUseCase.counters["consumers_deleted"] += await AsyncCache.get_instance().xgroup_delete_idle_consumers(
+            stream_key, RedisKeys.NODE_HANDOFF_GROUP, min_idle_ms=HandoffConfig.reclaim_idle_ms,
+            keep_consumer=HandoffUseCase.consumer)
+        return reclaimed
+
+    @staticmethod
+    async def handle_entries(entries: List[Tuple[str, dict]], reclaimed: bool = False) -> HandoffReportModel:
+        """send tokens of entries to broker ws and ack entries , runs of entries of the same command are sent
+        together , order of commands is kept
+        :param reclaimed: entries were delivered earlier to another consumer , newer entries may have been handled
+            since , so only tokens still owned are subscribed and only tokens no longer owned are unsubscribed"""
+        report = HandoffReportModel(entries=len(entries), reclaimed=len(entries) if reclaimed else 0)
+        parsed_entries: List[HandoffEntryModel] = [HandoffEntryModel.parse_entry(fields) for _, fields in entries]
+        owned_tokens: Set[str] = set(await SensiUseCase.get_owned_tokens()) if reclaimed else set()
+        runs: List[Tuple[BrokerWSCommands, List[str]]] = []
+        for entry in parsed_entries:
+            tokens = entry.tokens
+            if reclaimed:
+                tokens = [token for token in tokens if (token in owned_tokens) == (
+                    entry.command == BrokerWSCommands.SUBSCRIBE)]
+            if runs and runs[-1][0] == entry.command:
+                runs[-1][1].extend(tokens)
+            else:
+                runs.append((entry.command, list(tokens)))
+        for command, tokens in runs:
+            if not tokens:
+                continue
+            await SensiUseCase.send_ws_command(command, tokens)
+            if command == BrokerWSCommands.UNSUBSCRIBE:
+                PriceTable.get_instance().remove(tokens)
+                report.unsubscribed += len(tokens)
+            else:
+                report.subscribed += len(tokens)
+        await AsyncCache.get_instance().xack_and_delete(RedisKeys.NODE_HANDOFF.format(AppConfig.node_id),
+                                                        RedisKeys.NODE_HANDOFF_GROUP,
+                                                        [entry_id for entry_id, _ in entries])
+        handled_at = time.time()
+        for entry in parsed_entries:
+            if entry.published_at:
+                HandoffUseCase.handoff_latency.record((handled_at - entry.published_at) * 1000)
+        for counter, value in report.dict().items():
+            HandoffUseCase.counters[counter] += value
+        logger.info(extra=context_log_meta.get(), msg=f"handoff: handled entries : {report.json()}")
+        return report
+
+    @staticmethod
+    def get_stats() -> dict:
+        """counters of handoff stream of this process"""
+        return {
+            "consumer": HandoffUseCase.consumer,
+            **HandoffUseCase.counters,
+            "handoff_latency": HandoffUseCase.handoff_latency.get_stats(),
+        }
@@ -0,0 +1,102 @@
+from typing import List, Optional
+
+from config.constants import RedisKeys, HistoryResolutions
+from config.settings import TickHistoryConfig
+from controller.context_manager import context_log_meta
+from data_adapter.async_redis import AsyncCache
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import PriceHistoryModel
+
+MAX_ENTRY_SEQUENCE = 2 ** 64 - 1
+
+
+class HistoryUseCase:
+    """range queries over tick history and ohlc bars recorded by TickRecorder"""
+
+    @staticmethod
+    async def get_price_history(token: str, resolution: str, start: Optional[float] = None,
+                                end: Optional[float] = None, limit: Optional[int] = None,
+                                cursor: Optional[str] = None) -> GenericResponseModel:
+        """
+        Get ticks or ohlc bars of token between start and end (epoch seconds , both inclusive) , oldest first
+        :param resolution: tick , or one of bar resolutions of HistoryResolutions
+        :param limit: max entries , capped at TICK_HISTORY_MAX_QUERY_ENTRIES
+        :param cursor: next_cursor of previous page , entries after it are returned in place of entries from start
+        :return GenericResponseModel: payload is PriceHistoryModel
+        """
+        if resolution != HistoryResolutions.TICK and resolution not in HistoryResolutions.BAR_SECONDS:
+            return GenericResponseModel(success=False, payload="Invalid resolution")
+        if cursor is not None:
+            try:
+                min_id = HistoryUseCase.get_id_after(cursor)
+            except ValueError:
+                return GenericResponseModel(success=False, payload="Invalid cursor")
+        else:
+            # entry ids are times in ms with a sequence number , bounds cover every entry of their ms
+            min_id = f"{int(start * 1000)}-0" if start is not None else "-"
+        try:
+            count = min(limit or TickHistoryConfig.max_query_entries, TickHistoryConfig.max_query_entries)
+            max_id = f"{int(end * 1000)}-{MAX_ENTRY_SEQUENCE}" if end is not None else "+"
+            history = PriceHistoryModel(token=token, resolution=resolution)
+            if resolution == HistoryResolutions.TICK:
+                entries = await AsyncCache.get_instance().xrange(RedisKeys.TICK_HISTORY.format(token), min_id=min_id,
+                                                                 max_id=max_id, count=count)
+                history.entries = [{"t": HistoryUseCase.get_entry_time(entry_id), "p": float(fields["p"])} for
+                                   entry_id, fields in entries]
+            else:
+                entries = await AsyncCache.get_instance().xrange(RedisKeys.OHLC_BARS.format(resolution, token),
+                                                                 min_id=min_id, max_id=max_id, count=count)
+                history.entries = [HistoryUseCase.build_bar(HistoryUseCase.get_entry_time(entry_id), fields["o"],
+                                                            fields["h"], fields["l"], fields["c"], fields["n"]) for
+                                   entry_id, fields in entries]
+                if len(entries) < count:
+                    open_bar = await HistoryUseCase.get_open_bar(token=token, resolution=resolution)
+                    if open_bar and (start is None or open_bar["t"] >= start) and (
+                            end is None or open_bar["t"] <= end) and (
+                            not history.entries or open_bar["t"] > history.entries[-1]["t"]):
+                        history.entries.append(open_bar)
+            if len(entries) == count:
+                # ticks of the same ms only differ in sequence number , so next page resumes after the last entry id
+                # and not after its time
+                history.next_cursor = entries[-1][0]
+            return GenericResponseModel(success=True, payload=history)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in get_price_history error : {e}")
+            return GenericResponseModel(success=False)
+
+    @staticmethod
+    async def get_open_bar(token: str, resolution: str) -> Optional[dict]:
+        """bar of token still open at its recording node , None if token has not ticked recently"""
+        open_bar: Optional[str] = await AsyncCache.get_instance().hget(
+            RedisKeys.OPEN_OHLC_BARS.format(resolution), token)
+        if not open_bar:
+            return None
+        bucket_start, open_price, high, low, close, ticks = open_bar.split(",")
+        return HistoryUseCase.build_bar(float(bucket_start), open_price, high, low, close, ticks)
+
+    @staticmethod
+    def get_entry_time(entry_id: str) -> float:
+        return int(entry_id.split("-")[0]) / 1000
+
+    @staticmethod
+    def get_id_after(entry_id: str) -> str:
+        """smallest stream entry id after entry_id , inclusive XRANGE bound that works before redis 6.2 added
+        exclusive ones
+        raises ValueError for an id not of the form {ms}-{sequence}"""
+        ms, sequence = (int(part) for part in entry_id.split("-"))
+        if ms < 0 or not 0 <= sequence <= MAX_ENTRY_SEQUENCE:
+            raise ValueError(f"invalid entry id : {entry_id}")
+        return f"{ms + 1}-0" if sequence == MAX_ENTRY_SEQUENCE else f"{ms}-{sequence + 1}"
+
+    @staticmethod
+    def build_bar(bucket_start: float, open_price: str, high: str, low: str, close: str, ticks: str) -> dict:
+        return {"t": bucket_start, "o": float(open_price), "h": float(high), "l": float(low), "c": float(close),
+                "n": int(ticks)}
+
+    @staticmethod
+    def get_history_keys(tokens: List[str]) -> List[str]:
+        """stream keys holding history of tokens"""
+        return [RedisKeys.TICK_HISTORY.format(token) for token in tokens] + [
+            RedisKeys.OHLC_BARS.format(resolution, token) for resolution in HistoryResolutions.BAR_SECONDS for token in
+            tokens]
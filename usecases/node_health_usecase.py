@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from config.constants import RedisKeys
+from config.settings import AppConfig, BrokerConfig, ShardConfig
+from controller.context_manager import context_log_meta
+from data_adapter.async_redis import AsyncCache
+from data_adapter.ws import WS, WSReconnectSupervisor
+from logger import logger
+from usecases.shard_usecase import ShardUseCase
+from utils.utils import LatencyStats
+
+
+class NodeHealthUseCase:
+    """liveness of nodes of the cluster , detected by the nodes themselves instead of a celery task
+    every node writes its heartbeat key NODE_HEARTBEAT:{node_id} every NODE_HEARTBEAT_INTERVAL_MS with
+    NODE_HEARTBEAT_TTL_MS expiry (NODE_HEARTBEAT_TTL_EMBEDDED_MS for app servers in embedded ingest mode) , the key
+    expiring is the deadline a node is declared dead at. Every node watches
+    heartbeats of nodes registered in NODE_IDS_IN_CLUSTER , first node to take the lock of a dead node moves its tokens
+    to live nodes. A node also watches its own broker ws connections and reconnects one that received nothing for
+    BROKER_WS_PING_TIMEOUT , without waiting for anyone to tell it."""
+    # set on shutdown , heartbeat and monitor loops exit
+    is_stopping = False
+    # ttl of heartbeat of this node , set when ingestion starts
+    heartbeat_ttl_ms = ShardConfig.heartbeat_ttl_ms
+    # last heartbeat seen of every node , detection latency of a dead node is measured from it
+    last_heartbeat_at: Dict[str, float] = {}
+    detection_latency = LatencyStats()
+    takeover_latency = LatencyStats()
+    counters: Dict[str, int] = {"dead_nodes": 0, "takeovers": 0, "tokens_taken_over": 0, "rejoins": 0,
+                                "silent_connections": 0}
+
+    @staticmethod
+    async def beat() -> bool:
+        """write heartbeat of this node"""
+        return await AsyncCache.get_instance().set(RedisKeys.NODE_HEARTBEAT.format(AppConfig.node_id),
+                                                   str(time.time()), ttl_ms=NodeHealthUseCase.heartbeat_ttl_ms)
+
+    @staticmethod
+    async def run_heartbeat():
+        """write heartbeat and watch own broker ws connections every interval , should run as a background task next
+        to broker ws listener"""
+        while not NodeHealthUseCase.is_stopping:
+            try:
+                await NodeHealthUseCase.beat()
+                NodeHealthUseCase.watch_connections()
+            except Exception as e:
+                logger.error(extra=context_log_meta.get(), msg=f"node_health: exception in heartbeat : {e}")
+            await asyncio.sleep(ShardConfig.heartbeat_interval_ms / 1000)
+
+    @staticmethod
+    def watch_connections() -> None:
+        """reconnect connections that received neither ticks nor pings for BROKER_WS_PING_TIMEOUT , a connection
+        being reconnected is left to the supervisor"""
+        silent_before = time.time() - BrokerConfig.ws_ping_timeout
+        for connection in WS.get_instance().connections:
+            last_message_at: Optional[float] = connection.get_last_message_at()
+            if last_message_at is None or last_message_at >= silent_before or \
+                    WSReconnectSupervisor.get_instance().is_reconnecting(connection.index):
+                continue
+            NodeHealthUseCase.counters["silent_connections"] += 1
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"node_health: connection {connection.index} silent for "
+                             f"{time.time() - last_message_at:.1f} sec , reconnecting")
+            WSReconnectSupervisor.get_instance().request_reconnect(connection.index, reason="silent")
+
+    @staticmethod
+    async def run_monitor():
+        """look for dead nodes every interval , should run as a background task next to broker ws listener"""
+        while not NodeHealthUseCase.is_stopping:
+            try:
+                await NodeHealthUseCase.detect_dead_nodes()
+            except Exception as e:
+                logger.error(extra=context_log_meta.get(), msg=f"node_health: exception in monitor : {e}")
+            await asyncio.sleep(ShardConfig.heartbeat_interval_ms / 1000)
+
+    @staticmethod
+    async def detect_dead_nodes() -> List[str]:
+        """nodes registered in NODE_IDS_IN_CLUSTER whose heartbeat expired (or that stopped) , tokens of those this
+        node gets the takeover lock of are moved to live nodes
+        :return node ids taken over by this node"""
+        registered_at: dict = await AsyncCache.get_instance().hgetall(RedisKeys.NODE_IDS_IN_CLUSTER)
+        if not registered_at:
+            # redis could not be read
+            return []
+        if AppConfig.node_id not in registered_at:
+            await NodeHealthUseCase.rejoin()
+            return []
+        node_ids: List[str] = list(registered_at)
+        heartbeats: List[Optional[str]] = await AsyncCache.get_instance().mget(
+            [RedisKeys.NODE_HEARTBEAT.format(node_id) for node_id in node_ids])
+        if heartbeats[node_ids.index(AppConfig.node_id)] is None:
+            # own heartbeat missing means redis could not be read or this node is stalled itself , either way
+            # missing heartbeats of others can not be trusted
+            return []
+        now = time.time()
+        dead_node_ids: List[str] = []
+        for node_id, heartbeat in zip(node_ids, heartbeats):
+            if heartbeat is not None:
+                NodeHealthUseCase.last_heartbeat_at[node_id] = float(heartbeat)
+            elif now - float(registered_at[node_id]) > NodeHealthUseCase.heartbeat_ttl_ms / 1000:
+                # registration is written after first heartbeat , a stopped node has registration time 0
+                dead_node_ids.append(node_id)
+        taken_over_node_ids: List[str] = []
+        for node_id in dead_node_ids:
+            if await AsyncCache.get_instance().set(RedisKeys.NODE_TAKEOVER_LOCK.format(node_id), AppConfig.node_id,
+                                                   ttl_ms=ShardConfig.takeover_lock_ms, only_if_absent=True):
+                taken_over_node_ids.append(node_id)
+                last_heartbeat_at = NodeHealthUseCase.last_heartbeat_at.pop(node_id, None)
+                if last_heartbeat_at is not None:
+                    NodeHealthUseCase.detection_latency.record((now - last_heartbeat_at) * 1000)
+        if not taken_over_node_ids:
+            return []
+        NodeHealthUseCase.counters["dead_nodes"] += len(taken_over_node_ids)
+        start = time.perf_counter()
+        # shard usecase uses blocking redis client , it runs off the event loop
+        tokens_by_node: Dict[str, int] = await asyncio.to_thread(ShardUseCase.take_over_dead_nodes,
+                                                                 taken_over_node_ids)
+        NodeHealthUseCase.takeover_latency.record((time.perf_counter() - start) * 1000)
+        NodeHealthUseCase.counters["takeovers"] += 1
+        NodeHealthUseCase.counters["tokens_taken_over"] += sum(tokens_by_node.values())
+        logger.info(extra=context_log_meta.get(),
+                    msg=f"node_health: took over dead nodes {taken_over_node_ids} , tokens moved : {tokens_by_node}")
+        return taken_over_node_ids
+
+    @staticmethod
+    async def rejoin():
+        """register again after this node was declared dead while alive (eg event loop stalled past heartbeat ttl)
+        its tokens were moved to other nodes , connections are reconnected so that broker drops their subscriptions
+        and node gets tokens again on next rebalance"""
+        NodeHealthUseCase.counters["rejoins"] += 1
+        logger.error(extra=context_log_meta.get(),
+                     msg=f"node_health: node {AppConfig.node_id} was declared dead , registering again")
+        await AsyncCache.get_instance().hset(key=RedisKeys.NODE_IDS_IN_CLUSTER,
+                                             mapping={AppConfig.node_id: time.time()})
+        WSReconnectSupervisor.get_instance().request_reconnect(reason="rejoin")
+
+    @staticmethod
+    async def stop():
+        """stop heartbeats and drop heartbeat key , so that other nodes take over tokens of this node right away"""
+        NodeHealthUseCase.is_stopping = True
+        await AsyncCache.get_instance().delete([RedisKeys.NODE_HEARTBEAT.format(AppConfig.node_id)])
+
+    @staticmethod
+    def get_stats() -> dict:
+        """counters of failure detection"""
+        return {
+            **NodeHealthUseCase.counters,
+            "detection_latency": NodeHealthUseCase.detection_latency.get_stats(),
+            "takeover_latency": NodeHealthUseCase.takeover_latency.get_stats(),
+        }
@@ -0,0 +1,74 @@
+from typing import List, Set
+
+import orjson
+
+from config.settings import PriceStreamConfig
+from controller.context_manager import context_log_meta
+from data_adapter.instrument_catalog import InstrumentCatalog
+from data_adapter.price_stream import PriceStreamHub, PriceStreamSubscriber
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import PriceStreamCommandModel, PriceStreamActions
+from usecases.sensi_usecase import SensiUseCase
+
+
+class PriceStreamUseCase:
+
+    @staticmethod
+    async def resolve_tokens(symbols: List[str], tokens: List[str]) -> Set[str]:
+        """tokens to stream for underlying symbols (underlying along with all its derivatives) and tokens"""
+        resolved_tokens: Set[str] = set(tokens)
+        if not symbols:
+            return resolved_tokens
+        underlying_token_by_symbol = {underlying.symbol: underlying.token for underlying in
+                                      (await InstrumentCatalog.get_instance().get_underlyings()).instruments}
+        for symbol in symbols:
+            if symbol in underlying_token_by_symbol:
+                resolved_tokens.add(underlying_token_by_symbol[symbol])
+            resolved_tokens.update((await InstrumentCatalog.get_instance().get_derivatives_by_underlying_symbol(
+                symbol=symbol)).tokens)
+        return resolved_tokens
+
+    @staticmethod
+    async def subscribe(subscriber: PriceStreamSubscriber, symbols: List[str], tokens: List[str]) \
+            -> GenericResponseModel:
+        """
+        Subscribe stream connection to prices of symbols and tokens , snapshot of current prices is queued
+        on the subscriber followed by deltas
+        :return GenericResponseModel:
+        """
+        try:
+            tokens_to_subscribe = await PriceStreamUseCase.resolve_tokens(symbols=symbols, tokens=tokens) - \
+                subscriber.tokens
+            if len(subscriber.tokens) + len(tokens_to_subscribe) > PriceStreamConfig.max_tokens_per_connection:
+                return GenericResponseModel(success=False, payload=f"max {PriceStreamConfig.max_tokens_per_connection}"
+                                                                   f" tokens can be subscribed per connection")
+            if not tokens_to_subscribe:
+                return GenericResponseModel(success=True)
+            tokens_to_subscribe = list(tokens_to_subscribe)
+            PriceStreamHub.get_instance().subscribe(subscriber, tokens_to_subscribe)
+            prices = await SensiUseCase.get_prices(tokens_to_subscribe)
+            snapshot = {token: price for token, price in zip(tokens_to_subscribe, prices) if price is not None}
+            subscriber.mark_sent(snapshot)
+            subscriber.push_message(orjson.dumps({"type": "snapshot", "prices": snapshot}))
+            return GenericResponseModel(success=True)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in price stream subscribe error : {e}")
+            return GenericResponseModel(success=False)
+
+    @staticmethod
+    async def handle_command(subscriber: PriceStreamSubscriber, command: PriceStreamCommandModel) \
+            -> GenericResponseModel:
+        """
+        Handle subscribe/unsubscribe command sent by client on price stream websocket
+        :return GenericResponseModel:
+        """
+        if command.action == PriceStreamActions.SUBSCRIBE:
+            return await PriceStreamUseCase.subscribe(subscriber, symbols=command.symbols, tokens=command.tokens)
+        try:
+            PriceStreamHub.get_instance().unsubscribe(
+                subscriber, await PriceStreamUseCase.resolve_tokens(symbols=command.symbols, tokens=command.tokens))
+            return GenericResponseModel(success=True)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in price stream unsubscribe error : {e}")
+            return GenericResponseModel(success=False)
@@ -1,143 +1,372 @@
+import asyncio
+import hashlib
+import math
 import time
-from datetime import datetime, timedelta
-from typing import List, Set
+from array import array
+from datetime import date
+from typing import List, Set, Optional, Dict, Tuple
 
-from config.constants import RedisKeys
-from config.settings import AppConfig, BrokerConfig
-from controller.context_manager import context_log_meta
+import orjson
+
+from config.constants import RedisKeys, HistoryResolutions
+from config.settings import AppConfig, BrokerConfig, OptionChainConfig
+from controller.context_manager import context_log_meta, get_db_session
+from data_adapter.async_redis import AsyncCache
+from data_adapter.instrument_catalog import InstrumentCatalog, CatalogEntry
+from data_adapter.price_board import PriceBoard
+from data_adapter.price_stream import PriceStreamHub
+from data_adapter.price_table import PriceTable
 from data_adapter.redis import Cache
 from data_adapter.sensi_data import SensiUnderlying, SensiDerivative
-from data_adapter.ws import WS
+from data_adapter.token_registry import TokenRegistry
+from data_adapter.ws import WS, WSReconnectSupervisor
 from integrations.broker_integration import BrokerIntegration
 from logger import logger
-from models.base import GenericResponseModel
+from models.base import GenericResponseModel, EncodedPayloadModel
+from usecases.analytics_usecase import AnalyticsUseCase
+from usecases.history_usecase import HistoryUseCase
+from usecases.shard_usecase import ShardUseCase
+from utils.utils import LatencyStats, build_payload_hash
 from models.sensi_models import SensiBrokerResModel, UnderlyingCacheModel, \
-    BrokerWSOutgoingMessage, BrokerWSCommands, SensiResModel
+    BrokerWSOutgoingMessage, BrokerWSCommands, PriceDeltaModel, TopicMessageModel, InstrumentSyncReportModel, \
+    DerivativeFilterModel, OptionChainCursorModel
 
 
 class SensiUseCase:
+    # publish to consume latency of redis topics consumed by the node
+    topic_latency: Dict[str, LatencyStats] = {}
 
     @staticmethod
-    def get_underlying_prices() -> GenericResponseModel:
+    async def get_underlying_prices(if_none_match: Optional[str] = None,
+                                    max_age: Optional[float] = None) -> GenericResponseModel:
         """
         Get underlying prices
-        :return GenericResponseModel:
+        :param if_none_match: etag of the snapshot client already has
+        :param max_age: prices not updated in these many seconds are returned as null
+        :return GenericResponseModel: payload is json encoded list of underlyings with prices
         """
         try:
-            sensi_underlyings: List[SensiResModel] = SensiUnderlying.get_all_underlying()
-            if not sensi_underlyings:
+            sensi_underlyings: CatalogEntry = await InstrumentCatalog.get_instance().get_underlyings()
+            if not sensi_underlyings.instruments:
                 return GenericResponseModel(success=False, payload="No underlyings found")
-            token_price_from_cache: dict = Cache.get_instance(). \
-                hmget(RedisKeys.ENTITY_PRICE_DATA, fields=[underlying.token for underlying in sensi_underlyings])
-            # build a map of token and price from list of derivatives
-            token_price_map: dict = {}
-            for i in range(len(sensi_underlyings)):
-                if token_price_from_cache[i]:
-                    token_price_map[sensi_underlyings[i].token] = float(token_price_from_cache[i])
-            # update price in derivative object from cache
-            for derivative in sensi_underlyings:
-                derivative.price = token_price_map.get(derivative.token)
-            return GenericResponseModel(success=True, payload=sensi_underlyings)
+            return GenericResponseModel(success=True, payload=await SensiUseCase.build_encoded_prices_payload(
+                sensi_underlyings, if_none_match=if_none_match, max_age=max_age))
         except Exception as e:
             logger.error(extra=context_log_meta.get(), msg=f"exception in get_underlying_prices error : {e}")
             return GenericResponseModel(success=False)
 
     @staticmethod
-    def get_derivatives_by_underlying_symbol(symbol: str) -> GenericResponseModel:
+    async def get_derivatives_by_underlying_symbol(symbol: str, if_none_match: Optional[str] = None,
+                                                   filters: Optional[DerivativeFilterModel] = None,
+                                                   with_greeks: bool = False,
+                                                   max_age: Optional[float] = None) -> GenericResponseModel:
         """
         Get derivative prices for underlying symbol
         :param symbol: underlying symbol
-        :return GenericResponseModel:
+        :param if_none_match: etag of the snapshot client already has
+        :param filters: option chain filters and page , whole chain is served from catalog without them
+        :param with_greeks: add implied volatility and greeks of options to every derivative
+        :param max_age: prices not updated in these many seconds are returned as null
+        :return GenericResponseModel: payload is json encoded list of derivatives with prices
         """
+        if filters is not None and not filters.is_empty():
+            return await SensiUseCase.get_option_chain(symbol=symbol, filters=filters, if_none_match=if_none_match,
+                                                       with_greeks=with_greeks, max_age=max_age)
         try:
-            sensi_derivatives: List[SensiResModel] = SensiDerivative.get_all_derivative_by_underlying_symbol(
-                symbol=symbol)
-            if not sensi_derivatives:
+            sensi_derivatives: CatalogEntry = await InstrumentCatalog.get_instance(). \
+                get_derivatives_by_underlying_symbol(symbol=symbol)
+            if not sensi_derivatives.instruments:
                 return GenericResponseModel(success=False, payload="No derivatives found for given symbol")
-            token_price_from_cache: dict = Cache.get_instance(). \
-                hmget(RedisKeys.ENTITY_PRICE_DATA, fields=[derivative.token for derivative in sensi_derivatives])
-            # build a map of token and price from list of derivatives
-            token_price_map: dict = {}
-            for i in range(len(sensi_derivatives)):
-                if token_price_from_cache[i]:
-                    token_price_map[sensi_derivatives[i].token] = float(token_price_from_cache[i])
-            # update price in derivative object from cache
-            for derivative in sensi_derivatives:
-                derivative.price = token_price_map.get(derivative.token)
-            return GenericResponseModel(success=True, payload=sensi_derivatives)
+            return GenericResponseModel(success=True, payload=await SensiUseCase.build_encoded_prices_payload(
+                sensi_derivatives, if_none_match=if_none_match, greeks_of_symbol=symbol if with_greeks else None,
+                max_age=max_age))
         except Exception as e:
             logger.error(extra=context_log_meta.get(), msg=f"exception in get_derivatives_by_symbol error : {e}")
             return GenericResponseModel(success=False)
 
     @staticmethod
-    def sync_underlyings_data() -> GenericResponseModel:
+    async def get_option_chain(symbol: str, filters: DerivativeFilterModel, if_none_match: Optional[str] = None,
+                               with_greeks: bool = False, max_age: Optional[float] = None) -> GenericResponseModel:
         """
-        Sync underlying data
-        :return GenericResponseModel:
+        Get a page of derivative prices of underlying symbol matching filters , filtering and paging happen in db
+        so payload and db work scale with what client asks for
+        :return GenericResponseModel: payload is json encoded list of derivatives with prices and next page cursor
         """
         try:
-            underlyings_from_broker: List[SensiBrokerResModel] = BrokerIntegration.fetch_all_underlyings()
-            current_underlyings_in_system: Set[str] = SensiUseCase.get_all_underlyings_from_cache()
-            #  filter out underlyings which are already in system
-            underlyings_to_be_added: List[SensiBrokerResModel] = list(
-                filter(lambda x: x.token not in current_underlyings_in_system, underlyings_from_broker))
-            if not underlyings_to_be_added:
-                logger.error(extra=context_log_meta.get(), msg=f"no underlyings found in broker that are not in system")
-                return GenericResponseModel(success=False)
-            underlyings_to_insert = [underlying.build_underlying_db_model() for underlying in underlyings_to_be_added]
-            SensiUnderlying.insert_underlyings(underlyings_to_insert)
-            # update cached underlyings with newly added underlyings
-            SensiUseCase.add_underlyings_in_cache([UnderlyingCacheModel(token=underlying.token, id=underlying.id) for
-                                                   underlying in underlyings_to_insert])
-            SensiUseCase.publish_synced_entity_data([underlying.token for underlying in underlyings_to_insert])
-            return GenericResponseModel(success=True)
+            try:
+                after = OptionChainCursorModel.parse_cursor(filters.cursor) if filters.cursor else None
+            except ValueError:
+                return GenericResponseModel(success=False, payload="Invalid cursor")
+            if filters.strikes_around_atm is not None and after is not None and (
+                    after.min_strike is not None or after.max_strike is not None):
+                # later pages reuse strike window resolved for first page
+                filters = filters.copy(update={"min_strike": after.min_strike, "max_strike": after.max_strike})
+            elif filters.strikes_around_atm is not None:
+                filters = await SensiUseCase.resolve_strikes_around_atm(symbol=symbol, filters=filters)
+                if filters is None:
+                    return GenericResponseModel(success=False, payload="Underlying price not available")
+            limit = min(filters.limit or OptionChainConfig.default_page_size, OptionChainConfig.max_page_size)
+            derivatives, next_cursor = SensiDerivative.get_option_chain_page(symbol=symbol, filters=filters,
+                                                                             limit=limit, after=after)
+            entry = CatalogEntry(derivatives, version_tag=f"{InstrumentCatalog.get_instance().get_version()}:chain:"
+                                                          f"{symbol}:{filters.json()}")
+            payload = await SensiUseCase.build_encoded_prices_payload(
+                entry, if_none_match=if_none_match, greeks_of_symbol=symbol if with_greeks else None, max_age=max_age)
+            if next_cursor and filters.strikes_around_atm is not None:
+                next_cursor = next_cursor.copy(update={"min_strike": filters.min_strike,
+                                                       "max_strike": filters.max_strike})
+            payload.next_cursor = next_cursor.build_cursor() if next_cursor else None
+            return GenericResponseModel(success=True, payload=payload)
         except Exception as e:
-            logger.error(extra=context_log_meta.get(), msg=f"exception in sync_underlyings_data error : {e}")
+            logger.error(extra=context_log_meta.get(), msg=f"exception in get_option_chain error : {e}")
             return GenericResponseModel(success=False)
 
     @staticmethod
-    def sync_derivatives_data() -> GenericResponseModel:
+    async def resolve_strikes_around_atm(symbol: str, filters: DerivativeFilterModel) \
+            -> Optional[DerivativeFilterModel]:
+        """narrow strike range of filters to strikes_around_atm strikes on each side of the strike closest to live
+        price of underlying
+        :return None if live price of underlying is not available"""
+        underlying_price = await SensiUseCase.get_underlying_price(symbol)
+        if underlying_price is None:
+            return None
+        strikes: List[float] = SensiDerivative.get_option_chain_strikes(symbol=symbol, filters=filters)
+        if not strikes:
+            return filters
+        atm_index = min(range(len(strikes)), key=lambda i: abs(strikes[i] - underlying_price))
+        min_strike = strikes[max(atm_index - filters.strikes_around_atm, 0)]
+        max_strike = strikes[min(atm_index + filters.strikes_around_atm, len(strikes) - 1)]
+        return filters.copy(update={
+            "min_strike": max(min_strike, filters.min_strike) if filters.min_strike is not None else min_strike,
+            "max_strike": min(max_strike, filters.max_strike) if filters.max_strike is not None else max_strike})
+
+    @staticmethod
+    async def get_underlying_price(symbol: str) -> Optional[float]:
+        """live price of underlying symbol , None if symbol is unknown or has no price"""
+        underlyings: CatalogEntry = await InstrumentCatalog.get_instance().get_underlyings()
+        underlying_token = next((underlying.token for underlying in underlyings.instruments if
+                                 underlying.symbol == symbol), None)
+        if underlying_token is None:
+            return None
+        return (await SensiUseCase.get_prices([underlying_token]))[0]
+
+    @staticmethod
+    async def build_encoded_prices_payload(entry: CatalogEntry, if_none_match: Optional[str] = None,
+                                           greeks_of_symbol: Optional[str] = None,
+                                           max_age: Optional[float] = None) -> EncodedPayloadModel:
+        """splice live prices into pre-encoded instruments of catalog entry
+        etag is derived from catalog version and prices , so body is not built at all when client already has
+        the same snapshot
+        :param greeks_of_symbol: underlying symbol of derivatives of entry , iv and greeks are spliced along with
+        prices when given
+        :param max_age: prices not updated in these many seconds (or with unknown update time) are nulled , update
+        time of every price is spliced as price_updated_at when given"""
+        prices: List[Optional[float]] = await SensiUseCase.get_prices(entry.tokens, token_ids=entry.get_token_ids())
+        updated_at: Optional[List[Optional[float]]] = None
+        if max_age is not None:
+            updated_at = await SensiUseCase.get_price_update_times(entry.tokens, token_ids=entry.get_token_ids())
+            oldest_allowed = time.time() - max_age
+            prices = [price if price_updated_at is not None and price_updated_at >= oldest_allowed else None for
+                      price, price_updated_at in zip(prices, updated_at)]
+        snapshot = array('d', [math.nan if price is None else price for price in prices]).tobytes()
+        if updated_at is not None:
+            # update times are part of the snapshot , so is max age through the prices it nulled
+            snapshot += b'updated_at' + array('d', [math.nan if price_updated_at is None else price_updated_at
+                                                    for price_updated_at in updated_at]).tobytes()
+        if greeks_of_symbol is not None:
+            # greeks depend on underlying price and time to expiry as well , they are part of the snapshot
+            underlying_price = await SensiUseCase.get_underlying_price(greeks_of_symbol)
+            valued_at = AnalyticsUseCase.get_valuation_time()
+            snapshot += b'greeks' + array('d', [math.nan if underlying_price is None else underlying_price,
+                                                valued_at]).tobytes()
+        etag = '"{}"'.format(hashlib.blake2b(entry.version_tag + snapshot, digest_size=16).hexdigest())
+        if if_none_match == etag:
+            return EncodedPayloadModel(etag=etag)
+        # json members spliced after price of every instrument , price update time and greeks
+        members: List[List[bytes]] = []
+        if updated_at is not None:
+            members.append([b',"price_updated_at":' + orjson.dumps(
+                None if price_updated_at is None else round(price_updated_at, 3)) for price_updated_at in updated_at])
+        if greeks_of_symbol is not None:
+            members.append(await AnalyticsUseCase.get_encoded_greeks(
+                entry, prices, underlying_price=underlying_price, valued_at=valued_at, snapshot_key=etag))
+        if not members:
+            body = b'[' + b','.join([prefix + orjson.dumps(price) + b'}' for prefix, price in
+                                     zip(entry.encoded_prefixes, prices)]) + b']'
+        else:
+            body = b'[' + b','.join([prefix + orjson.dumps(price) + b''.join(instrument_members) + b'}' for
+                                     prefix, price, *instrument_members in
+                                     zip(entry.encoded_prefixes, prices, *members)]) + b']'
+        return EncodedPayloadModel(etag=etag, body=body)
+
+    @staticmethod
+    async def get_prices(tokens: List[str], token_ids: Optional[List[Optional[int]]] = None) -> List[Optional[float]]:
+        """latest prices of tokens from local price table , tokens missing or stale in the table are read from
+        price board of the host when it is enabled , only tokens missed by both are fetched from redis and written
+        back to the table
+        :param token_ids: registry ids of tokens if caller has them , table is then read without id lookups"""
+        prices: List[Optional[float]] = PriceTable.get_instance().get_many(tokens) if token_ids is None else \
+            PriceTable.get_instance().get_many_by_ids(token_ids)
+        missed_indexes = [i for i, price in enumerate(prices) if price is None]
+        if missed_indexes and PriceBoard.get_instance().is_enabled():
+            board_prices = PriceBoard.get_instance().get_many(
+                [tokens[i] for i in missed_indexes],
+                token_ids=None if token_ids is None else [token_ids[i] for i in missed_indexes])
+            if board_prices is not None:
+                for i, board_price in zip(missed_indexes, board_prices):
+                    prices[i] = board_price
+                missed_indexes = [i for i in missed_indexes if prices[i] is None]
+        if missed_indexes:
+            # update times are read along so that table keeps time of the tick and not of this read
+            token_price_from_cache, updated_at_from_cache = await AsyncCache.get_instance().hmget_with_scores(
+                RedisKeys.ENTITY_PRICE_DATA, score_key=RedisKeys.ENTITY_PRICE_UPDATED_AT,
+                fields=[tokens[i] for i in missed_indexes])
+            for i, cached_price, cached_updated_at in zip(missed_indexes, token_price_from_cache,
+                                                          updated_at_from_cache):
+                if cached_price:
+                    prices[i] = float(cached_price)
+                    PriceTable.get_instance().update(token=tokens[i], price=prices[i], ticked_at=cached_updated_at)
+        return prices
+
+    @staticmethod
+    async def get_price_update_times(tokens: List[str], token_ids: Optional[List[Optional[int]]] = None) \
+            -> List[Optional[float]]:
+        """time price of every token was last updated (epoch sec) , from local price table and from
+        ENTITY_PRICE_UPDATED_AT for prices the table does not serve , None if token never had a price
+        :param token_ids: registry ids of tokens if caller has them"""
+        updated_at: List[Optional[float]] = PriceTable.get_instance().get_ticked_at_by_ids(
+            TokenRegistry.get_instance().get_ids(tokens) if token_ids is None else token_ids)
+        missed_indexes = [i for i, price_updated_at in enumerate(updated_at) if price_updated_at is None]
+        if missed_indexes:
+            updated_at_from_cache = await AsyncCache.get_instance().zmscore(
+                RedisKeys.ENTITY_PRICE_UPDATED_AT, members=[tokens[i] for i in missed_indexes])
+            for i, cached_updated_at in zip(missed_indexes, updated_at_from_cache):
+                updated_at[i] = cached_updated_at
+        return updated_at
+
+    @staticmethod
+    def apply_price_delta(message: dict) -> None:
+        """handler for price delta feed , keeps local price table in sync with ticks received by other nodes"""
+        try:
+            price_delta = PriceDeltaModel.parse_raw(message.get("data"))
+            SensiUseCase.topic_latency.setdefault(RedisKeys.TOPIC_FOR_PRICE_DELTA, LatencyStats()).record(
+                (time.time() - price_delta.updated_at) * 1000)
+            # own ticks are already in the price table
+            if price_delta.node_id == AppConfig.node_id:
+                return
+            PriceTable.get_instance().update_many(price_delta.prices, updated_at=price_delta.updated_at)
+            PriceStreamHub.get_instance().publish_many(price_delta.prices)
+            if price_delta.stale:
+                PriceStreamHub.get_instance().publish_stale(price_delta.stale)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in apply_price_delta error : {e}")
+
+    @staticmethod
+    def publish_catalog_version() -> None:
+        """bump and publish instrument catalog version after instruments are inserted
+        inserted rows are committed first so that nodes reloading the catalog on this bump can see them"""
+        get_db_session().commit()
+        version = Cache.get_instance().incr(RedisKeys.INSTRUMENT_CATALOG_VERSION)
+        Cache.get_instance().publish(RedisKeys.TOPIC_FOR_INSTRUMENT_CATALOG_VERSION,
+                                     TopicMessageModel(data=str(version), published_at=time.time()).build_message())
+
+    @staticmethod
+    def sync_underlyings_data() -> GenericResponseModel:
         """
-        Sync derivative data for all underlyings
-        :return GenericResponseModel:
+        Sync underlying data , skipped if broker payload is same as last synced payload
+        :return GenericResponseModel: payload is InstrumentSyncReportModel
         """
         try:
-            udnerlyings_from_system: List[UnderlyingCacheModel] = SensiUseCase.get_underlyings_token_id_from_cache()
-            if not udnerlyings_from_system:
-                logger.error(extra=context_log_meta.get(), msg=f"no underlyings found in db")
+            start = time.perf_counter()
+            underlyings_from_broker: List[SensiBrokerResModel] = BrokerIntegration.fetch_all_underlyings()
+            report = InstrumentSyncReportModel(key=RedisKeys.UNDERLYINGS_DATA, fetched=len(underlyings_from_broker),
+                                               fetch_ms=round((time.perf_counter() - start) * 1000, 3))
+            if not underlyings_from_broker:
+                logger.error(extra=context_log_meta.get(), msg=f"no underlyings found in broker")
                 return GenericResponseModel(success=False)
-            derivative_tokens_to_subscribe_from_ws: List[str] = []
-            for underlying in udnerlyings_from_system:
-                derivatives_from_broker: List[
-                    SensiBrokerResModel] = BrokerIntegration.fetch_all_derivatives_by_underlying_token(
-                    underlying_token=underlying.token)
-                current_derivatives_in_system: Set[str] = SensiUseCase.get_all_derivatives_from_cache(
-                    underlying_token=underlying.token)
-                #  filter out derivatives which are already in system
-                derivatives_to_be_added: List[SensiBrokerResModel] = list(
-                    filter(lambda x: x.token not in current_derivatives_in_system, derivatives_from_broker))
-                if not derivatives_to_be_added:
-                    logger.error(extra=context_log_meta.get(),
-                                 msg=f"no derivatives found in broker that are not in system "
-                                     f"for underlying : {underlying.token}")
-                    continue
-                SensiDerivative.insert_derivatives(
-                    [derivative.build_derivative_db_model(underlying_id=underlying.id) for derivative in
-                     derivatives_to_be_added])
-                # update cached derivatives with newly added derivatives
-                token_to_add_in_cache = [derivative.token for derivative in derivatives_to_be_added]
-                SensiUseCase.add_derivatives_in_cache(
-                    underlying_token=underlying.token,
-                    derivatives=token_to_add_in_cache)
-                derivative_tokens_to_subscribe_from_ws.extend(token_to_add_in_cache)
-            # add newly added derivatives to set of tokens to subscribe from ws
-            if derivative_tokens_to_subscribe_from_ws:
-                SensiUseCase.publish_synced_entity_data(derivative_tokens_to_subscribe_from_ws)
-            return GenericResponseModel(success=True)
+            rows_from_broker: List[dict] = [underlying.build_db_row() for underlying in underlyings_from_broker]
+            payload_hash = build_payload_hash(rows_from_broker)
+            if payload_hash == Cache.get_instance().get(RedisKeys.UNDERLYINGS_PAYLOAD_HASH):
+                logger.info(extra=context_log_meta.get(), msg=f"sync_underlyings_data: underlyings unchanged , skipped")
+                report.skipped = True
+                return GenericResponseModel(success=True, payload=report)
+            start = time.perf_counter()
+            rows_in_db: Dict[str, dict] = SensiUnderlying.get_rows_by_token(columns=list(rows_from_broker[0]))
+            rows_to_insert, rows_to_update, tokens_to_delete = SensiUseCase.build_instrument_diff(
+                rows_from_broker, rows_in_db)
+            upserted_underlyings = SensiUnderlying.bulk_upsert(rows_to_insert + rows_to_update)
+            SensiUnderlying.soft_delete_by_tokens(tokens_to_delete)
+            get_db_session().commit()
+            # update cached underlyings with committed underlyings
+            if upserted_underlyings:
+                # ids are assigned before tokens are handed over to nodes and catalog version is bumped
+                TokenRegistry.get_instance().assign_ids([token for _, token in upserted_underlyings])
+                SensiUseCase.add_underlyings_in_cache([UnderlyingCacheModel(token=token, id=underlying_id) for
+                                                       underlying_id, token in upserted_underlyings])
+            if tokens_to_delete:
+                Cache.get_instance().srem(RedisKeys.UNDERLYINGS_DATA, values=[
+                    UnderlyingCacheModel(token=token, id=rows_in_db[token]['id']).build_cache_data()
+                    for token in tokens_to_delete])
+                SensiUseCase.release_deleted_tokens(tokens_to_delete)
+            Cache.get_instance().set(RedisKeys.UNDERLYINGS_PAYLOAD_HASH, payload_hash)
+            report.added, report.updated, report.deleted = len(rows_to_insert), len(rows_to_update), len(
+                tokens_to_delete)
+            report.write_ms = round((time.perf_counter() - start) * 1000, 3)
+            if rows_to_insert or rows_to_update or tokens_to_delete:
+                SensiUseCase.publish_catalog_version()
+            tokens_to_subscribe = SensiUseCase.get_tokens_to_subscribe(rows_to_insert, rows_to_update, rows_in_db)
+            if tokens_to_subscribe:
+                SensiUseCase.publish_synced_entity_data(tokens_to_subscribe)
+            logger.info(extra=context_log_meta.get(), msg=f"sync_underlyings_data: report : {report.json()}")
+            return GenericResponseModel(success=True, payload=report)
         except Exception as e:
-            logger.error(extra=context_log_meta.get(), msg=f"exception in sync_derivatives_data error : {e}")
+            logger.error(extra=context_log_meta.get(), msg=f"exception in sync_underlyings_data error : {e}")
             return GenericResponseModel(success=False)
 
+    @staticmethod
+    def build_instrument_diff(rows_from_broker: List[dict], rows_in_db: Dict[str, dict]) \
+            -> Tuple[List[dict], List[dict], List[str]]:
+        """field level diff of rows built from broker payload against rows in db
+        :return rows to insert , rows to update (some field changed or row was deleted earlier) and tokens of rows
+        no longer sent by broker (expired instruments) to be soft deleted"""
+        # expired instruments still sent by broker are treated as not sent , so that they are not brought back
+        # after being purged
+        today = date.today()
+        rows_from_broker = [row for row in rows_from_broker if not SensiUseCase.is_expired_row(row, today)]
+        rows_to_insert: List[dict] = []
+        rows_to_update: List[dict] = []
+        for row in rows_from_broker:
+            row_in_db = rows_in_db.get(row['token'])
+            if row_in_db is None:
+                rows_to_insert.append(row)
+            elif row_in_db['is_deleted'] or any(SensiUseCase.__normalize_field(value) !=
+                                                SensiUseCase.__normalize_field(row_in_db[column])
+                                                for column, value in row.items()):
+                rows_to_update.append(row)
+        tokens_from_broker: Set[str] = {row['token'] for row in rows_from_broker}
+        tokens_to_delete: List[str] = [token for token, row_in_db in rows_in_db.items()
+                                       if not row_in_db['is_deleted'] and token not in tokens_from_broker]
+        return rows_to_insert, rows_to_update, tokens_to_delete
+
+    @staticmethod
+    def __normalize_field(value):
+        """broker sends dates as iso strings while db returns date objects"""
+        return value.isoformat() if isinstance(value, date) else value
+
+    @staticmethod
+    def is_expired_row(row: dict, today: date) -> bool:
+        expiry = row.get('expiry')
+        if not expiry:
+            return False
+        return str(SensiUseCase.__normalize_field(expiry))[:10] < today.isoformat()
+
+    @staticmethod
+    def get_tokens_to_subscribe(rows_to_insert: List[dict], rows_to_update: List[dict],
+                                rows_in_db: Dict[str, dict]) -> List[str]:
+        """tokens of newly inserted rows and of rows brought back after being deleted"""
+        revived_tokens = [row['token'] for row in rows_to_update if rows_in_db[row['token']]['is_deleted']]
+        return [row['token'] for row in rows_to_insert] + revived_tokens
+
     @staticmethod
     def get_all_underlyings_from_cache() -> Set[str]:
         """extract only underlying tokens and return"""
@@ -186,105 +415,145 @@ class SensiUseCase:
         return Cache.get_instance().sadd(RedisKeys.UNDERLYINGS_DATA,
                                          values=[underlying.build_cache_data() for underlying in underlyings])
 
-    @staticmethod
-    def get_all_derivatives_from_cache(underlying_token: str) -> Set[str]:
-        """extract derivatives associated with underlying token"""
-        derivatives = Cache.get_instance().smembers(RedisKeys.DERIVATIVES_DATA.format(underlying_token))
-        if not derivatives:
-            # if cache is empty then fetch from db
-            logger.error(extra=context_log_meta.get(), msg=f"no derivatives found in cache fetching form db")
-            derivatives_from_db = SensiDerivative.get_all_derivatives_by_underlying_token(underlying_token)
-            if not derivatives_from_db:
-                logger.error(extra=context_log_meta.get(), msg=f"no derivatives found in db")
-                return set()
-            SensiUseCase.add_derivatives_in_cache(underlying_token=underlying_token,
-                                                  derivatives=[derivative.token for derivative in
-                                                               derivatives_from_db])
-            derivatives = {derivative.token for derivative in derivatives_from_db}
-        return derivatives
-
     @staticmethod
     def add_derivatives_in_cache(underlying_token: str, derivatives: List[str]) -> int:
         """add derivatives in cache"""
         return Cache.get_instance().sadd(RedisKeys.DERIVATIVES_DATA.format(underlying_token), values=derivatives)
 
-    """we are using combination of set and redis pubsub to send data from worker to application servers
-    worker would publish an event on topic and add data in set , app instance would subscribe to topic and
-    read data from set and process it , at a time only one instance would be able to read data from set and other 
-    instances would get empty data"""
+    @staticmethod
+    def remove_derivatives_from_cache(underlying_token: str, derivatives: List[str]) -> int:
+        """remove deleted derivatives from cache"""
+        return Cache.get_instance().srem(RedisKeys.DERIVATIVES_DATA.format(underlying_token), values=derivatives)
+
+    @staticmethod
+    def remove_prices_from_cache(tokens: List[str]) -> int:
+        """drop prices , update times , stale flags , tick history and ohlc bars of tokens that are no longer traded
+        :return number of price entries removed"""
+        removed = Cache.get_instance().hdel(RedisKeys.ENTITY_PRICE_DATA, fields=tokens)
+        Cache.get_instance().zrem(RedisKeys.ENTITY_PRICE_UPDATED_AT, members=tokens)
+        Cache.get_instance().srem(RedisKeys.STALE_ENTITY_TOKENS, values=tokens)
+        Cache.get_instance().delete(HistoryUseCase.get_history_keys(tokens))
+        for resolution in HistoryResolutions.BAR_SECONDS:
+            Cache.get_instance().hdel(RedisKeys.OPEN_OHLC_BARS.format(resolution), fields=tokens)
+        return removed
+
+    @staticmethod
+    def release_deleted_tokens(tokens: List[str]) -> Dict[str, int]:
+        """instruments soft deleted by sync (no longer sent by broker) are unsubscribed by the nodes owning them and
+        their prices dropped , same as expired ones , so that they do not stay subscribed and move between nodes
+        :return number of tokens unsubscribed by each node"""
+        tokens_by_node = ShardUseCase.unassign_tokens(tokens)
+        SensiUseCase.remove_prices_from_cache(tokens)
+        return tokens_by_node
+
+    """synced tokens reach their owner node through its handoff stream (see ShardUseCase and HandoffUseCase) ,
+    redis topics carry price deltas , catalog versions and reconnect requests to every node"""
 
     @staticmethod
     def publish_synced_entity_data(synced_entity_tokens: List[str]):
-        """publish synced derivatives data to redis"""
-        Cache.get_instance().sadd_and_publish(topic=RedisKeys.TOPIC_FOR_WS_ENTITY_PUSH,
-                                              msg=RedisKeys.TOPIC_MESSAGE_FOR_WS_ENTITY_PUSH,
-                                              key=RedisKeys.ENTITY_TOKENS_TO_BE_SYNCED, values=synced_entity_tokens)
+        """hand synced tokens over to the nodes owning them , to be subscribed from broker ws"""
+        ShardUseCase.assign_tokens(synced_entity_tokens)
 
     @staticmethod
-    async def subscribe_and_poll_topic_data():
-        """subscribe to derivative data and poll for data
-        in cae of multiple instances of servers , all instances would subscribe to the topic and receive message
-        but only one of them would get hold of data present in set
+    async def consume_topic_data():
+        """consume messages of redis topics the node subscribes to , runs as a task on the app event loop
+        listen blocks till a message arrives and every wakeup drains all pending messages , so a burst of messages
+        is handled in a single pass instead of one message per poll
+        all instances receive every message , reconnect requests carry node id of the node they are for
         """
-        Cache.get_instance().subscribe(RedisKeys.TOPIC_FOR_WS_ENTITY_PUSH)
-        Cache.get_instance().subscribe(RedisKeys.TOPIC_FOR_WS_RECONNECT)
+        pubsub = AsyncCache.get_instance().pubsub()
+        await pubsub.subscribe(RedisKeys.TOPIC_FOR_WS_RECONNECT, RedisKeys.TOPIC_FOR_PRICE_DELTA,
+                               RedisKeys.TOPIC_FOR_INSTRUMENT_CATALOG_VERSION)
         while True:
             try:
-                message = Cache.get_instance().get_message()
-                if message and message.get("data") == RedisKeys.TOPIC_MESSAGE_FOR_WS_ENTITY_PUSH:
-                    derivatives_to_subscribe: List[str] = Cache.get_instance().smembers_and_delete(
-                        key=RedisKeys.ENTITY_TOKENS_TO_BE_SYNCED)
-                    # in cae of multiple instances of servers , all instances would subscribe to the topic but only on
-                    # of them would get hold of data present in the redis set
-                    if not derivatives_to_subscribe:
-                        continue
-                    #  subscribe to derivatives data from WS
-                    logger.info(extra=context_log_meta.get(),
-                                msg=f"subscribe_and_poll_topic_data: subscribing to derivatives data from ws "
-                                    f": {derivatives_to_subscribe}")
-                    await BrokerIntegration.broker_ws_sender(
-                        data=BrokerWSOutgoingMessage(msg_command=BrokerWSCommands.SUBSCRIBE,
-                                                     tokens=derivatives_to_subscribe).json())
-                    # register the entity token as ws subscriber for the node
-                    # if this node goes down , orchestrator would register these entity ws subscribers to other node
-                    Cache.get_instance().sadd(key=RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(AppConfig.node_id),
-                                              values=derivatives_to_subscribe)
-                    logger.info(extra=context_log_meta.get(),
-                                msg=f"subscribe_and_poll_topic_data: subscribed to derivatives data from ws "
-                                    f": {derivatives_to_subscribe}")
-                elif message and message.get("channel") == RedisKeys.TOPIC_FOR_WS_RECONNECT and message.get(
-                        "data") == AppConfig.node_id:
-                    # if node instance get a message on topic to reconnect  and node id in message matched its own node
-                    # id then it would reconnect to ws
-                    logger.info(extra=context_log_meta.get(),
-                                msg=f"subscribe_and_poll_topic_data: reconnecting to ws")
-                    await WS.get_instance().connect()
-                    logger.info(extra=context_log_meta.get(),
-                                msg=f"subscribe_and_poll_topic_data: reconnected to ws")
+                async for message in pubsub.listen():
+                    messages = [message]
+                    while True:
+                        pending_message = await pubsub.get_message(timeout=0)
+                        if not pending_message:
+                            break
+                        messages.append(pending_message)
+                    await SensiUseCase.handle_topic_messages(messages)
             except Exception as e:
-                logger.error(extra=context_log_meta.get(),
-                             msg=f"exception in subscribe_and_poll_to_derivative_data : {e}")
-            finally:
-                # poll every second
-                time.sleep(1)
+                logger.error(extra=context_log_meta.get(), msg=f"exception in consume_topic_data : {e}")
+                # pubsub reconnects and resubscribes on next read , back off while redis is unreachable
+                await asyncio.sleep(1)
 
-    """WS reconnect logic , we would register last ping against node id in redis hashset 
-    worker would keep on checking if last ping is older than 60 seconds , if yes then it would
-    publish a node_id as message on topic TOPIC_FOR_WS_RECONNECT
-     reciever node would check if it's node id matches with message and if yes then it would
-        reconnect to ws"""
+    @staticmethod
+    async def handle_topic_messages(messages: List[dict]):
+        """handle a batch of messages drained from topics , repeated triggers in the batch are handled once"""
+        reconnect_received = False
+        catalog_version = None
+        # price deltas of tokens synced since last refresh need their ids
+        await TokenRegistry.get_instance().refresh_if_pending()
+        for message in messages:
+            channel = message.get("channel")
+            if channel == RedisKeys.TOPIC_FOR_PRICE_DELTA:
+                SensiUseCase.apply_price_delta(message)
+                continue
+            topic_message = TopicMessageModel.parse_message(message.get("data"))
+            if topic_message.published_at:
+                SensiUseCase.topic_latency.setdefault(channel, LatencyStats()).record(
+                    (time.time() - topic_message.published_at) * 1000)
+            if channel == RedisKeys.TOPIC_FOR_WS_RECONNECT and topic_message.data == AppConfig.node_id:
+                reconnect_received = True
+            elif channel == RedisKeys.TOPIC_FOR_INSTRUMENT_CATALOG_VERSION:
+                catalog_version = max(catalog_version or 0, int(topic_message.data))
+        if catalog_version is not None:
+            # ids of synced tokens are assigned before version is bumped , catalog entries reloaded on this version
+            # resolve them
+            await TokenRegistry.get_instance().refresh()
+            InstrumentCatalog.get_instance().set_remote_version(catalog_version)
+        if reconnect_received:
+            # if node instance get a message on topic to reconnect  and node id in message matched its own node
+            # id then it would reconnect to ws
+            # supervisor reconnects in background and replays subscriptions of every connection , so that topic
+            # consumer keeps handling messages while broker is unreachable
+            logger.info(extra=context_log_meta.get(), msg=f"handle_topic_messages: reconnecting to ws")
+            WSReconnectSupervisor.get_instance().request_reconnect(reason="ping timeout")
 
     @staticmethod
-    def check_ws_connection_alive():
-        """check if ws connection is alive """
-        node_id_last_ping_map: dict = Cache.get_instance().hgetall(RedisKeys.LAST_PING_TIME_FROM_WS)
-        current_time = datetime.now()
-        for node_id, last_ping in node_id_last_ping_map.items():
-            if current_time - datetime.fromtimestamp(float(last_ping)) > timedelta(
-                    seconds=BrokerConfig.ws_ping_timeout):
-                logger.error(extra=context_log_meta.get(),
-                             msg=f"check_ws_connection_alive: ws connection is not alive for node_id : {node_id}")
-                Cache.get_instance().publish(RedisKeys.TOPIC_FOR_WS_RECONNECT, node_id)
-                logger.info(extra=context_log_meta.get(),
-                            msg=f"check_ws_connection_alive: published message node id : {node_id} on topic "
-                                f"{RedisKeys.TOPIC_FOR_WS_RECONNECT}")
+    async def get_owned_tokens(connection_index: Optional[int] = None) -> List[str]:
+        """tokens owned by this node , only those partitioned to connection_index if it is given"""
+        owned_tokens: List[str] = list(await AsyncCache.get_instance().smembers(
+            key=RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(AppConfig.node_id)))
+        if connection_index is not None:
+            owned_tokens = [token for token in owned_tokens if
+                            WS.get_instance().get_connection_index(token) == connection_index]
+        return owned_tokens
+
+    @staticmethod
+    async def resubscribe_owned_entities(connection_index: Optional[int] = None):
+        """subscribe tokens owned by this node , to be called after ws connection is (re)established
+        :param connection_index: only tokens partitioned to this connection are subscribed , all if not given"""
+        owned_tokens: List[str] = await SensiUseCase.get_owned_tokens(connection_index)
+        if not owned_tokens:
+            return
+        await SensiUseCase.send_ws_command(BrokerWSCommands.SUBSCRIBE, owned_tokens)
+        logger.info(extra=context_log_meta.get(),
+                    msg=f"resubscribe_owned_entities: subscribed to {len(owned_tokens)} owned tokens from ws "
+                        f"connection : {'all' if connection_index is None else connection_index}")
+
+    @staticmethod
+    async def mark_partition_stale(connection_index: int):
+        """prices of tokens of a broken ws connection stop updating till it is reconnected , streaming clients of
+        every node are told so through the price delta feed"""
+        stale_tokens: List[str] = await SensiUseCase.get_owned_tokens(connection_index)
+        if not stale_tokens:
+            return
+        PriceStreamHub.get_instance().publish_stale(stale_tokens)
+        await AsyncCache.get_instance().publish(RedisKeys.TOPIC_FOR_PRICE_DELTA, PriceDeltaModel(
+            node_id=AppConfig.node_id, updated_at=time.time(), stale=stale_tokens).json())
+        logger.info(extra=context_log_meta.get(),
+                    msg=f"mark_partition_stale: {len(stale_tokens)} tokens of connection {connection_index} are stale")
+
+    @staticmethod
+    async def send_ws_command(command: BrokerWSCommands, tokens: List[str]):
+        """send command for tokens to broker ws in batches , so that a large hand over is not a single huge message
+        every token is sent over the connection of its partition"""
+        for connection_index, connection_tokens in WS.get_instance().partition(tokens).items():
+            for start in range(0, len(connection_tokens), BrokerConfig.ws_command_batch_size):
+                await BrokerIntegration.broker_ws_sender(data=BrokerWSOutgoingMessage(
+                    msg_command=command,
+                    tokens=connection_tokens[start:start + BrokerConfig.ws_command_batch_size]).json(),
+                    connection_index=connection_index)
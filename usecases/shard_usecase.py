@@ -0,0 +1,174 @@
+import time
+from typing import List, Dict, Set, Optional
+
+from config.constants import RedisKeys
+from config.settings import HandoffConfig
+from controller.context_manager import context_log_meta
+from data_adapter.redis import Cache
+from data_adapter.token_registry import TokenRegistry
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import ShardLoadReportModel, HandoffEntryModel, BrokerWSCommands
+from utils.utils import get_rendezvous_owner
+
+
+class ShardUseCase:
+    """ownership of broker ws subscriptions across app nodes
+    every token is owned by a live node picked by rendezvous hashing over live nodes of NODE_IDS_IN_CLUSTER ,
+    NODE_ID_WS_ENTITY_MAPPING:{node_id} is the source of truth of tokens a node owns. Worker writes the mapping and
+    hands tokens over to nodes by appending subscribe / unsubscribe entries to handoff stream NODE_HANDOFF:{node_id}
+    in the same transaction , node acks an entry once it has sent it to broker ws"""
+
+    @staticmethod
+    def get_live_node_ids() -> List[str]:
+        """nodes of NODE_IDS_IN_CLUSTER whose heartbeat has not expired"""
+        node_ids: List[str] = Cache.get_instance().hkeys(RedisKeys.NODE_IDS_IN_CLUSTER)
+        heartbeats: List[Optional[str]] = Cache.get_instance().mget(
+            [RedisKeys.NODE_HEARTBEAT.format(node_id) for node_id in node_ids])
+        return sorted(node_id for node_id, heartbeat in zip(node_ids, heartbeats) if heartbeat is not None)
+
+    @staticmethod
+    def assign_tokens(tokens: List[str]) -> Dict[str, int]:
+        """assign newly synced tokens to their owner nodes
+        :return number of tokens assigned to each node"""
+        live_node_ids = ShardUseCase.get_live_node_ids()
+        if not live_node_ids:
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"assign_tokens: no live node , {len(tokens)} tokens kept for next rebalance")
+            Cache.get_instance().sadd(RedisKeys.UNASSIGNED_ENTITY_TOKENS, values=tokens)
+            return {}
+        tokens_by_node: Dict[str, List[str]] = {}
+        for token in tokens:
+            tokens_by_node.setdefault(get_rendezvous_owner(token, live_node_ids), []).append(token)
+        for node_id, node_tokens in tokens_by_node.items():
+            ShardUseCase.hand_over_tokens(node_id, tokens_to_subscribe=node_tokens)
+        return {node_id: len(node_tokens) for node_id, node_tokens in tokens_by_node.items()}
+
+    @staticmethod
+    def unassign_tokens(tokens: List[str]) -> Dict[str, int]:
+        """take tokens away from the nodes owning them , eg instruments deleted by sync or expired , owner node
+        unsubscribes them from broker ws
+        :return number of tokens unassigned from each node"""
+        token_set: Set[str] = set(tokens)
+        tokens_by_node: Dict[str, int] = {}
+        for node_id in Cache.get_instance().hkeys(RedisKeys.NODE_IDS_IN_CLUSTER):
+            node_tokens = list(Cache.get_instance().smembers(
+                RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(node_id)) & token_set)
+            if not node_tokens:
+                continue
+            # a token still waiting in the handoff stream to be subscribed is subscribed and unsubscribed in order
+            ShardUseCase.hand_over_tokens(node_id, tokens_to_unsubscribe=node_tokens)
+            tokens_by_node[node_id] = len(node_tokens)
+        # tokens synced while no node was live are not assigned on next rebalance either
+        Cache.get_instance().srem(RedisKeys.UNASSIGNED_ENTITY_TOKENS, values=tokens)
+        return tokens_by_node
+
+    @staticmethod
+    def hand_over_tokens(node_id: str, tokens_to_subscribe: List[str] = None, tokens_to_unsubscribe: List[str] = None):
+        """update mapping of node and ask node to subscribe / unsubscribe tokens from broker ws
+        mapping and handoff entries are written in one transaction , node handles entries in the order they were
+        appended so that a token subscribed and later unsubscribed ends up unsubscribed"""
+        mapping_key = RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(node_id)
+        stream_key = RedisKeys.NODE_HANDOFF.format(node_id)
+        if tokens_to_subscribe:
+            Cache.get_instance().xadd_and_update_set(
+                stream_key=stream_key, entries=ShardUseCase.build_handoff_entries(
+                    BrokerWSCommands.SUBSCRIBE, tokens_to_subscribe), key=mapping_key,
+                values_to_add=tokens_to_subscribe)
+        if tokens_to_unsubscribe:
+            Cache.get_instance().xadd_and_update_set(
+                stream_key=stream_key, entries=ShardUseCase.build_handoff_entries(
+                    BrokerWSCommands.UNSUBSCRIBE, tokens_to_unsubscribe), key=mapping_key,
+                values_to_remove=tokens_to_unsubscribe)
+
+    @staticmethod
+    def build_handoff_entries(command: BrokerWSCommands, tokens: List[str]) -> List[dict]:
+        """handoff stream entries of HANDOFF_ENTRY_SIZE tokens each"""
+        published_at = time.time()
+        return [HandoffEntryModel(command=command, tokens=tokens[start:start + HandoffConfig.entry_size],
+                                  published_at=published_at).build_entry()
+                for start in range(0, len(tokens), HandoffConfig.entry_size)]
+
+    @staticmethod
+    def rebalance() -> GenericResponseModel:
+        """
+        move tokens whose owner changed because nodes joined or died , only tokens of joined / dead nodes move
+        :return GenericResponseModel: payload is ShardLoadReportModel
+        """
+        try:
+            node_ids: List[str] = Cache.get_instance().hkeys(RedisKeys.NODE_IDS_IN_CLUSTER)
+            live_node_ids: List[str] = ShardUseCase.get_live_node_ids()
+            if not live_node_ids:
+                logger.error(extra=context_log_meta.get(), msg=f"rebalance: no live node to assign tokens to")
+                return GenericResponseModel(success=False)
+            tokens_to_subscribe: Dict[str, List[str]] = {}
+            tokens_to_unsubscribe: Dict[str, List[str]] = {}
+            tokens_by_node: Dict[str, Set[str]] = {node_id: Cache.get_instance().smembers(
+                RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(node_id)) for node_id in node_ids}
+            owned_tokens: List[str] = [token for node_tokens in tokens_by_node.values() for token in node_tokens]
+            if Cache.get_instance().hlen(RedisKeys.TOKEN_IDS) < len(owned_tokens):
+                # tokens synced before they were given ids at sync time
+                TokenRegistry.get_instance().assign_ids(owned_tokens)
+            for node_id, node_tokens in tokens_by_node.items():
+                for token in node_tokens:
+                    owner_node_id = get_rendezvous_owner(token, live_node_ids)
+                    if owner_node_id != node_id:
+                        tokens_to_unsubscribe.setdefault(node_id, []).append(token)
+                        tokens_to_subscribe.setdefault(owner_node_id, []).append(token)
+            for token in Cache.get_instance().smembers_and_delete(RedisKeys.UNASSIGNED_ENTITY_TOKENS):
+                tokens_to_subscribe.setdefault(get_rendezvous_owner(token, live_node_ids), []).append(token)
+            # new owner subscribes before old owner unsubscribes , so that ticks of a moved token are not missed
+            for node_id, node_tokens in tokens_to_subscribe.items():
+                ShardUseCase.hand_over_tokens(node_id, tokens_to_subscribe=node_tokens)
+            for node_id, node_tokens in tokens_to_unsubscribe.items():
+                ShardUseCase.hand_over_tokens(node_id, tokens_to_unsubscribe=node_tokens)
+            dead_node_ids: List[str] = [node_id for node_id in node_ids if node_id not in live_node_ids]
+            if dead_node_ids:
+                ShardUseCase.remove_dead_nodes(dead_node_ids)
+            report = ShardUseCase.build_load_report(live_node_ids)
+            report.moved = sum(len(node_tokens) for node_tokens in tokens_to_subscribe.values())
+            logger.info(extra=context_log_meta.get(), msg=f"rebalance: report : {report.json()}")
+            return GenericResponseModel(success=True, payload=report)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in rebalance error : {e}")
+            return GenericResponseModel(success=False)
+
+    @staticmethod
+    def take_over_dead_nodes(dead_node_ids: List[str]) -> Dict[str, int]:
+        """move tokens of dead nodes to live nodes and forget dead nodes , without waiting for next rebalance
+        tokens of live nodes do not move , rendezvous owner of a token changes only when its owner leaves
+        :return number of tokens moved to each node"""
+        # a dead node started again with the same id may be live by now , it is forgotten all the same (and
+        # registers again) so none of the tokens are handed to it
+        live_node_ids: List[str] = [node_id for node_id in ShardUseCase.get_live_node_ids() if
+                                    node_id not in dead_node_ids]
+        if not live_node_ids:
+            logger.error(extra=context_log_meta.get(), msg=f"take_over_dead_nodes: no live node to move tokens to")
+            return {}
+        tokens_by_node: Dict[str, List[str]] = {}
+        for dead_node_id in dead_node_ids:
+            for token in Cache.get_instance().smembers(RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(dead_node_id)):
+                tokens_by_node.setdefault(get_rendezvous_owner(token, live_node_ids), []).append(token)
+        for node_id, node_tokens in tokens_by_node.items():
+            ShardUseCase.hand_over_tokens(node_id, tokens_to_subscribe=node_tokens)
+        ShardUseCase.remove_dead_nodes(dead_node_ids)
+        return {node_id: len(node_tokens) for node_id, node_tokens in tokens_by_node.items()}
+
+    @staticmethod
+    def remove_dead_nodes(dead_node_ids: List[str]):
+        """forget nodes whose tokens have been moved , a node that comes back registers itself again on startup
+        handoff stream of a dead node goes with it , tokens of its pending entries are already in its mapping"""
+        logger.info(extra=context_log_meta.get(), msg=f"remove_dead_nodes: removing dead nodes : {dead_node_ids}")
+        Cache.get_instance().hdel(RedisKeys.NODE_IDS_IN_CLUSTER, fields=dead_node_ids)
+        Cache.get_instance().delete([key.format(node_id) for node_id in dead_node_ids for key in (
+            RedisKeys.NODE_ID_WS_ENTITY_MAPPING, RedisKeys.NODE_HANDOFF)])
+
+    @staticmethod
+    def build_load_report(live_node_ids: List[str]) -> ShardLoadReportModel:
+        """tokens owned by every live node , max_to_mean close to 1 means subscriptions are balanced"""
+        tokens_by_node: Dict[str, int] = {node_id: Cache.get_instance().scard(
+            RedisKeys.NODE_ID_WS_ENTITY_MAPPING.format(node_id)) for node_id in live_node_ids}
+        mean_tokens = sum(tokens_by_node.values()) / len(tokens_by_node) if tokens_by_node else 0
+        return ShardLoadReportModel(live_nodes=len(live_node_ids), tokens_by_node=tokens_by_node,
+                                    max_to_mean=round(max(tokens_by_node.values()) / mean_tokens, 3) if
+                                    mean_tokens else 0.0)
@@ -0,0 +1,61 @@
+import time
+from typing import List, Optional
+
+from config.constants import RedisKeys
+from config.settings import AppConfig, PriceStalenessConfig
+from controller.context_manager import context_log_meta
+from data_adapter.redis import Cache
+from logger import logger
+from models.base import GenericResponseModel
+from models.sensi_models import PriceDeltaModel, StalePriceScanReportModel
+
+# flags tokens whose last update falls between previous cutoff and this one , so a scan reads only tokens that went
+# stale since previous scan. Tokens that tick again are removed from the stale set by tick writer and get a newer
+# update time , so they are flagged again only if they go stale again
+FLAG_STALE_PRICES_SCRIPT = """
+local unpack = table.unpack or unpack
+local last_cutoff = redis.call('GET', KEYS[3])
+if last_cutoff and tonumber(ARGV[1]) <= tonumber(last_cutoff) then
+    return {}
+end
+local min_score = last_cutoff and ('(' .. last_cutoff) or '-inf'
+local tokens = redis.call('ZRANGEBYSCORE', KEYS[1], min_score, ARGV[1])
+for i = 1, #tokens, 1000 do
+    redis.call('SADD', KEYS[2], unpack(tokens, i, math.min(i + 999, #tokens)))
+end
+redis.call('SET', KEYS[3], ARGV[1])
+return tokens
+"""
+
+
+class StalenessUseCase:
+    """staleness of prices
+    tick writer keeps update time of every token in sorted set ENTITY_PRICE_UPDATED_AT , scan flags tokens with no
+    tick in PRICE_STALE_AFTER_SEC into STALE_ENTITY_TOKENS and tells streaming clients of every node about them
+    through the price delta feed"""
+
+    @staticmethod
+    def flag_stale_prices() -> GenericResponseModel:
+        """
+        Flag tokens that went stale since previous scan , cost grows with tokens that went stale and not with tokens
+        tracked
+        :return GenericResponseModel: payload is StalePriceScanReportModel
+        """
+        try:
+            report = StalePriceScanReportModel(cutoff=round(time.time() - PriceStalenessConfig.stale_after_sec, 3))
+            stale_tokens: Optional[List[str]] = Cache.get_instance().run_script(
+                FLAG_STALE_PRICES_SCRIPT,
+                keys=[RedisKeys.ENTITY_PRICE_UPDATED_AT, RedisKeys.STALE_ENTITY_TOKENS,
+                      RedisKeys.STALE_PRICE_SCAN_CUTOFF], args=[report.cutoff])
+            if stale_tokens is None:
+                return GenericResponseModel(success=False, payload="Could not scan price update times")
+            report.newly_stale = len(stale_tokens)
+            if stale_tokens:
+                Cache.get_instance().publish(RedisKeys.TOPIC_FOR_PRICE_DELTA, PriceDeltaModel(
+                    node_id=AppConfig.node_id, updated_at=time.time(), stale=stale_tokens).json())
+            report.stale = Cache.get_instance().scard(RedisKeys.STALE_ENTITY_TOKENS)
+            logger.info(extra=context_log_meta.get(), msg=f"flag_stale_prices: report : {report.json()}")
+            return GenericResponseModel(success=True, payload=report)
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in flag_stale_prices error : {e}")
+            return GenericResponseModel(success=False)
@@ -0,0 +1,108 @@
+"""black scholes implied volatility and greeks of european options over numpy arrays
+every function takes arrays of same length (one element per option) so that a whole option chain is solved with a
+few array operations instead of a python loop per strike. Elements that can not be solved are nan."""
+from typing import Dict
+
+import numpy as np
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+MIN_VOLATILITY = 1e-4
+MAX_VOLATILITY = 5.0
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """standard normal cdf , abramowitz stegun 7.1.26 erf approximation (max error 1.5e-7) as numpy has no erf"""
+    z = np.abs(x) / np.sqrt(2)
+    t = 1 / (1 + 0.3275911 * z)
+    erf = 1 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t * \
+        np.exp(-z * z)
+    return 0.5 * (1 + np.sign(x) * erf)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def d1_d2(spot: np.ndarray, strike: np.ndarray, years: np.ndarray, volatility: np.ndarray, rate: float):
+    volatility_sqrt_years = volatility * np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * volatility * volatility) * years) / volatility_sqrt_years
+    return d1, d1 - volatility_sqrt_years
+
+
+def option_price(spot: np.ndarray, strike: np.ndarray, years: np.ndarray, volatility: np.ndarray,
+                 is_call: np.ndarray, rate: float) -> np.ndarray:
+    d1, d2 = d1_d2(spot, strike, years, volatility, rate)
+    discounted_strike = strike * np.exp(-rate * years)
+    call = spot * norm_cdf(d1) - discounted_strike * norm_cdf(d2)
+    # put from put call parity
+    return np.where(is_call, call, call - spot + discounted_strike)
+
+
+def initial_volatility(price: np.ndarray, spot: np.ndarray, strike: np.ndarray, years: np.ndarray,
+                       is_call: np.ndarray, rate: float) -> np.ndarray:
+    """corrado miller closed form approximation of implied volatility , starting point of newton steps close enough
+    to the root that most strikes converge in a few steps"""
+    discounted_strike = strike * np.exp(-rate * years)
+    # put is solved as the call of same strike , both have the same implied volatility by put call parity
+    call_price = np.where(is_call, price, price + spot - discounted_strike)
+    half_moneyness = (spot - discounted_strike) / 2
+    root = np.sqrt(np.maximum((call_price - half_moneyness) ** 2 - (spot - discounted_strike) ** 2 / np.pi, 0))
+    volatility = np.sqrt(2 * np.pi / years) / (spot + discounted_strike) * (call_price - half_moneyness + root)
+    return np.clip(np.where(np.isfinite(volatility) & (volatility > 0), volatility, 0.3), MIN_VOLATILITY,
+                   MAX_VOLATILITY)
+
+
+def implied_volatility(price: np.ndarray, spot: np.ndarray, strike: np.ndarray, years: np.ndarray,
+                       is_call: np.ndarray, rate: float, max_iterations: int = 50,
+                       tolerance: float = 1e-6) -> np.ndarray:
+    """volatility at which black scholes price matches price , newton steps safeguarded by a bisection bracket
+    an element whose newton step leaves its bracket takes the bracket midpoint instead , so every element converges
+    even for deep in / out of the money strikes where vega is tiny
+    :return nan for prices outside no arbitrage bounds or options already expired"""
+    discounted_strike = strike * np.exp(-rate * years)
+    lower_bound = np.where(is_call, np.maximum(spot - discounted_strike, 0), np.maximum(discounted_strike - spot, 0))
+    upper_bound = np.where(is_call, spot, discounted_strike)
+    solvable = (years > 0) & (price > lower_bound) & (price < upper_bound) & np.isfinite(price)
+    low = np.full(price.shape, MIN_VOLATILITY)
+    high = np.full(price.shape, MAX_VOLATILITY)
+    # values of unsolvable elements are masked at the end , placeholders keep the arithmetic free of warnings
+    price, spot, strike = np.where(solvable, price, 1.0), np.where(solvable, spot, 1.0), np.where(solvable, strike, 1.0)
+    years = np.where(solvable, years, 1.0)
+    volatility = initial_volatility(price, spot, strike, years, is_call, rate)
+    converged = ~solvable
+    for _ in range(max_iterations):
+        difference = option_price(spot, strike, years, volatility, is_call, rate) - price
+        converged |= np.abs(difference) < tolerance
+        if converged.all():
+            break
+        # price increases with volatility , so the sign of difference tells which side of the root volatility is
+        high = np.where(~converged & (difference > 0), volatility, high)
+        low = np.where(~converged & (difference < 0), volatility, low)
+        d1, _ = d1_d2(spot, strike, years, volatility, rate)
+        vega = spot * norm_pdf(d1) * np.sqrt(years)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = volatility - difference / vega
+        newton = np.where((newton > low) & (newton < high), newton, (low + high) / 2)
+        # far out of the money prices are too small for a price tolerance , those stop once volatility stops moving
+        converged |= np.abs(newton - volatility) < tolerance
+        volatility = np.where(converged, volatility, newton)
+    return np.where(solvable & converged, volatility, np.nan)
+
+
+def greeks(spot: np.ndarray, strike: np.ndarray, years: np.ndarray, volatility: np.ndarray, is_call: np.ndarray,
+           rate: float) -> Dict[str, np.ndarray]:
+    """delta , gamma , theta (per calendar day) and vega (per 1 percentage point of volatility)
+    nan wherever volatility is nan"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_years = np.sqrt(years)
+        d1, d2 = d1_d2(spot, strike, years, volatility, rate)
+        pdf_d1 = norm_pdf(d1)
+        discounted_strike = strike * np.exp(-rate * years)
+        decay = -spot * pdf_d1 * volatility / (2 * sqrt_years)
+        return {
+            "delta": np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1),
+            "gamma": pdf_d1 / (spot * volatility * sqrt_years),
+            "theta": np.where(is_call, decay - rate * discounted_strike * norm_cdf(d2),
+                              decay + rate * discounted_strike * norm_cdf(-d2)) / 365,
+            "vega": spot * pdf_d1 * sqrt_years / 100,
+        }
@@ -1,7 +1,16 @@
+import asyncio
+import hashlib
 import http
+import random
+import time
+from collections import deque
+from typing import Dict, List
+from urllib.parse import urlsplit
 
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+import httpx
+import orjson
 import requests
 from controller.context_manager import context_log_meta
 from logger import logger
@@ -23,6 +32,29 @@ def build_api_response(generic_response: GenericResponseModel) -> JSONResponse:
         return JSONResponse(status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR, content=response_json)
 
 
+def build_encoded_api_response(generic_response: GenericResponseModel) -> Response:
+    """build response from payload pre-encoded as json (EncodedPayloadModel) , skips jsonable_encoder and
+    JSONResponse encoding. Responds 304 when client already has the snapshot identified by etag"""
+    try:
+        if not generic_response.success:
+            return build_api_response(generic_response)
+        encoded_payload = generic_response.payload
+        if encoded_payload.body is None:
+            return Response(status_code=http.HTTPStatus.NOT_MODIFIED, headers={"ETag": encoded_payload.etag})
+        res = Response(status_code=http.HTTPStatus.OK, media_type="application/json",
+                       headers={"ETag": encoded_payload.etag},
+                       content=b'{"success":true,"payload":' + encoded_payload.body + (
+                           b',"next_cursor":' + orjson.dumps(encoded_payload.next_cursor) if
+                           encoded_payload.next_cursor else b'') + b'}')
+        logger.info(extra=context_log_meta.get(),
+                    msg="build_encoded_api_response: Generated Response with status_code: 200")
+        return res
+    except Exception as e:
+        logger.error(extra=context_log_meta.get(), msg=f"exception in build_encoded_api_response error : {e}")
+        response_json = jsonable_encoder(GenericResponseModel(success=False))
+        return JSONResponse(status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR, content=response_json)
+
+
 def make_request(external_service_url, request_params: dict = None, method='GET', headers=None) -> (dict, int):
     try:
         request_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
@@ -40,6 +72,105 @@ def make_request(external_service_url, request_params: dict = None, method='GET'
         return {}, 500
 
 
+def build_payload_hash(payload) -> str:
+    """content hash of json serializable payload , key order of dicts does not change the hash"""
+    return hashlib.blake2b(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+def get_rendezvous_owner(key: str, node_ids: List[str]) -> str:
+    """rendezvous (highest random weight) hashing , node with highest hash of node id and key owns the key
+    when a node joins or leaves only keys owned by that node change owner"""
+    return max(node_ids, key=lambda node_id: hashlib.blake2b(f"{node_id}:{key}".encode(), digest_size=8).digest())
+
+
+class HostRateLimiter:
+    """spaces out requests so that at most rate_per_sec requests are started per second to a host
+    meant to be shared by coroutines of a single event loop"""
+
+    def __init__(self, rate_per_sec: int):
+        self.__interval = 1 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self.__next_slot_by_host: Dict[str, float] = {}
+
+    async def acquire(self, host: str) -> None:
+        now = time.monotonic()
+        slot = max(now, self.__next_slot_by_host.get(host, now))
+        self.__next_slot_by_host[host] = slot + self.__interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == http.HTTPStatus.TOO_MANY_REQUESTS or status_code >= http.HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+async def make_async_request(client: httpx.AsyncClient, external_service_url, rate_limiter: HostRateLimiter,
+                             max_retries: int = 0, backoff_base_ms: int = 0, request_params: dict = None,
+                             method='GET', headers=None) -> (dict, int):
+    """async counterpart of make_request , client is shared across requests so connections are kept alive
+    timeouts , connection errors , 429 and 5xx responses are retried with exponential backoff and jitter"""
+    request_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+    if headers is not None:
+        request_headers.update(headers)
+    host = urlsplit(external_service_url).netloc
+    result_response, status_code = {}, 500
+    for attempt in range(max_retries + 1):
+        if attempt:
+            backoff_ms = backoff_base_ms * (2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(backoff_ms / 2, backoff_ms) / 1000)
+        await rate_limiter.acquire(host)
+        try:
+            response = await client.request(method=method, url=external_service_url, params=request_params,
+                                            headers=request_headers)
+            status_code = response.status_code
+            if is_retryable_status(status_code):
+                logger.error(extra=context_log_meta.get(),
+                             msg=f"make_async_request: attempt {attempt + 1} to {external_service_url} failed"
+                                 f" with status_code: {status_code}")
+                continue
+            result_response = response.json()
+            logger.debug(extra=context_log_meta.get(),
+                         msg=f"make_async_request: Successfully made request to external service: "
+                             f"{external_service_url} with status_code: {status_code}")
+            return result_response, status_code
+        except httpx.TransportError as e:
+            status_code = 500
+            logger.error(extra=context_log_meta.get(),
+                         msg=f"make_async_request: attempt {attempt + 1} to {external_service_url} failed : {e}")
+        except Exception as e:
+            logger.error(extra=context_log_meta.get(), msg=f"exception in make_async_request error : {e}")
+            return {}, 500
+    return result_response, status_code
+
+
+class LatencyStats:
+    """running latency counters , percentiles are computed over the most recent samples only"""
+
+    def __init__(self, window: int = 1000):
+        self.__samples_ms = deque(maxlen=window)
+        self.__count = 0
+        self.__total_ms = 0.0
+        self.__max_ms = 0.0
+
+    def record(self, latency_ms: float) -> None:
+        self.__samples_ms.append(latency_ms)
+        self.__count += 1
+        self.__total_ms += latency_ms
+        self.__max_ms = max(self.__max_ms, latency_ms)
+
+    def get_stats(self) -> dict:
+        if not self.__count:
+            return {"count": 0}
+        recent = sorted(self.__samples_ms)
+        return {
+            "count": self.__count,
+            "last_ms": round(self.__samples_ms[-1], 3),
+            "avg_ms": round(self.__total_ms / self.__count, 3),
+            "p50_ms": round(recent[int(len(recent) * 0.50)], 3),
+            "p99_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 3),
+            "max_ms": round(self.__max_ms, 3),
+        }
+
+
 class Singleton:
     """Implementation of singleton design pattern
     This is a singleton class which is used to get the instance of the class which is decorated with this class"""
@@ -1,7 +1,8 @@
 from config.settings import CELERY
 from worker.celery import celery_app
 
-from worker.task_worker import trigger_underlyings_sync, trigger_derivatives_sync, check_ws_connection_alive
+from worker.task_worker import trigger_underlyings_sync, trigger_derivatives_sync, \
+    trigger_expired_derivatives_purge, trigger_ws_rebalance, trigger_stale_price_scan
 
 
 @celery_app.on_after_configure.connect
@@ -12,5 +13,9 @@ def setup_periodic_tasks(sender, **kwargs):
                              name='trigger_underlyings_sync')
     sender.add_periodic_task(CELERY.trigger_freqn_for_derivative, trigger_derivatives_sync,
                              name='trigger_derivatives_sync')
-    sender.add_periodic_task(CELERY.trigger_freqn_for_ws_connection, check_ws_connection_alive,
-                             name='check_ws_connection_alive')
+    sender.add_periodic_task(CELERY.trigger_freqn_for_expiry_purge, trigger_expired_derivatives_purge,
+                             name='trigger_expired_derivatives_purge')
+    sender.add_periodic_task(CELERY.trigger_freqn_for_ws_rebalance, trigger_ws_rebalance,
+                             name='trigger_ws_rebalance')
+    sender.add_periodic_task(CELERY.trigger_freqn_for_stale_price_scan, trigger_stale_price_scan,
+                             name='trigger_stale_price_scan')
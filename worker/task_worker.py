@@ -2,7 +2,11 @@ from controller.context_manager import context_log_meta, build_non_request_conte
 from logger import logger
 from models.base import GenericResponseModel
 from worker.celery import celery_app, SQLAlchemyTask
+from usecases.derivative_sync_usecase import DerivativeSyncUseCase
+from usecases.expiry_usecase import ExpiryUseCase
 from usecases.sensi_usecase import SensiUseCase
+from usecases.shard_usecase import ShardUseCase
+from usecases.staleness_usecase import StalenessUseCase
 
 """command to run worker - 'celery -A worker.task_worker worker -B'"""
 
@@ -28,7 +32,7 @@ def trigger_derivatives_sync() -> GenericResponseModel:
     Internally this would call the usecase as usecase has business logic to sync derivatives """
     logger.info(extra=context_log_meta.get(), msg="trigger_derivatives_sync: Triggered")
     build_non_request_context()
-    response: GenericResponseModel = SensiUseCase().sync_derivatives_data()
+    response: GenericResponseModel = DerivativeSyncUseCase().sync_derivatives_data()
     if not response.success:
         logger.error(extra=context_log_meta.get(),
                      msg=f"trigger_derivatives_sync: Error in syncing derivatives data from broker")
@@ -37,16 +41,42 @@ def trigger_derivatives_sync() -> GenericResponseModel:
     return response
 
 
-@celery_app.task
-def check_ws_connection_alive():
-    """ This is a celery task which is triggered by scheduler to check if websocket connection is alive
-    If not alive, it would try to reconnect """
-    logger.info(extra=context_log_meta.get(), msg="check_ws_connection_alive: Triggered")
+@celery_app.task(base=SQLAlchemyTask)
+def trigger_expired_derivatives_purge() -> GenericResponseModel:
+    """ This is a celery task which is triggered by scheduler to purge expired derivatives
+    Internally this would call the usecase as usecase has business logic to purge expired derivatives """
+    logger.info(extra=context_log_meta.get(), msg="trigger_expired_derivatives_purge: Triggered")
     build_non_request_context()
-    response: GenericResponseModel = SensiUseCase().check_ws_connection_alive()
+    response: GenericResponseModel = ExpiryUseCase.purge_expired_derivatives()
     if not response.success:
         logger.error(extra=context_log_meta.get(),
-                     msg=f"check_ws_connection_alive: Error in checking websocket connection alive")
+                     msg=f"trigger_expired_derivatives_purge: Error in purging expired derivatives")
     logger.info(extra=context_log_meta.get(),
-                msg="check_ws_connection_alive: Checking websocket connection alive completed")
+                msg="trigger_expired_derivatives_purge: Purging expired derivatives completed")
+    return response
+
+
+@celery_app.task
+def trigger_ws_rebalance() -> GenericResponseModel:
+    """ This is a celery task which is triggered by scheduler to move ws subscriptions of joined / dead nodes
+    Internally this would call the usecase as usecase has business logic of token ownership """
+    logger.info(extra=context_log_meta.get(), msg="trigger_ws_rebalance: Triggered")
+    build_non_request_context()
+    response: GenericResponseModel = ShardUseCase.rebalance()
+    if not response.success:
+        logger.error(extra=context_log_meta.get(), msg=f"trigger_ws_rebalance: Error in rebalancing ws subscriptions")
+    logger.info(extra=context_log_meta.get(), msg="trigger_ws_rebalance: Rebalancing ws subscriptions completed")
+    return response
+
+
+@celery_app.task
+def trigger_stale_price_scan() -> GenericResponseModel:
+    """ This is a celery task which is triggered by scheduler to flag prices with no tick for a while
+    Internally this would call the usecase as usecase has business logic of price staleness """
+    logger.info(extra=context_log_meta.get(), msg="trigger_stale_price_scan: Triggered")
+    build_non_request_context()
+    response: GenericResponseModel = StalenessUseCase.flag_stale_prices()
+    if not response.success:
+        logger.error(extra=context_log_meta.get(), msg=f"trigger_stale_price_scan: Error in flagging stale prices")
+    logger.info(extra=context_log_meta.get(), msg="trigger_stale_price_scan: Flagging stale prices completed")
     return response